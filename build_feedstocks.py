@@ -0,0 +1,402 @@
+#!/usr/bin/env python3
+
+# Builds the feedstocks of this repository, and the RAPIDS recipes that need
+# them, in dependency order instead of one after another by hand.
+#
+# Packages whose dependencies are built run concurrently (cudatoolkit, nvcc
+# and dlpack need nothing from each other). Every package gets a hash of its
+# recipe directory, variant config, build command and the hashes of its
+# dependencies; a package whose hash matches the one recorded when its
+# artifacts were last put in the local channel, and whose artifacts are all
+# still there, is not built again. At the end the critical path, the chain
+# of dependent builds that bounds the total time, is reported.
+#
+#   python build_feedstocks.py --channel ~/rapids-l4t-channel -j 3
+#   python build_feedstocks.py --rmm-dir ~/src/rmm --cudf-dir ~/src/cudf cudf
+#   python build_feedstocks.py --dry-run
+#
+# --dry-run needs neither conda nor docker: it works out what would be
+# skipped or built and plays the schedule out on the durations of previous
+# builds.
+
+
+import hashlib
+import heapq
+import json
+import os
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from argparse import ArgumentParser
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+STATE_FILE = 'rapids_l4t_builds.json'
+# files of a recipe directory that are not inputs of the build, when it
+# is not in a git checkout that tells them apart
+IGNORED = ('__pycache__', '.git', '.pyc', '.pyo', '.pytest_cache',
+           '.benchmarks', '.mypy_cache', '.tox')
+
+
+class Package(object):
+    # one conda build: recipe is relative to root, config is the variant
+    # file passed with -m, relative to cwd
+
+    def __init__(self, name, root, recipe, deps=(), config=None, env=None,
+                 estimate=600):
+        self.name = name
+        self.root = root
+        self.recipe = recipe
+        self.deps = list(deps)
+        self.config = config
+        self.env = env or {}
+        # guess of the build time in seconds, until one has been recorded
+        self.estimate = estimate
+
+    def command(self, output, croot, channel):
+        cmd = ['conda', 'build', '--output-folder', output, '--croot', croot,
+               '-c', channel]
+        if self.config:
+            cmd += ['-m', self.config]
+        return cmd + [self.recipe]
+
+    def inputs_hash(self, dep_hashes):
+        # every file of the recipe, the variant config, the environment
+        # and the dependencies' hashes
+        h = hashlib.sha256()
+        recipe = os.path.join(self.root, self.recipe)
+        for relpath in recipe_files(recipe):
+            h.update(relpath.encode() + b'\0')
+            with open(os.path.join(recipe, relpath), 'rb') as f:
+                h.update(hashlib.sha256(f.read()).digest())
+        if self.config:
+            with open(os.path.join(self.root, self.config), 'rb') as f:
+                h.update(b'config\0' + f.read())
+        h.update(json.dumps([self.recipe, self.config, sorted(self.env.items()),
+                             sorted(dep_hashes.items())]).encode())
+        return h.hexdigest()
+
+
+def recipe_files(recipe):
+    # The paths relative to recipe of the files below it that git tracks,
+    # or would track once added, so that tool output such as pytest's
+    # cache is not an input, less the IGNORED ones. Outside of a git
+    # checkout, every file but the IGNORED ones.
+    try:
+        out = subprocess.check_output(
+            ['git', 'ls-files', '-z', '--cached', '--others', '--exclude-standard'],
+            cwd=recipe, stderr=subprocess.DEVNULL)
+        names = [x for x in out.decode().split('\0') if x]
+    except (OSError, subprocess.CalledProcessError):
+        names = []
+        for path, dirs, files in os.walk(recipe):
+            names += [os.path.relpath(os.path.join(path, x), recipe).replace(os.sep, '/')
+                      for x in files]
+    # deleted files stay in the index until the deletion is staged
+    return sorted(set(
+        x for x in names
+        if not x.endswith(IGNORED) and not any(d in IGNORED for d in x.split('/')[:-1])
+        and os.path.isfile(os.path.join(recipe, x))))
+
+
+def feedstock_packages():
+    return [
+        Package('cudatoolkit', HERE, 'cudatoolkit-feedstock', estimate=300),
+        Package('nvcc', os.path.join(HERE, 'nvcc-feedstock'), 'recipe',
+                config='.ci_support/linux_cuda_compiler_version10.2target_platformlinux-aarch64.yaml',
+                estimate=120),
+        Package('dlpack', os.path.join(HERE, 'dlpack-feedstock'), 'recipe',
+                config='.ci_support/linux_aarch64_.yaml', estimate=60),
+        Package('arrow-cpp', os.path.join(HERE, 'arrow-cpp-feedstock'), 'recipe',
+                deps=['cudatoolkit', 'nvcc'],
+                config='.ci_support/linux_aarch64_cuda_compiler_version10.2numpy1.17python3.7.____cpython.yaml',
+                estimate=3 * 3600),
+    ]
+
+
+def rapids_packages(rmm_dir, cudf_dir, rmm_parallel_level, parallel_level):
+    # the recipes of the rmm and cudf checkouts, built as in the README
+    packages = []
+    if rmm_dir:
+        env = {'CUDA_VERSION': '10.2', 'PARALLEL_LEVEL': str(rmm_parallel_level)}
+        recipes = os.path.join(rmm_dir, 'conda', 'recipes')
+        packages += [
+            Package('librmm', recipes, 'librmm', deps=['cudatoolkit', 'nvcc'],
+                    env=env, estimate=900),
+            Package('rmm', recipes, 'rmm', deps=['librmm'], env=env, estimate=900),
+        ]
+    if cudf_dir:
+        env = {'CUDA_VERSION': '10.2', 'PARALLEL_LEVEL': str(parallel_level)}
+        recipes = os.path.join(cudf_dir, 'conda', 'recipes')
+        packages += [
+            Package('libcudf', recipes, 'libcudf',
+                    deps=['librmm', 'arrow-cpp', 'dlpack'], env=env,
+                    estimate=8 * 3600),
+            Package('cudf', recipes, 'cudf', deps=['libcudf', 'rmm'], env=env,
+                    estimate=2 * 3600),
+        ]
+    return packages
+
+
+def select(packages, targets):
+    # the targets and everything they depend on, in dependency order
+    by_name = {x.name: x for x in packages}
+    order = []
+    state = {}
+
+    def visit(name, chain):
+        if name not in by_name:
+            raise SystemExit('%s needs %s, which is not configured (see --help)'
+                             % (chain[-1] if chain else 'target', name))
+        if state.get(name) == 'done':
+            return
+        if state.get(name) == 'visiting':
+            raise SystemExit('dependency cycle: %s' % ' -> '.join(chain + [name]))
+        state[name] = 'visiting'
+        for dep in by_name[name].deps:
+            visit(dep, chain + [name])
+        state[name] = 'done'
+        order.append(by_name[name])
+
+    for name in targets or [x.name for x in packages]:
+        visit(name, [])
+    return order
+
+
+def load_state(channel):
+    path = os.path.join(channel, STATE_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_state(channel, state):
+    with open(os.path.join(channel, STATE_FILE), 'w') as f:
+        json.dump(state, f, indent=1, sort_keys=True)
+
+
+def plan(order, state):
+    # hashes of every package and whether it is up to date in the channel
+    hashes = {}
+    up_to_date = {}
+    for package in order:
+        hashes[package.name] = package.inputs_hash(
+            {x: hashes[x] for x in package.deps})
+        recorded = state.get(package.name, {})
+        up_to_date[package.name] = (
+            recorded.get('hash') == hashes[package.name] and
+            bool(recorded.get('artifacts')) and
+            all(os.path.exists(x) for x in recorded['artifacts']))
+    return hashes, up_to_date
+
+
+def critical_path(order, durations):
+    # the chain of dependent packages with the longest total duration
+    finish = {}
+    previous = {}
+    for package in order:
+        start = 0.0
+        for dep in package.deps:
+            if finish[dep] > start:
+                start, previous[package.name] = finish[dep], dep
+        finish[package.name] = start + durations[package.name]
+    name = max(finish, key=finish.get)
+    path = [name]
+    while path[-1] in previous:
+        path.append(previous[path[-1]])
+    return list(reversed(path)), finish[name]
+
+
+def simulate(order, durations, workers):
+    # when each package would finish with workers concurrent builds,
+    # started as soon as their dependencies are done, in order
+    finish = {}
+    running = []
+    pending = list(order)
+    now = 0.0
+    while pending or running:
+        for package in list(pending):
+            if len(running) >= workers:
+                break
+            if all(x in finish and finish[x] <= now for x in package.deps):
+                pending.remove(package)
+                heapq.heappush(running, (now + durations[package.name], package.name))
+        now, name = heapq.heappop(running)
+        finish[name] = now
+    return finish
+
+
+def index_channel(channel):
+    subprocess.check_call(['conda', 'index', channel],
+                          stdout=subprocess.DEVNULL)
+
+
+def build_one(package, channel, workdir):
+    # Runs conda build for package, logging to workdir/<name>.log. The
+    # build writes and indexes its own output folder, concurrent builds
+    # re-indexing the channel they all read from would race; merge()
+    # moves the artifacts to the channel. Returns their paths in the
+    # output folder.
+    croot = os.path.join(workdir, package.name)
+    output = os.path.join(workdir, package.name + '-output')
+    os.makedirs(croot, exist_ok=True)
+    shutil.rmtree(output, ignore_errors=True)
+    env = dict(os.environ, **package.env)
+    cmd = package.command(output, croot, channel)
+    outputs = subprocess.check_output(cmd[:2] + ['--output'] + cmd[2:],
+                                      cwd=package.root, env=env,
+                                      universal_newlines=True)
+    artifacts = [x.strip() for x in outputs.splitlines()
+                 if x.strip().endswith(('.tar.bz2', '.conda'))]
+    log = os.path.join(workdir, package.name + '.log')
+    with open(log, 'w') as f:
+        returncode = subprocess.call(cmd, cwd=package.root, env=env,
+                                     stdout=f, stderr=subprocess.STDOUT)
+    if returncode != 0:
+        raise RuntimeError('conda build failed (%d), see %s' % (returncode, log))
+    return artifacts
+
+
+def merge(artifacts, channel):
+    # Copies artifacts into the subdirs of channel and indexes it, the
+    # caller holds the lock that makes this the only writer. Returns their
+    # paths in the channel.
+    merged = []
+    for artifact in artifacts:
+        subdir = os.path.join(channel, os.path.basename(os.path.dirname(artifact)))
+        os.makedirs(subdir, exist_ok=True)
+        path = os.path.join(subdir, os.path.basename(artifact))
+        shutil.copyfile(artifact, path + '.part')
+        os.replace(path + '.part', path)
+        merged.append(path)
+    index_channel(channel)
+    return merged
+
+
+def run(order, hashes, up_to_date, state, channel, workdir, workers):
+    # Builds the packages that are not up to date, each as soon as its
+    # dependencies are done. Returns the duration of every package (0 for
+    # skipped ones) and the failed or blocked ones.
+    by_name = {x.name: x for x in order}
+    durations = {x.name: 0.0 for x in order if up_to_date[x.name]}
+    failed = {}
+    lock = threading.Lock()
+    for name in durations:
+        print('up to date %s' % name)
+    if not os.path.exists(os.path.join(channel, 'noarch', 'repodata.json')):
+        # -c needs an indexed channel before the first build merges into it
+        os.makedirs(os.path.join(channel, 'noarch'), exist_ok=True)
+        index_channel(channel)
+
+    def job(package):
+        start = time.monotonic()
+        artifacts = build_one(package, channel, workdir)
+        seconds = time.monotonic() - start
+        with lock:
+            artifacts = merge(artifacts, channel)
+            state[package.name] = {'hash': hashes[package.name],
+                                   'artifacts': artifacts,
+                                   'seconds': round(seconds, 1)}
+            save_state(channel, state)
+        return seconds
+
+    pending = [x for x in order if not up_to_date[x.name]]
+    futures = {}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while pending or futures:
+            for package in list(pending):
+                if any(x in failed for x in package.deps):
+                    pending.remove(package)
+                    failed[package.name] = 'blocked by %s' % ', '.join(
+                        x for x in package.deps if x in failed)
+                    print('skipped %s: %s' % (package.name, failed[package.name]))
+                elif all(x in durations for x in package.deps):
+                    pending.remove(package)
+                    print('building %s' % package.name)
+                    futures[pool.submit(job, package)] = package.name
+            if not futures:
+                continue
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = futures.pop(future)
+                try:
+                    durations[name] = future.result()
+                    print('built %s in %.0fs' % (name, durations[name]))
+                except Exception as e:
+                    failed[name] = str(e)
+                    print('FAILED %s: %s' % (name, e))
+    return durations, failed
+
+
+def main(args=None):
+    p = ArgumentParser("build_feedstocks")
+    p.add_argument("targets", nargs="*",
+                   help="packages to build with their dependencies, default all")
+    p.add_argument("--channel", default=os.environ.get('CONDA_BLD_PATH') or
+                   os.path.expanduser(os.path.join('~', 'rapids-l4t-channel')),
+                   help="local channel the artifacts are written to and "
+                        "dependencies are taken from")
+    p.add_argument("--work-dir", help="conda build roots and logs, defaults "
+                                      "to CHANNEL-work")
+    p.add_argument("-j", "--jobs", type=int, default=2,
+                   help="packages built at once")
+    p.add_argument("--rmm-dir", help="checkout of rapidsai/rmm to build librmm and rmm from")
+    p.add_argument("--cudf-dir", help="checkout of rapidsai/cudf to build libcudf and cudf from")
+    p.add_argument("--rmm-parallel-level", type=int, default=8,
+                   help="PARALLEL_LEVEL of the librmm and rmm builds")
+    p.add_argument("--parallel-level", type=int, default=2,
+                   help="PARALLEL_LEVEL of the libcudf and cudf builds, "
+                        "sort.cu needs a lot of memory per job")
+    p.add_argument("--force", action="append", default=[], metavar="NAME",
+                   help="rebuild NAME even if it is up to date")
+    p.add_argument("--dry-run", action="store_true",
+                   help="report what would be built and simulate the schedule")
+    ns = p.parse_args(args=args)
+
+    packages = feedstock_packages() + rapids_packages(
+        ns.rmm_dir, ns.cudf_dir, ns.rmm_parallel_level, ns.parallel_level)
+    order = select(packages, ns.targets)
+    channel = os.path.abspath(ns.channel)
+    state = load_state(channel)
+    hashes, up_to_date = plan(order, state)
+    for name in ns.force:
+        up_to_date[name] = False
+    # a package is only up to date if everything it was built against is
+    for package in order:
+        if not all(up_to_date[x] for x in package.deps):
+            up_to_date[package.name] = False
+
+    if ns.dry_run:
+        durations = {x.name: 0.0 if up_to_date[x.name] else
+                     state.get(x.name, {}).get('seconds', x.estimate)
+                     for x in order}
+        finish = simulate(order, durations, ns.jobs)
+        for package in sorted(order, key=lambda x: finish[x.name]):
+            action = 'skip' if up_to_date[package.name] else 'build'
+            print('%-6s %-12s %s  done at %6.0fs  %s' % (
+                action, package.name, hashes[package.name][:12],
+                finish[package.name], ' '.join(package.command('<output>', '<croot>', channel))))
+        print('estimated total %.0fs with %d jobs' % (max(finish.values()), ns.jobs))
+    else:
+        workdir = os.path.abspath(ns.work_dir or channel + '-work')
+        os.makedirs(channel, exist_ok=True)
+        os.makedirs(workdir, exist_ok=True)
+        start = time.monotonic()
+        durations, failed = run(order, hashes, up_to_date, state, channel,
+                                workdir, ns.jobs)
+        print('finished in %.0fs' % (time.monotonic() - start))
+        if failed:
+            for name, reason in sorted(failed.items()):
+                print('  %s: %s' % (name, reason))
+            sys.exit(1)
+
+    path, total = critical_path(order, durations)
+    print('critical path: %s (%.0fs)' % (' -> '.join(
+        '%s %.0fs' % (x, durations[x]) for x in path), total))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,572 @@
+#!/usr/bin/env python3
+
+# Memory aware scheduler for the compile step of large CUDA builds such as
+# libcudf, where a fixed PARALLEL_LEVEL has to be low enough for the worst
+# translation unit (sort.cu) and leaves most cores idle the rest of the time.
+#
+# ninja still runs the whole build, but every compile job it starts goes
+# through the `launch` wrapper (the CMAKE_<LANG>_COMPILER_LAUNCHER), which
+# waits for a budget server started by `run` to admit it: the peak RSS each
+# translation unit needed in a previous build is kept in a small JSON
+# database, many small units run side by side, and the heavy ones only
+# start once enough memory is free. While jobs run, the budget is charged
+# with the larger of their estimate and their live RSS, so an unknown or
+# grown unit cannot push the machine into swap. Without a server running,
+# the wrapper starts the compiler straight away.
+#
+#   L="python3;$PWD/build_scheduler.py;launch"
+#   cmake -GNinja -DCMAKE_CUDA_COMPILER_LAUNCHER="$L" -DCMAKE_CXX_COMPILER_LAUNCHER="$L" ...
+#   python build_scheduler.py run -C build --db libcudf_rss.json
+#
+# The scheduling itself can be tried without a compiler, on the recorded
+# database or a synthetic job set, in simulation or with a fake compiler:
+#
+#   python build_scheduler.py simulate --db libcudf_rss.json --compare 2
+#   python build_scheduler.py simulate --synthetic 300 --execute
+
+
+import heapq
+import json
+import os
+import random
+import shlex
+import socket
+import socketserver
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from argparse import ArgumentParser
+from tempfile import TemporaryDirectory as tempdir
+
+# the budget server the launch wrapper asks before starting a compile job
+SOCKET_ENV = 'BUILD_SCHEDULER_SOCKET'
+
+SOURCE_SUFFIXES = ('.c', '.cc', '.cpp', '.cxx', '.cu')
+
+
+def parse_size(value):
+    # '500M' or '20G' -> bytes
+    value = str(value).strip().upper().rstrip('B')
+    units = {'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30, 'T': 1 << 40}
+    if value and value[-1] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+    return int(value)
+
+
+def format_size(n):
+    return '%.1fG' % (n / float(1 << 30))
+
+
+def available_memory():
+    # MemAvailable from /proc/meminfo, in bytes
+    with open('/proc/meminfo') as f:
+        for line in f:
+            if line.startswith('MemAvailable:'):
+                return int(line.split()[1]) * 1024
+    raise RuntimeError('MemAvailable missing from /proc/meminfo')
+
+
+class Job(object):
+    # one compile command with its expected peak RSS (bytes) and duration
+
+    def __init__(self, name, command, directory, rss, seconds):
+        self.name = name
+        self.command = command
+        self.directory = directory
+        self.rss = rss
+        self.seconds = seconds
+
+    def __repr__(self):
+        return 'Job(%r, rss=%s, seconds=%.0f)' % (self.name, format_size(self.rss),
+                                                   self.seconds)
+
+
+class RssDatabase(object):
+    # peak RSS and wall time per translation unit, from previous builds
+
+    def __init__(self, path=None):
+        self.path = path
+        self.entries = {}
+        if path and os.path.exists(path):
+            with open(path) as f:
+                self.entries = json.load(f)
+
+    def save(self):
+        if self.path:
+            with open(self.path, 'w') as f:
+                json.dump(self.entries, f, indent=1, sort_keys=True)
+
+    def record(self, name, rss, seconds):
+        self.entries[name] = {'rss': rss, 'seconds': round(seconds, 3)}
+
+    def estimate(self, name, default_rss, default_seconds, margin):
+        # the recorded values with a safety margin on the memory, or the
+        # defaults for units never seen before
+        entry = self.entries.get(name)
+        if entry is None:
+            return default_rss, default_seconds
+        return int(entry['rss'] * margin), entry['seconds']
+
+    def defaults(self):
+        # median of the recorded units, used for new ones
+        if not self.entries:
+            return None, None
+        return (int(statistics.median(x['rss'] for x in self.entries.values())),
+                statistics.median(x['seconds'] for x in self.entries.values()))
+
+
+def source_file(command):
+    # The translation unit a compiler command line builds, as an absolute
+    # path like the names in the database: the source after -c, or else
+    # the last argument that looks like a source file
+    sources = [x for x in command if x.endswith(SOURCE_SUFFIXES)]
+    for flag, arg in zip(command, command[1:]):
+        if flag == '-c' and arg.endswith(SOURCE_SUFFIXES):
+            sources = [arg]
+            break
+    if not sources:
+        return None
+    return os.path.normpath(os.path.join(os.getcwd(), sources[-1]))
+
+
+class Scheduler(object):
+    # Decides which jobs start next. Jobs are taken longest first, as long
+    # as the memory they are expected to need fits in the budget next to
+    # what the running jobs are charged. When the next job does not fit it
+    # keeps its place, and later jobs only jump ahead if they are expected
+    # to finish before enough memory is freed for it, so heavy units are
+    # not starved by a stream of small ones. A job larger than the whole
+    # budget runs on its own.
+    #
+    # budget=None and order='fifo' schedule like make -jN, for comparison.
+
+    def __init__(self, jobs, budget, workers, order='longest'):
+        self.budget = budget
+        self.workers = workers
+        self.order = order
+        self.pending = []
+        self.add(*jobs)
+
+    def add(self, *jobs):
+        self.pending.extend(jobs)
+        if self.order == 'longest':
+            self.pending.sort(key=lambda x: (-x.seconds, -x.rss, x.name))
+
+    def fits(self, used, job, alone):
+        return self.budget is None or alone or used + job.rss <= self.budget
+
+    def shadow_time(self, now, running, job):
+        # when, going by the estimates, enough running jobs are done for
+        # job to fit
+        used = sum(charged for _, charged, _ in running)
+        for finish, charged in sorted((max(now, started + j.seconds), charged)
+                                      for j, charged, started in running):
+            used -= charged
+            if used + job.rss <= self.budget:
+                return finish
+        return float('inf')
+
+    def ready(self, now, running):
+        # running is a list of (job, charged bytes, start time), returns
+        # the jobs to start now and removes them from pending
+        running = list(running)
+        used = sum(charged for _, charged, _ in running)
+        start = []
+        shadow = None
+        for job in list(self.pending):
+            if len(running) >= self.workers:
+                break
+            fits = self.fits(used, job, alone=not running)
+            if shadow is None and not fits:
+                shadow = self.shadow_time(now, running, job)
+                continue
+            if not fits or (shadow is not None and now + job.seconds > shadow):
+                continue
+            self.pending.remove(job)
+            start.append(job)
+            running.append((job, job.rss, now))
+            used += job.rss
+        return start
+
+
+def process_tree_rss(pids):
+    # resident memory of each pid including its descendants, in bytes
+    children = {}
+    rss = {}
+    page = os.sysconf('SC_PAGE_SIZE')
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open('/proc/%s/stat' % entry) as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+        except OSError:
+            continue
+        pid = int(entry)
+        children.setdefault(int(fields[1]), []).append(pid)
+        rss[pid] = int(fields[21]) * page
+    totals = {}
+    for root in pids:
+        total, stack = 0, [root]
+        while stack:
+            pid = stack.pop()
+            total += rss.get(pid, 0)
+            stack.extend(children.get(pid, []))
+        totals[root] = total
+    return totals
+
+
+def execute(scheduler, db=None, poll=0.2, keep_going=False):
+    # Runs the jobs of scheduler as processes, recording their peak RSS and
+    # wall time in db. Returns (makespan, failed job names).
+    running = {}
+    failed = []
+    start_time = time.monotonic()
+    peak_charged = 0
+    try:
+        while (scheduler.pending and not (failed and not keep_going)) or running:
+            now = time.monotonic() - start_time
+            live = process_tree_rss(running) if running else {}
+            state = [(job, max(job.rss, live.get(pid, 0)), started)
+                     for pid, (job, proc, started) in running.items()]
+            peak_charged = max(peak_charged, sum(x[1] for x in state))
+            if not (failed and not keep_going):
+                for job in scheduler.ready(now, state):
+                    print('[%4d left, %2d running, %s charged] %s' % (
+                        len(scheduler.pending), len(running) + 1,
+                        format_size(sum(x[1] for x in state) + job.rss), job.name))
+                    proc = subprocess.Popen(job.command, shell=True, cwd=job.directory)
+                    running[proc.pid] = (job, proc, now)
+                    state.append((job, job.rss, now))
+            reaped = False
+            for pid in list(running):
+                _, status, usage = os.wait4(pid, os.WNOHANG)
+                if _ == 0:
+                    continue
+                reaped = True
+                job, proc, started = running.pop(pid)
+                proc.returncode = os.waitstatus_to_exitcode(status)
+                seconds = time.monotonic() - start_time - started
+                if proc.returncode != 0:
+                    print('FAILED (%d) %s' % (proc.returncode, job.name))
+                    failed.append(job.name)
+                elif db is not None:
+                    # ru_maxrss is in kilobytes, and covers the children the
+                    # compiler driver waited for
+                    db.record(job.name, usage.ru_maxrss * 1024, seconds)
+            if not reaped:
+                time.sleep(poll)
+    finally:
+        for job, proc, _ in running.values():
+            proc.kill()
+            proc.wait()
+        if db is not None:
+            db.save()
+    print('peak memory charged: %s' % format_size(peak_charged))
+    return time.monotonic() - start_time, failed
+
+
+class BudgetServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    # Admits the compile jobs of a ninja build. Each launch wrapper sends a
+    # line with its translation unit and pid, is answered 'go' once the
+    # scheduler lets its job start, and sends back the peak RSS and wall
+    # time of the compiler when it succeeded. A dispatcher thread charges
+    # the running jobs with their live RSS, like execute.
+
+    daemon_threads = True
+
+    def __init__(self, path, scheduler, db, default_rss, default_seconds,
+                 margin, poll=0.2):
+        socketserver.UnixStreamServer.__init__(self, path, BudgetHandler)
+        self.scheduler = scheduler
+        self.db = db
+        self.default_rss = default_rss
+        self.default_seconds = default_seconds
+        self.margin = margin
+        self.poll = poll
+        self.cond = threading.Condition()
+        # launcher pid -> (job, start time), and job -> its admission event
+        self.running = {}
+        self.admissions = {}
+        self.peak_charged = 0
+        self.stopped = False
+        self.start_time = time.monotonic()
+
+    def admit(self, name, pid):
+        # blocks until the job of the unit name may start
+        rss, seconds = self.db.estimate(name, self.default_rss,
+                                        self.default_seconds, self.margin)
+        job = Job(name, None, None, rss, seconds)
+        job.pid = pid
+        admitted = threading.Event()
+        with self.cond:
+            self.admissions[job] = admitted
+            self.scheduler.add(job)
+            self.cond.notify()
+        admitted.wait()
+        return job
+
+    def release(self, job, report=None):
+        with self.cond:
+            self.running.pop(job.pid, None)
+            if report is not None:
+                self.db.record(job.name, report['rss'], report['seconds'])
+            self.cond.notify()
+
+    def dispatch(self):
+        with self.cond:
+            while not self.stopped:
+                now = time.monotonic() - self.start_time
+                live = process_tree_rss(self.running) if self.running else {}
+                state = [(job, max(job.rss, live.get(pid, 0)), started)
+                         for pid, (job, started) in self.running.items()]
+                self.peak_charged = max(self.peak_charged, sum(x[1] for x in state))
+                for job in self.scheduler.ready(now, state):
+                    print('[%2d waiting, %2d running, %s charged] %s' % (
+                        len(self.scheduler.pending), len(self.running) + 1,
+                        format_size(sum(x[1] for x in state) + job.rss), job.name))
+                    self.running[job.pid] = (job, now)
+                    state.append((job, job.rss, now))
+                    self.admissions.pop(job).set()
+                self.cond.wait(self.poll)
+
+    def stop(self):
+        with self.cond:
+            self.stopped = True
+            self.cond.notify()
+        self.shutdown()
+        self.server_close()
+
+
+class BudgetHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        request = json.loads(self.rfile.readline())
+        job = self.server.admit(request['name'], request['pid'])
+        report = None
+        try:
+            self.wfile.write(b'go\n')
+            self.wfile.flush()
+            line = self.rfile.readline()
+            if line:
+                report = json.loads(line)
+        except OSError:
+            pass
+        finally:
+            self.server.release(job, report)
+
+
+def launch(command):
+    # CMAKE_<LANG>_COMPILER_LAUNCHER: runs the compiler command once the
+    # budget server of `run` admits it, or straight away without a server
+    # or for commands that compile no source file
+    if not command:
+        print('usage: build_scheduler.py launch COMPILER ARGS...', file=sys.stderr)
+        return 2
+    path = os.environ.get(SOCKET_ENV)
+    name = source_file(command)
+    sock = None
+    if path and name:
+        sock = socket.socket(socket.AF_UNIX)
+        try:
+            sock.connect(path)
+        except OSError:
+            sock.close()
+            sock = None
+    if sock is None:
+        return subprocess.call(command)
+    with sock, sock.makefile('rwb') as f:
+        f.write(json.dumps({'name': name, 'pid': os.getpid()}).encode() + b'\n')
+        f.flush()
+        if f.readline() != b'go\n':
+            raise RuntimeError('budget server at %s went away' % path)
+        start = time.monotonic()
+        proc = subprocess.Popen(command)
+        _, status, usage = os.wait4(proc.pid, 0)
+        proc.returncode = os.waitstatus_to_exitcode(status)
+        if proc.returncode == 0:
+            # ru_maxrss is in kilobytes, and covers the children the
+            # compiler driver waited for
+            f.write(json.dumps({'rss': usage.ru_maxrss * 1024,
+                                'seconds': round(time.monotonic() - start, 3)}
+                               ).encode() + b'\n')
+            f.flush()
+    return proc.returncode
+
+
+def simulate(scheduler):
+    # Plays the schedule out on the estimates. Returns (makespan, peak
+    # memory of the jobs running at once).
+    now = 0.0
+    running = []
+    finishing = []
+    peak = 0
+    while scheduler.pending or running:
+        for job in scheduler.ready(now, running):
+            running.append((job, job.rss, now))
+            heapq.heappush(finishing, (now + job.seconds, job.name))
+        peak = max(peak, sum(x[1] for x in running))
+        if not finishing:
+            raise RuntimeError('scheduler started nothing with %d jobs pending'
+                               % len(scheduler.pending))
+        now, name = heapq.heappop(finishing)
+        running = [x for x in running if x[0].name != name]
+    return now, peak
+
+
+def synthetic_jobs(count, seed):
+    # A job set shaped like libcudf: mostly units of about a gigabyte and a
+    # minute or two, and a few percent of heavy ones like sort.cu
+    rng = random.Random(seed)
+    jobs = []
+    for i in range(count):
+        if rng.random() < 0.03:
+            rss = rng.uniform(6, 14) * (1 << 30)
+            seconds = rng.uniform(600, 1800)
+        else:
+            rss = rng.lognormvariate(0, 0.4) * (1 << 30)
+            seconds = rng.lognormvariate(4, 0.6)
+        jobs.append(Job('src/unit_%04d.cu' % i, None, None, int(rss), seconds))
+    return jobs
+
+
+def fake_compiler_command(job, time_scale, memory_scale):
+    return '%s %s fake-cc --rss %d --seconds %.3f' % (
+        shlex.quote(sys.executable), shlex.quote(os.path.abspath(__file__)),
+        int(job.rss * memory_scale), job.seconds * time_scale)
+
+
+def fake_cc(args):
+    # Stands in for a compiler: holds rss bytes resident for some seconds
+    p = ArgumentParser("build_scheduler.py fake-cc")
+    p.add_argument("--rss", type=parse_size, required=True)
+    p.add_argument("--seconds", type=float, required=True)
+    p.add_argument("--fail", action="store_true")
+    ns = p.parse_args(args)
+    memory = bytearray(ns.rss)
+    for i in range(0, len(memory), 4096):
+        memory[i] = 1
+    time.sleep(ns.seconds)
+    return 1 if ns.fail else 0
+
+
+def add_budget_options(p):
+    p.add_argument("--budget", type=parse_size,
+                   help="memory the running jobs may use, defaults to 90%% of "
+                        "MemAvailable")
+    p.add_argument("-j", "--jobs", type=int, default=os.cpu_count(),
+                   help="maximum number of jobs running at once")
+    p.add_argument("--db", help="JSON database of peak RSS per translation unit")
+    p.add_argument("--default-rss", type=parse_size,
+                   help="expected RSS of units missing from the database, "
+                        "defaults to the median of the recorded units, or 2G "
+                        "while the database is empty")
+    p.add_argument("--margin", type=float, default=1.1,
+                   help="factor applied to recorded peak RSS")
+
+
+def estimates(ns, db):
+    default_rss, default_seconds = db.defaults()
+    if ns.default_rss:
+        default_rss = ns.default_rss
+    budget = ns.budget or int(available_memory() * 0.9)
+    return budget, default_rss or (2 << 30), default_seconds or 60.0
+
+
+def run_main(args):
+    p = ArgumentParser("build_scheduler.py run")
+    p.add_argument("-C", dest="build_dir", default=".",
+                   help="ninja build directory, configured with the launch "
+                        "wrapper as compiler launcher")
+    p.add_argument("targets", nargs="*", help="ninja targets, default all")
+    add_budget_options(p)
+    p.add_argument("-k", "--keep-going", action="store_true",
+                   help="keep starting jobs after one failed")
+    ns = p.parse_args(args)
+
+    db = RssDatabase(ns.db)
+    budget, default_rss, default_seconds = estimates(ns, db)
+    print('%d workers, %s budget, %d units recorded' % (
+        ns.jobs, format_size(budget), len(db.entries)))
+    with tempdir() as tmpd:
+        server = BudgetServer(os.path.join(tmpd, 'budget.sock'),
+                              Scheduler([], budget, ns.jobs), db, default_rss,
+                              default_seconds, ns.margin)
+        threads = [threading.Thread(target=server.serve_forever, daemon=True),
+                   threading.Thread(target=server.dispatch, daemon=True)]
+        [x.start() for x in threads]
+        cmd = ['ninja', '-C', ns.build_dir, '-j', str(ns.jobs)]
+        if ns.keep_going:
+            cmd += ['-k', '0']
+        env = dict(os.environ, **{SOCKET_ENV: server.server_address})
+        try:
+            returncode = subprocess.call(cmd + ns.targets, env=env)
+        finally:
+            server.stop()
+            db.save()
+    print('peak memory charged: %s' % format_size(server.peak_charged))
+    return returncode
+
+
+def simulate_main(args):
+    p = ArgumentParser("build_scheduler.py simulate")
+    add_budget_options(p)
+    p.add_argument("--synthetic", type=int, metavar="N",
+                   help="simulate N synthetic jobs instead of the database")
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--compare", type=int, action="append", default=[],
+                   metavar="N", help="also simulate a fixed PARALLEL_LEVEL=N")
+    p.add_argument("--execute", action="store_true",
+                   help="run the jobs with the fake compiler instead")
+    p.add_argument("--time-scale", type=float, default=0.01,
+                   help="durations of the fake compiler jobs relative to the job set")
+    p.add_argument("--memory-scale", type=float, default=0.01,
+                   help="memory of the fake compiler jobs relative to the job set")
+    ns = p.parse_args(args)
+
+    if ns.synthetic:
+        jobs = synthetic_jobs(ns.synthetic, ns.seed)
+    elif ns.db:
+        jobs = [Job(name, None, None, int(x['rss'] * ns.margin), x['seconds'])
+                for name, x in sorted(RssDatabase(ns.db).entries.items())]
+    else:
+        p.error("pass --db or --synthetic")
+    budget = ns.budget or int(available_memory() * 0.9)
+
+    if ns.execute:
+        for job in jobs:
+            job.command = fake_compiler_command(job, ns.time_scale, ns.memory_scale)
+            job.rss = int(job.rss * ns.memory_scale)
+            job.seconds *= ns.time_scale
+        budget = int(budget * ns.memory_scale)
+        makespan, failed = execute(Scheduler(jobs, budget, ns.jobs), poll=0.05)
+        print('ran %d fake jobs in %.1fs, %d failed' % (len(jobs), makespan, len(failed)))
+        return 1 if failed else 0
+
+    serial = sum(x.seconds for x in jobs)
+    print('%d jobs, %.0fs of compiling, %s budget, largest unit %s' % (
+        len(jobs), serial, format_size(budget), format_size(max(x.rss for x in jobs))))
+    makespan, peak = simulate(Scheduler(jobs, budget, ns.jobs))
+    print('%-24s %8.0fs  peak %7s' % ('budgeted -j%d' % ns.jobs, makespan,
+                                      format_size(peak)))
+    for level in ns.compare:
+        makespan, peak = simulate(Scheduler(jobs, None, level, order='fifo'))
+        print('%-24s %8.0fs  peak %7s%s' % (
+            'PARALLEL_LEVEL=%d' % level, makespan, format_size(peak),
+            '  (over budget)' if peak > budget else ''))
+    return 0
+
+
+def main():
+    commands = {'run': run_main, 'launch': launch, 'simulate': simulate_main,
+                'fake-cc': fake_cc}
+    if sys.argv[1:2] and sys.argv[1] in commands:
+        sys.exit(commands[sys.argv[1]](sys.argv[2:]))
+    print('usage: build_scheduler.py {%s} ...' % ','.join(commands), file=sys.stderr)
+    sys.exit(2)
+
+
+if __name__ == "__main__":
+    main()
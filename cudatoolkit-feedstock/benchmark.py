@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+
+# Benchmarks the cudatoolkit extraction pipeline of build.py without a GPU,
+# a Jetson or network access.
+#
+# Synthetic .deb archives shaped like the L4T CUDA packages (a versioned
+# shared library, its SONAME symlink, headers and docs) are generated from a
+# fixed seed together with a matching l4t_cuda.yaml style manifest, served
+# from a local HTTP server that honours Range requests, and run through
+# DebExtractor. Every repetition starts from an empty $SRC_DIR and $PREFIX.
+#
+#   python benchmark.py --packages 40 --lib-size 8M --filler-size 32M --repeat 3
+
+
+import io
+import json
+import os
+import random
+import re
+import shutil
+import statistics
+import sys
+import tarfile
+import threading
+import time
+from argparse import ArgumentParser
+from contextlib import redirect_stdout
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from tempfile import TemporaryDirectory as tempdir
+
+import yaml
+
+import build
+
+# where the L4T CUDA debs install their libraries
+LIBDIR = 'usr/local/cuda-10.2/targets/aarch64-linux/lib'
+VERSION = '10.2.89'
+
+
+def ar_archive(members):
+    # members is a list of (name, bytes), written in the common ar format
+    # used by deb files
+    out = io.BytesIO()
+    out.write(b'!<arch>\n')
+    for name, data in members:
+        header = '%-16s%-12d%-6d%-6d%-8s%-10d`\n' % (
+            name, 0, 0, 0, '100644', len(data))
+        out.write(header.encode('ascii'))
+        out.write(data)
+        if len(data) % 2:
+            out.write(b'\n')
+    return out.getvalue()
+
+
+def tar_archive(entries, compression):
+    # entries is a list of (path, bytes or None, symlink target or None)
+    # the payload is random and does not compress, spend no effort on it
+    level = {'xz': {'preset': 0}, 'gz': {'compresslevel': 1}}[compression]
+    out = io.BytesIO()
+    with tarfile.open(fileobj=out, mode='w:%s' % compression, **level) as tar:
+        for path, data, target in entries:
+            info = tarfile.TarInfo('./' + path)
+            if target is not None:
+                info.type = tarfile.SYMTYPE
+                info.linkname = target
+                tar.addfile(info)
+            else:
+                info.size = len(data)
+                info.mode = 0o644
+                tar.addfile(info, io.BytesIO(data))
+    return out.getvalue()
+
+
+def make_deb(package, library, lib_size, filler_size, rng, compression):
+    # A deb with the shared library 'library' (if any) and filler headers
+    # and docs that the extractor should never need
+    entries = []
+    if library is not None:
+        concrete = 'lib%s.so.%s' % (library, VERSION)
+        entries.append(('%s/%s' % (LIBDIR, concrete), rng.randbytes(lib_size), None))
+        entries.append(('%s/lib%s.so.%s' % (LIBDIR, library, VERSION.split('.')[0]),
+                        None, concrete))
+    if filler_size:
+        half = filler_size // 2
+        entries.append(('usr/local/cuda-10.2/include/%s.h' % package,
+                        rng.randbytes(half), None))
+        entries.append(('usr/share/doc/%s/changelog' % package,
+                        rng.randbytes(filler_size - half), None))
+    control = ('Package: %s\nVersion: %s-1\nArchitecture: arm64\n'
+               'Maintainer: benchmark\nDescription: synthetic\n' % (package, VERSION))
+    deb = ar_archive([
+        ('debian-binary', b'2.0\n'),
+        ('control.tar.%s' % compression,
+         tar_archive([('control', control.encode('ascii'), None)], compression)),
+        ('data.tar.%s' % compression, tar_archive(entries, compression)),
+    ])
+    libraries = []
+    if library is not None:
+        libraries = sorted(['lib%s.so.%s' % (library, VERSION),
+                            'lib%s.so.%s' % (library, VERSION.split('.')[0])])
+    return deb, libraries
+
+
+def generate_fixtures(outdir, packages, lib_size, filler_size, seed, compression,
+                      base_url):
+    # Writes the debs into outdir/debs and returns the manifest. The first
+    # packages each ship one of the configured CUDA libraries, any extra
+    # ones ship filler only.
+    rng = random.Random(seed)
+    debdir = os.path.join(outdir, 'debs')
+    os.makedirs(debdir, exist_ok=True)
+    libraries = list(build.config['cuda_libraries'])
+    if packages < len(libraries):
+        raise ValueError('need at least %d packages, one per CUDA library'
+                         % len(libraries))
+    manifest = {}
+    for i in range(packages):
+        library = libraries[i] if i < len(libraries) else None
+        package = 'cuda-%s-10-2' % (library or 'extra%d' % i)
+        name = '%s_%s-1_arm64.deb' % (package, VERSION)
+        deb, shipped = make_deb(package, library, lib_size, filler_size, rng,
+                                compression)
+        with open(os.path.join(debdir, name), 'wb') as f:
+            f.write(deb)
+        manifest[package] = {'link': base_url + name,
+                             'name': name,
+                             'size': len(deb),
+                             'md5': build.hashlib.md5(deb).hexdigest(),
+                             'libraries': shipped}
+    return manifest
+
+
+class RangeRequestHandler(SimpleHTTPRequestHandler):
+    # SimpleHTTPRequestHandler plus single 'bytes=start-[end]' ranges, so
+    # resumed and segmented downloads can be exercised locally
+
+    def log_message(self, *args):
+        pass
+
+    def send_head(self):
+        path = self.translate_path(self.path)
+        if not os.path.isfile(path):
+            self.send_error(404)
+            return None
+        size = os.path.getsize(path)
+        match = re.match(r'bytes=(\d+)-(\d*)$', self.headers.get('Range', ''))
+        if match is None:
+            self.send_response(200)
+            self.send_header('Content-Length', str(size))
+            self.send_header('Accept-Ranges', 'bytes')
+            self.end_headers()
+            return open(path, 'rb')
+        start = int(match.group(1))
+        end = min(int(match.group(2) or size - 1), size - 1)
+        if start >= size:
+            self.send_response(416)
+            self.send_header('Content-Range', 'bytes */%d' % size)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return None
+        self.send_response(206)
+        self.send_header('Content-Range', 'bytes %d-%d/%d' % (start, end, size))
+        self.send_header('Content-Length', str(end - start + 1))
+        self.end_headers()
+        with open(path, 'rb') as f:
+            f.seek(start)
+            return io.BytesIO(f.read(end - start + 1))
+
+
+def serve(directory):
+    # Starts a threaded HTTP server for directory on a free local port,
+    # returns the server and its base url
+    handler = lambda *args: RangeRequestHandler(*args, directory=directory)
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, 'http://127.0.0.1:%d/' % server.server_address[1]
+
+
+def new_extractor(workdir, manifest_path):
+    # A DebExtractor on fresh $SRC_DIR and $PREFIX directories
+    shutil.rmtree(workdir, ignore_errors=True)
+    os.environ['SRC_DIR'] = os.path.join(workdir, 'src')
+    os.environ['PREFIX'] = os.path.join(workdir, 'prefix')
+    os.makedirs(os.environ['SRC_DIR'])
+    os.makedirs(os.environ['PREFIX'])
+    build._digests.clear()
+    plt_config = dict(build.config['linux-aarch64'], blob=manifest_path)
+    return build.DebExtractor('10.2', build.config, plt_config)
+
+
+def timed(timings, phase, func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    timings[phase] = time.perf_counter() - start
+    return result
+
+
+def run_phases(workdir, manifest_path):
+    # Times each phase of the phased run on its own
+    timings = {}
+    extractor = new_extractor(workdir, manifest_path)
+    timed(timings, 'download', extractor.download_blobs)
+    timed(timings, 'check_md5', extractor.check_md5)
+    # md5 again without the digests memoised during the download
+    build._digests.clear()
+    archives = os.path.join(extractor.src_dir, extractor.archive_dir)
+    timed(timings, 'md5', lambda: [build.md5(os.path.join(archives, x))
+                                   for x in os.listdir(archives)])
+
+    # copy_files runs inside extract while the extracted tree still exists,
+    # time its lookup and install halves there and leave extract the rest
+    def copy_files(sos):
+        index = build.LibraryIndex(sos)
+        filepaths = timed(timings, 'get_paths', extractor.get_paths,
+                          extractor.cuda_libraries, index, extractor.cuda_lib_fmt)
+        timed(timings, 'copy', extractor.install_files, filepaths)
+    extractor.copy_files = copy_files
+    timed(timings, 'extract', extractor.extract)
+    timings['extract'] -= timings['get_paths'] + timings['copy']
+    return timings
+
+
+def run_end_to_end(workdir, manifest_path):
+    timings = {}
+    extractor = new_extractor(workdir, manifest_path)
+    timed(timings, 'end_to_end', extractor.run)
+    return timings
+
+
+def main(args=None):
+    p = ArgumentParser("benchmark")
+    p.add_argument("--packages", type=int, default=len(build.config['cuda_libraries']),
+                   help="number of synthetic debs, at least one per CUDA library")
+    p.add_argument("--lib-size", default="1M",
+                   help="size of the shared library in each deb, e.g. 8M")
+    p.add_argument("--filler-size", default="4M",
+                   help="headers and docs per deb the extractor should skip")
+    p.add_argument("--compression", choices=["xz", "gz"], default="xz")
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--repeat", type=int, default=3)
+    p.add_argument("--json", help="also write the results to this file")
+    ns = p.parse_args(args=args)
+
+    os.environ.pop('CUDATOOLKIT_CACHE_DIR', None)
+    with tempdir() as root:
+        fixtures = os.path.join(root, 'fixtures')
+        os.makedirs(os.path.join(fixtures, 'debs'))
+        server, base_url = serve(os.path.join(fixtures, 'debs'))
+        start = time.perf_counter()
+        manifest = generate_fixtures(fixtures, ns.packages,
+                                     build.parse_size(ns.lib_size),
+                                     build.parse_size(ns.filler_size),
+                                     ns.seed, ns.compression, base_url)
+        print("generated %d debs, %d bytes in %.2fs" % (
+            len(manifest), sum(x['size'] for x in manifest.values()),
+            time.perf_counter() - start), file=sys.stderr)
+        manifest_path = os.path.join(fixtures, 'l4t_cuda.yaml')
+        with open(manifest_path, 'w') as f:
+            yaml.dump(manifest, f)
+
+        runs = []
+        workdir = os.path.join(root, 'work')
+        # keep stdout for the results, build.py logs every file it touches
+        with redirect_stdout(sys.stderr):
+            for _ in range(ns.repeat):
+                timings = run_phases(workdir, manifest_path)
+                timings.update(run_end_to_end(workdir, manifest_path))
+                runs.append(timings)
+        server.shutdown()
+
+    results = {'parameters': vars(ns),
+               'phases': {phase: {'median': statistics.median(x[phase] for x in runs),
+                                  'min': min(x[phase] for x in runs),
+                                  'max': max(x[phase] for x in runs)}
+                          for phase in runs[0]}}
+    print("%-12s %10s %10s %10s" % ('phase', 'median', 'min', 'max'))
+    for phase, stats in results['phases'].items():
+        print("%-12s %9.3fs %9.3fs %9.3fs" % (
+            phase, stats['median'], stats['min'], stats['max']))
+    if ns.json:
+        with open(ns.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
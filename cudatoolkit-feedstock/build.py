@@ -1,15 +1,26 @@
 from __future__ import print_function
+import bisect
+import collections
 import fnmatch
 import platform
 import hashlib
+import json
+import mmap
 import os
+import posixpath
+import queue
+import re
 import sys
 import shutil
 import tarfile
+import threading
+import time
 import urllib.parse as urlparse
 import yaml
 
-from contextlib import contextmanager
+from concurrent.futures import (Future, InvalidStateError, ProcessPoolExecutor,
+                                ThreadPoolExecutor, as_completed)
+from contextlib import contextmanager, suppress
 from pathlib import Path
 from subprocess import check_call
 from tempfile import TemporaryDirectory as tempdir
@@ -18,44 +29,1467 @@ import requests
 from tqdm import tqdm
 import os
 
-def download_from_url(url, dst):
+def count(counters, **amounts):
+    """Adds amounts to the named counters of a dict
+    """
+    for key, value in amounts.items():
+        counters[key] = counters.get(key, 0) + value
+
+class BuildReport(object):
+    """Timings and I/O counters of an extractor run.
+
+    Every phase (download, verify, extract, copy, ...) is recorded as an
+    event with its archive if any, wall clock start and end, the process
+    and thread it ran on and counters such as bytes_downloaded, bytes_read,
+    bytes_written, files and subprocess_seconds. The events are summarised
+    per phase and per archive into a JSON report and can be exported as
+    Chrome trace events (chrome://tracing, Perfetto).
+    """
+
+    def __init__(self):
+        self.start = time.time()
+        self.events = []
+        self._lock = threading.Lock()
+
+    def record(self, phase, start, end, archive=None, pid=None, tid=None,
+               **counters):
+        event = {'phase': phase, 'archive': archive,
+                 'start': start, 'end': end,
+                 'pid': pid or os.getpid(),
+                 'tid': tid or threading.get_ident()}
+        event.update(counters)
+        with self._lock:
+            self.events.append(event)
+        return event
+
+    @contextmanager
+    def phase(self, phase, archive=None):
+        """Times the body as one event, yielding the dict of its counters
+        """
+        counters = {}
+        start = time.time()
+        try:
+            yield counters
+        finally:
+            self.record(phase, start, time.time(), archive, **counters)
+
+    def check_call(self, cmd, counters):
+        """check_call that adds the subprocess time to counters
+        """
+        start = time.time()
+        try:
+            check_call(cmd)
+        finally:
+            count(counters, subprocess_seconds=time.time() - start)
+
+    def summary(self):
+        def totals(events):
+            result = {'count': len(events),
+                      'seconds': sum(x['end'] - x['start'] for x in events),
+                      'wall_seconds': max(x['end'] for x in events) -
+                                      min(x['start'] for x in events)}
+            for event in events:
+                for key, value in event.items():
+                    if key not in ('phase', 'archive', 'start', 'end', 'pid', 'tid'):
+                        result[key] = result.get(key, 0) + value
+            return result
+
+        with self._lock:
+            events = list(self.events)
+        phases = {}
+        archives = {}
+        for event in events:
+            phases.setdefault(event['phase'], []).append(event)
+            if event['archive'] is not None:
+                archives.setdefault(event['archive'], {}).setdefault(
+                    event['phase'], []).append(event)
+        return {'wall_seconds': time.time() - self.start,
+                'phases': {k: totals(v) for k, v in sorted(phases.items())},
+                'archives': {a: {k: totals(v) for k, v in sorted(p.items())}
+                             for a, p in sorted(archives.items())}}
+
+    def dump(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.summary(), f, indent=2, sort_keys=True)
+
+    def dump_trace(self, path):
+        with self._lock:
+            events = list(self.events)
+        trace = []
+        for event in events:
+            args = {k: v for k, v in event.items()
+                    if k not in ('phase', 'start', 'end', 'pid', 'tid')}
+            trace.append({'name': event['archive'] or event['phase'],
+                          'cat': event['phase'], 'ph': 'X',
+                          'ts': (event['start'] - self.start) * 1e6,
+                          'dur': (event['end'] - event['start']) * 1e6,
+                          'pid': event['pid'], 'tid': event['tid'],
+                          'args': args})
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': trace}, f)
+
+# bytes read from the network per iteration when streaming a download,
+# small chunks make the python loop dominate on the Jetson's ARM cores
+DOWNLOAD_CHUNK_SIZE = 4 * 1024 * 1024
+
+# seconds to wait for a connection, and for more data on an open one before
+# the download counts as stalled
+DOWNLOAD_TIMEOUT = (10, float(os.environ.get('CUDATOOLKIT_STALL_TIMEOUT', 60)))
+
+_session = None
+_session_pool_size = 0
+_session_lock = threading.Lock()
+
+def get_session(pool_size=10):
+    """Returns the requests.Session shared by every download so that
+    connections are pooled and reused across blobs.
+    @param: pool_size connections kept per host, the pool is grown when a
+    caller asks for more than it holds
+    """
+    global _session, _session_pool_size
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+        if pool_size > _session_pool_size:
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=pool_size, pool_maxsize=pool_size)
+            _session.mount('http://', adapter)
+            _session.mount('https://', adapter)
+            _session_pool_size = pool_size
+    return _session
+
+def _content_range(req):
+    """Parses a 'bytes start-end/total' Content-Range header into
+    (start, total), either of which may be None
+    """
+    value = req.headers.get('content-range', '')
+    unit, _, spec = value.partition(' ')
+    if unit != 'bytes' or '/' not in spec:
+        return None, None
+    span, total = spec.split('/', 1)
+    start = span.split('-', 1)[0]
+    start = int(start) if start.isdigit() else None
+    total = int(total) if total.isdigit() else None
+    return start, total
+
+def download_from_url(url, dst, pbar=None, session=None, counters=None):
     """
     @param: url to download file
-    @param: dst place to put the file
+    @param: dst place to put the file, a partial file is resumed
+    @param: pbar optional shared progress bar to update instead of
+            creating a per-file one
+    @param: session requests.Session to use, defaults to the shared one
+    @param: counters optional dict in which the bytes downloaded, read
+            and written are accumulated
     """
-    file_size = requests.head(url).headers.get("content-length",None)
-    if file_size: file_size = int(file_size)
+    if counters is None:
+        counters = {}
+    if url.startswith('file://'):
+        return copy_from_file(url, dst, pbar, counters)
+    if session is None:
+        session = get_session()
     if os.path.exists(dst):
         first_byte = os.path.getsize(dst)
     else:
         first_byte = 0
-    if file_size and first_byte >= file_size:
-        return file_size
 
-    pbar = None
-    if file_size:
-        header = {"Range": "bytes=%s-%s" % (first_byte, file_size)}
+    headers = {}
+    if first_byte:
+        headers['Range'] = 'bytes=%d-' % first_byte
+    req = session.get(url, headers=headers, stream=True, timeout=DOWNLOAD_TIMEOUT)
+
+    if req.status_code == 416:
+        # nothing left to fetch, unless the local file is not a prefix
+        # of the remote one, in which case start again from scratch
+        req.close()
+        _, total = _content_range(req)
+        if total == first_byte:
+            return first_byte
+        first_byte = 0
+        req = session.get(url, stream=True, timeout=DOWNLOAD_TIMEOUT)
+    req.raise_for_status()
+
+    if first_byte and (req.status_code != 206 or
+                       _content_range(req)[0] != first_byte):
+        # the server ignored the range request and sent the whole file
+        first_byte = 0
+    mode = 'ab' if first_byte else 'wb'
+
+    # hash while writing so the archive never has to be read back, only
+    # a resumed prefix is read again
+    hash_md5 = hashlib.md5()
+    if first_byte:
+        with open(dst, 'rb') as f:
+            for chunk in iter(lambda: f.read(MD5_CHUNK_SIZE), b""):
+                hash_md5.update(chunk)
+        count(counters, bytes_read=first_byte)
+
+    file_size = req.headers.get("content-length", None)
+    if file_size: file_size = int(file_size) + first_byte
+
+    own_pbar = False
+    if file_size and pbar is None:
         pbar = tqdm(
             total=file_size, initial=first_byte,
             unit='B', unit_scale=True, desc=url.split('/')[-1])
+        own_pbar = True
 
-    req = requests.get(url, stream=True)
-    
-    with(open(dst, 'ab')) as f:
-        for chunk in req.iter_content(chunk_size=1024):
+    with req, open(dst, mode) as f:
+        for chunk in req.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
             if chunk:
                 f.write(chunk)
-                if file_size: 
-                    pbar.update(1024)
-        if pbar: pbar.close()
-    return file_size
+                hash_md5.update(chunk)
+                count(counters, bytes_downloaded=len(chunk),
+                      bytes_written=len(chunk))
+                if pbar is not None:
+                    pbar.update(len(chunk))
+        if own_pbar: pbar.close()
+    remember_md5(dst, hash_md5.hexdigest())
+    return file_size or os.path.getsize(dst)
+
+def copy_from_file(url, dst, pbar=None, counters=None):
+    """download_from_url for file:// urls: appends what dst is missing of
+    the local file, or copies it again if dst is not a prefix of it
+    """
+    if counters is None:
+        counters = {}
+    src = urlparse.unquote(urlparse.urlsplit(url).path)
+    size = os.path.getsize(src)
+    have = os.path.getsize(dst) if os.path.exists(dst) else 0
+    if have > size:
+        have = 0
+    # hash while copying, as download_from_url does
+    hash_md5 = hashlib.md5()
+    with open(src, 'rb') as s, open(dst, 'r+b' if have else 'wb') as d:
+        if have:
+            for chunk in iter(lambda: d.read(min(MD5_CHUNK_SIZE, have - d.tell())), b""):
+                hash_md5.update(chunk)
+            count(counters, bytes_read=have)
+        s.seek(have)
+        d.truncate()
+        for chunk in iter(lambda: s.read(DOWNLOAD_CHUNK_SIZE), b""):
+            d.write(chunk)
+            hash_md5.update(chunk)
+            count(counters, bytes_read=len(chunk), bytes_written=len(chunk))
+            if pbar is not None:
+                pbar.update(len(chunk))
+    remember_md5(dst, hash_md5.hexdigest())
+    return size
+
+# segmented downloads split a file into ranges of at least this size
+MIN_SEGMENT_SIZE = 32 * 1024 * 1024
+
+def _probe_ranges(url, session):
+    """Asks for the first byte of url, returns (total size, validator) if
+    the server answers with a byte range, otherwise (None, None)
+    """
+    req = session.get(url, headers={'Range': 'bytes=0-0'}, stream=True,
+                      timeout=DOWNLOAD_TIMEOUT)
+    with req:
+        req.raise_for_status()
+        _, total = _content_range(req)
+        if req.status_code != 206 or total is None:
+            return None, None
+        return total, req.headers.get('etag') or req.headers.get('last-modified')
+
+def _load_segments(sidecar, url, total, validator):
+    """The segments [start, end, done] of an interrupted download of the
+    same file, or None. A download started from another mirror is resumed
+    if the size matches, the md5 check catches a mismatch.
+    """
+    try:
+        with open(sidecar, 'r') as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if state.get('size') != total or (state.get('url') == url and
+                                      state.get('validator') != validator):
+        return None
+    return state['segments']
+
+def download_segmented(url, dst, segments=8, pbar=None, session=None,
+                       counters=None, retries=3):
+    """
+    Downloads url into dst as several byte ranges fetched concurrently and
+    written in place into a preallocated file. The progress of every range
+    is kept in dst + '.segments', so an interrupted download only fetches
+    what is missing. Falls back to download_from_url for servers without
+    range support and for files too small to be worth splitting.
+    @param: url to download file
+    @param: dst place to put the file
+    @param: segments number of ranges fetched at once
+    @param: pbar optional shared progress bar
+    @param: session requests.Session to use, defaults to the shared one
+    @param: counters optional dict accumulating the bytes downloaded and written
+    @param: retries attempts per range before the download fails
+    """
+    if counters is None:
+        counters = {}
+    if session is None:
+        session = get_session(max(1, segments))
+    sidecar = dst + '.segments'
+    total, validator = None, None
+    if segments > 1 and not url.startswith('file://'):
+        total, validator = _probe_ranges(url, session)
+    if total is None or total < 2 * MIN_SEGMENT_SIZE:
+        if os.path.exists(sidecar):
+            # a preallocated file is not a prefix that can be resumed
+            os.remove(sidecar)
+            with suppress(FileNotFoundError):
+                os.remove(dst)
+        return download_from_url(url, dst, pbar, session, counters)
+
+    state = _load_segments(sidecar, url, total, validator)
+    if state is None or not os.path.exists(dst):
+        # a partial file without sidecar was written front to back by
+        # download_from_url, keep it as a finished first range. A longer
+        # one is not this file, it is truncated and fetched again.
+        have = os.path.getsize(dst) if os.path.exists(dst) else 0
+        if have == total and not os.path.exists(sidecar):
+            return have
+        if os.path.exists(sidecar) or have > total:
+            have = 0
+        n = max(1, min(segments, (total - have) // MIN_SEGMENT_SIZE))
+        bounds = [have + (total - have) * i // n for i in range(n + 1)]
+        state = [[bounds[i], bounds[i + 1], 0] for i in range(n)]
+        if have:
+            state.insert(0, [0, have, have])
+        with open(dst, 'ab') as f:
+            f.truncate(total)
+    lock = threading.Lock()
+
+    def save():
+        tmp = sidecar + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'url': url, 'size': total, 'validator': validator,
+                       'segments': state}, f)
+        os.replace(tmp, sidecar)
+
+    save()
+    remaining = sum(end - start - done for start, end, done in state)
+    own_pbar = pbar is None
+    if own_pbar:
+        pbar = tqdm(total=total, initial=total - remaining, unit='B',
+                    unit_scale=True, desc=url.split('/')[-1])
+
+    def fetch(segment, fd):
+        for attempt in range(retries):
+            start, end, done = segment
+            if start + done >= end:
+                return
+            req = session.get(url, stream=True, timeout=DOWNLOAD_TIMEOUT, headers={
+                'Range': 'bytes=%d-%d' % (start + done, end - 1)})
+            try:
+                with req:
+                    req.raise_for_status()
+                    if req.status_code != 206 or _content_range(req)[0] != start + done:
+                        raise IOError('%s ignored the range request' % url)
+                    for chunk in req.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                        chunk = chunk[:end - start - segment[2]]
+                        os.pwrite(fd, chunk, start + segment[2])
+                        with lock:
+                            segment[2] += len(chunk)
+                            count(counters, bytes_downloaded=len(chunk),
+                                  bytes_written=len(chunk))
+                            pbar.update(len(chunk))
+                            save()
+                if start + segment[2] < end:
+                    raise IOError('connection closed %d bytes early'
+                                  % (end - start - segment[2]))
+                return
+            except (IOError, requests.RequestException):
+                if attempt == retries - 1:
+                    raise
+
+    fd = os.open(dst, os.O_WRONLY)
+    try:
+        with ThreadPoolExecutor(max_workers=len(state)) as pool:
+            futures = [pool.submit(fetch, x, fd) for x in state]
+            errors = [x.exception() for x in futures if x.exception()]
+    finally:
+        os.close(fd)
+        if own_pbar:
+            pbar.close()
+    if errors:
+        # the sidecar keeps what was fetched for the next attempt
+        raise errors[0]
+    os.remove(sidecar)
+    # the ranges arrive out of order and cannot be hashed as they stream
+    # in, the file is hashed now while it is still in the page cache
+    # instead of in one more pass when it is verified
+    md5(dst)
+    count(counters, bytes_read=total)
+    return total
+
+# bytes fetched from each mirror to rank them for a file
+PROBE_BYTES = 256 * 1024
+
+class MirrorSet(object):
+    """Ordered list of mirrors of the NVIDIA download servers. A mirror is
+    an http(s):// or file:// base under which files are found at the same
+    path as on the origin, e.g. with the mirror http://artifacts/nvidia
+    https://developer.download.nvidia.com/compute/cuda/x.deb is looked up
+    at http://artifacts/nvidia/compute/cuda/x.deb. The origin itself is
+    tried last.
+    """
+
+    def __init__(self, mirrors):
+        self.mirrors = [x.rstrip('/') for x in mirrors]
+
+    @classmethod
+    def from_environ(cls):
+        """The mirrors listed, space or comma separated, in
+        $CUDATOOLKIT_MIRRORS
+        """
+        value = os.environ.get('CUDATOOLKIT_MIRRORS', '')
+        return cls([x for x in re.split(r'[\s,]+', value) if x])
+
+    def candidates(self, url):
+        parts = urlparse.urlsplit(url)
+        path = parts.path + ('?' + parts.query if parts.query else '')
+        return [x + path for x in self.mirrors] + [url]
+
+    def probe(self, url):
+        """Seconds taken to fetch the first PROBE_BYTES of url, None if it
+        cannot be fetched
+        """
+        start = time.time()
+        try:
+            if url.startswith('file://'):
+                path = urlparse.unquote(urlparse.urlsplit(url).path)
+                return 0.0 if os.path.isfile(path) else None
+            req = get_session().get(url, stream=True, timeout=DOWNLOAD_TIMEOUT,
+                                    headers={'Range': 'bytes=0-%d' % (PROBE_BYTES - 1)})
+            with req:
+                req.raise_for_status()
+                received = 0
+                for chunk in req.iter_content(chunk_size=64 * 1024):
+                    received += len(chunk)
+                    if received >= PROBE_BYTES:
+                        break
+        except (OSError, requests.RequestException):
+            return None
+        return time.time() - start
+
+    def ranked(self, url):
+        """The candidate urls of url that answered the probe, fastest
+        first, followed by those that did not in their listed order
+        """
+        candidates = self.candidates(url)
+        if len(candidates) == 1:
+            return candidates
+        with ThreadPoolExecutor(max_workers=len(candidates)) as pool:
+            timings = list(pool.map(self.probe, candidates))
+        answered = sorted((t, i) for i, t in enumerate(timings) if t is not None)
+        order = [i for _, i in answered]
+        order += [i for i, t in enumerate(timings) if t is None]
+        return [candidates[i] for i in order]
+
+    def download(self, url, dst, download=download_from_url, **kwargs):
+        """Downloads url with download(candidate, dst, **kwargs) from the
+        fastest mirror, failing over to the next one on errors or stalls.
+        The partial file is kept so the next mirror resumes it.
+        """
+        errors = []
+        for candidate in self.ranked(url):
+            if candidate != url:
+                tqdm.write('fetching %s from %s' % (os.path.basename(dst), candidate))
+            try:
+                return download(candidate, dst, **kwargs)
+            except (OSError, requests.RequestException) as e:
+                errors.append('%s: %s' % (candidate, e))
+                tqdm.write('FAILED %s, trying the next mirror' % candidate)
+        raise IOError('no mirror could provide %s:\n  %s' % (url, '\n  '.join(errors)))
+
+_mirrors = None
+
+def mirrors():
+    """The MirrorSet configured by $CUDATOOLKIT_MIRRORS
+    """
+    global _mirrors
+    if _mirrors is None:
+        _mirrors = MirrorSet.from_environ()
+    return _mirrors
+
+def download_many(jobs, workers=4, total=None, report=None):
+    """Downloads several files concurrently
+    @param: jobs list of (url, dst) pairs
+    @param: workers maximum number of downloads in flight
+    @param: total expected number of bytes over all jobs, if known
+    @param: report optional BuildReport receiving a download event per file
+    Returns a dict mapping each url to its downloaded size. Failures
+    are reported per file and raised together once all jobs finished.
+    """
+    if report is None:
+        report = BuildReport()
+
+    def fetch(url, dst):
+        with report.phase('download', os.path.basename(dst)) as counters:
+            return mirrors().download(url, dst, pbar=pbar, counters=counters)
+
+    results = {}
+    failures = {}
+    # size the connection pool so every worker can keep its connection
+    get_session(max(1, workers))
+    pbar = tqdm(total=total, unit='B', unit_scale=True,
+                desc='%d files' % len(jobs))
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = {pool.submit(fetch, url, dst): url for url, dst in jobs}
+        for future in as_completed(futures):
+            url = futures[future]
+            name = url.split('/')[-1]
+            try:
+                results[url] = future.result()
+            except Exception as e:
+                failures[url] = e
+                tqdm.write('FAILED %s: %s' % (name, e))
+            else:
+                tqdm.write('downloaded %s' % name)
+    pbar.close()
+
+    if failures:
+        msg = "%d of %d downloads failed:\n" % (len(failures), len(jobs))
+        msg += '\n'.join('  %s: %s' % (url, e)
+                         for url, e in sorted(failures.items()))
+        raise RuntimeError(msg)
+    return results
+
+# read size for md5 when a file cannot be memory mapped
+MD5_CHUNK_SIZE = 4 * 1024 * 1024
+
+# md5 digests of files already hashed in this process, or of artifact
+# cache entries hashed by earlier builds (see ArtifactCache.load_digests),
+# keyed by (device, inode, size, mtime) so any later modification
+# invalidates them
+_digests = {}
+_digests_lock = threading.Lock()
+
+def _stat_key(fname):
+    st = os.stat(fname)
+    return (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+
+def remember_md5(fname, digest):
+    """Records digest as the md5 of fname as it is on disk right now
+    """
+    with _digests_lock:
+        _digests[_stat_key(fname)] = digest
+
+def md5_known(fname):
+    """Whether md5(fname) would be answered without reading the file
+    """
+    key = _stat_key(fname)
+    with _digests_lock:
+        return key in _digests
 
 def md5(fname):
+    key = _stat_key(fname)
+    with _digests_lock:
+        if key in _digests:
+            return _digests[key]
     hash_md5 = hashlib.md5()
     with open(fname, "rb") as f:
-        for chunk in iter(lambda: f.read(4096), b""):
-            hash_md5.update(chunk)
-    return hash_md5.hexdigest()
+        try:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                hash_md5.update(m)
+        except (ValueError, OSError):
+            # empty files and some filesystems cannot be mapped
+            for chunk in iter(lambda: f.read(MD5_CHUNK_SIZE), b""):
+                hash_md5.update(chunk)
+    digest = hash_md5.hexdigest()
+    with _digests_lock:
+        _digests[key] = digest
+    return digest
+
+# ioctl request number to reflink (copy-on-write clone) a file on linux
+FICLONE = 0x40049409
+
+def reflink(src, dst):
+    """Clones src to dst sharing the data blocks, raises OSError when the
+    filesystem (or platform) does not support it
+    """
+    try:
+        import fcntl
+    except ImportError:
+        raise OSError('reflink not supported on this platform')
+    with open(src, 'rb') as s, open(dst, 'wb') as d:
+        try:
+            fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+        except OSError:
+            d.close()
+            os.remove(dst)
+            raise
+
+def clone_or_copy(src, dst):
+    """Places the contents of src at dst as a file of its own, using a
+    reflink or, failing that, a copy, never a hard link that writes to
+    dst would go through. Returns the name of the strategy used.
+    """
+    if os.path.lexists(dst):
+        os.remove(dst)
+    try:
+        reflink(src, dst)
+        return 'reflink'
+    except OSError:
+        pass
+    shutil.copyfile(src, dst)
+    return 'copy'
+
+def kernel_copy(src, dst):
+    """Copies src to dst inside the kernel with copy_file_range, switching to
+    sendfile where that is unavailable or refused (e.g. across filesystems
+    on older kernels), raises OSError when neither works
+    """
+    copy_range = getattr(os, 'copy_file_range', None)
+    sendfile = getattr(os, 'sendfile', None)
+    if copy_range is None and sendfile is None:
+        raise OSError('no in-kernel copy on this platform')
+    with open(src, 'rb') as s, open(dst, 'wb') as d:
+        size = os.fstat(s.fileno()).st_size
+        offset = 0
+        try:
+            while offset < size:
+                n = None
+                if copy_range is not None:
+                    try:
+                        n = copy_range(s.fileno(), d.fileno(), size - offset,
+                                       offset, offset)
+                    except OSError:
+                        if sendfile is None:
+                            raise
+                        copy_range = None
+                if n is None:
+                    os.lseek(d.fileno(), offset, os.SEEK_SET)
+                    n = sendfile(d.fileno(), s.fileno(), offset, size - offset)
+                if n == 0:
+                    raise OSError('short in-kernel copy of %s' % src)
+                offset += n
+        except OSError:
+            d.close()
+            os.remove(dst)
+            raise
+
+def materialise(src, dst, move=False):
+    """Places the file src at dst as cheaply as possible: by renaming it
+    when move is allowed, otherwise (or across filesystems) by a reflink,
+    a hard link, an in-kernel copy and finally a plain copy. Permission
+    bits are preserved. Returns the name of the strategy used.
+    """
+    if os.path.lexists(dst):
+        os.remove(dst)
+    if move:
+        try:
+            os.rename(src, dst)
+            return 'rename'
+        except OSError:
+            pass
+    try:
+        reflink(src, dst)
+        shutil.copymode(src, dst)
+        return 'reflink'
+    except OSError:
+        pass
+    try:
+        os.link(src, dst)
+        return 'hardlink'
+    except OSError:
+        pass
+    try:
+        kernel_copy(src, dst)
+        shutil.copymode(src, dst)
+        return 'kernel_copy'
+    except OSError:
+        pass
+    shutil.copy(src, dst)
+    return 'copy'
+
+# the files WindowsExtractor collects out of the installer, by suffix
+COLLECTED_SUFFIXES = ('.dll', '.lib', '.bc')
+# installer components whose dlls are never packaged
+SKIPPED_COMPONENTS = ('jre', 'GFExperience')
+
+def collect_by_suffix(root, suffixes, seen, skip=()):
+    """Returns a (name, path) pair for every file below root whose name
+    ends in one of suffixes, in a single walk that does not descend into
+    directories whose name contains one of skip. Names already in the set
+    seen are left out, the names returned are added to it, so the first
+    file found for a name wins.
+    """
+    found = []
+    for path, dirs, files in os.walk(root):
+        dirs[:] = [x for x in dirs if not any(y in x for y in skip)]
+        for filename in files:
+            key = os.path.normcase(filename)
+            if key.endswith(suffixes) and key not in seen:
+                seen.add(key)
+                found.append((filename, os.path.join(path, filename)))
+    return found
+
+def store_files(files, store, move=False):
+    """Places each (name, path) of files at store/name on a pool of
+    threads, moved with materialise when move is allowed and copied
+    otherwise. A symlink is always copied from the file it points to,
+    moving a relative one would leave it dangling, before any file it may
+    point to is moved. Returns a Counter of the strategies used.
+    """
+    def place(name, path):
+        dst = os.path.join(store, name)
+        if move and not os.path.islink(path):
+            return materialise(path, dst, move=True)
+        shutil.copy(path, dst)
+        return 'copy'
+    links = [x for x in files if os.path.islink(x[1])]
+    with ThreadPoolExecutor() as pool:
+        strategies = collections.Counter(pool.map(lambda x: place(*x), links))
+        futures = [pool.submit(place, name, path) for name, path in files
+                   if not os.path.islink(path)]
+        strategies.update(x.result() for x in futures)
+    return strategies
+
+def parse_size(value):
+    """Parses a human readable size such as '500M' or '20G' into bytes
+    """
+    value = str(value).strip().upper().rstrip('B')
+    units = {'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30, 'T': 1 << 40}
+    if value and value[-1] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+    return int(value)
+
+class ArtifactCache(object):
+    """A persistent, content addressed store of verified downloads.
+
+    Entries live under <root>/md5/<first two hex digits>/<md5> and their
+    atime is bumped on every hit, so eviction drops the least recently
+    used entries first once the total size exceeds max_bytes. The mtime
+    is left alone as it keys the memoised digests, which are kept in
+    <root>/digests so later builds do not hash an entry again. Entries are
+    read-only files of their own, downloads resumed or appended to in
+    $SRC_DIR can not reach them.
+    """
+
+    # one 'device inode size mtime md5' line per hashed entry
+    DIGESTS = 'digests'
+
+    def __init__(self, root, max_bytes=None):
+        """Initialise an instance:
+        Arguments:
+          root - the cache directory, created if missing
+          max_bytes - size cap in bytes, None or 0 for no cap
+        """
+        self.root = root
+        self.max_bytes = max_bytes or None
+        self.tmpdir = os.path.join(root, 'tmp')
+        os.makedirs(self.tmpdir, exist_ok=True)
+        self.load_digests()
+
+    @classmethod
+    def from_environ(cls):
+        """Returns the cache configured by CUDATOOLKIT_CACHE_DIR and
+        CUDATOOLKIT_CACHE_MAX_SIZE, or None when caching is not enabled
+        """
+        root = os.environ.get('CUDATOOLKIT_CACHE_DIR')
+        if not root:
+            return None
+        max_size = os.environ.get('CUDATOOLKIT_CACHE_MAX_SIZE')
+        return cls(root, parse_size(max_size) if max_size else None)
+
+    def path(self, digest):
+        digest = digest.lower()
+        return os.path.join(self.root, 'md5', digest[:2], digest)
+
+    def entries(self):
+        """Returns a list of (path, size, atime) for every cached entry
+        """
+        found = []
+        top = os.path.join(self.root, 'md5')
+        if not os.path.isdir(top):
+            return found
+        for sub in os.scandir(top):
+            if not sub.is_dir():
+                continue
+            for entry in os.scandir(sub.path):
+                st = entry.stat()
+                found.append((entry.path, st.st_size, st.st_atime))
+        return found
+
+    def load_digests(self):
+        """Memoises the digests recorded for the entries, dropping the lines
+        of entries evicted or modified since
+        """
+        path = os.path.join(self.root, self.DIGESTS)
+        try:
+            with open(path) as f:
+                lines = f.read().splitlines()
+        except FileNotFoundError:
+            return
+        current = set()
+        for entry, _, _ in self.entries():
+            with suppress(FileNotFoundError):
+                current.add(_stat_key(entry))
+        kept = {}
+        for line in lines:
+            fields = line.split()
+            try:
+                key = tuple(int(x) for x in fields[:4])
+            except ValueError:
+                continue
+            if len(fields) == 5 and len(fields[4]) == 32 and key in current:
+                kept[key] = fields[4]
+        with _digests_lock:
+            _digests.update(kept)
+        if len(kept) != len(lines):
+            tmp = os.path.join(self.tmpdir, '%s.%d' % (self.DIGESTS, os.getpid()))
+            with open(tmp, 'w') as f:
+                f.writelines('%d %d %d %d %s\n' % (key + (digest,))
+                             for key, digest in kept.items())
+            os.replace(tmp, path)
+
+    def record_digest(self, path, digest):
+        """Memoises digest as the md5 of the entry at path, for this build
+        and the later ones
+        """
+        remember_md5(path, digest)
+        with open(os.path.join(self.root, self.DIGESTS), 'a') as f:
+            f.write('%d %d %d %d %s\n' % (_stat_key(path) + (digest,)))
+
+    def touch(self, path):
+        st = os.stat(path)
+        os.utime(path, ns=(time.time_ns(), st.st_mtime_ns))
+
+    def fetch(self, digest, dst, size=None):
+        """Materialises the entry for digest at dst, returns False on a miss.
+        The entry is checked against size, if known, and digest first and
+        evicted if it does not match, dst's digest is then recorded without
+        hashing it again.
+        """
+        path = self.path(digest)
+        if not os.path.isfile(path):
+            return False
+        known = md5_known(path)
+        if ((size and os.path.getsize(path) != size) or
+                md5(path) != digest.lower()):
+            print("evicting corrupt cache entry %s" % path)
+            os.remove(path)
+            return False
+        if not known:
+            self.record_digest(path, digest.lower())
+        self.touch(path)
+        how = clone_or_copy(path, dst)
+        remember_md5(dst, digest.lower())
+        print("cache hit for %s, %s to %s" % (digest, how, dst))
+        return True
+
+    def store(self, src, digest):
+        """Adds the already verified file src under digest
+        """
+        path = self.path(digest)
+        if os.path.isfile(path):
+            self.touch(path)
+            return path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = os.path.join(self.tmpdir, '%s.%d.%d' % (
+            digest, os.getpid(), threading.get_ident()))
+        clone_or_copy(src, tmp)
+        os.chmod(tmp, 0o444)
+        os.replace(tmp, path)
+        self.record_digest(path, digest.lower())
+        self.prune()
+        return path
+
+    def stats(self):
+        entries = self.entries()
+        return {'root': self.root,
+                'entries': len(entries),
+                'bytes': sum(x[1] for x in entries),
+                'max_bytes': self.max_bytes}
+
+    def prune(self, max_bytes=None):
+        """Evicts least recently used entries until the cache fits in
+        max_bytes (defaults to the configured cap). Returns the evicted
+        paths.
+        """
+        max_bytes = max_bytes if max_bytes is not None else self.max_bytes
+        if max_bytes is None:
+            return []
+        entries = sorted(self.entries(), key=lambda x: x[2])
+        total = sum(x[1] for x in entries)
+        evicted = []
+        for path, size, _ in entries:
+            if total <= max_bytes:
+                break
+            os.remove(path)
+            total -= size
+            evicted.append(path)
+        return evicted
+
+# memory budgeted per concurrent archive extraction, xz decompression of
+# the deb data members needs a large dictionary plus pipe buffers
+EXTRACT_JOB_MEMORY = 256 * 1024 * 1024
+
+def available_memory():
+    """Returns MemAvailable from /proc/meminfo in bytes, None if unknown
+    """
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+def extraction_workers():
+    """Number of archives to extract concurrently: one per core, limited by
+    available memory, overridden by CUDATOOLKIT_EXTRACT_WORKERS
+    """
+    if os.environ.get('CUDATOOLKIT_EXTRACT_WORKERS'):
+        return max(1, int(os.environ['CUDATOOLKIT_EXTRACT_WORKERS']))
+    workers = os.cpu_count() or 1
+    memory = available_memory()
+    if memory:
+        workers = min(workers, memory // EXTRACT_JOB_MEMORY)
+    return max(1, workers)
+
+def merge_tree(src, dst):
+    """Moves every file and symlink under src into the same relative place
+    under dst, replacing existing entries, then removes src
+    """
+    os.makedirs(dst, exist_ok=True)
+    for entry in os.scandir(src):
+        target = os.path.join(dst, entry.name)
+        if entry.is_dir(follow_symlinks=False):
+            if os.path.isdir(target) and not os.path.islink(target):
+                merge_tree(entry.path, target)
+                continue
+            if os.path.lexists(target):
+                os.remove(target)
+        os.replace(entry.path, target)
+    os.rmdir(src)
+
+# directory names that never hold the shared libraries being installed
+PRUNED_DIRS = frozenset(['doc', 'docs', 'include', 'man', 'samples', 'share',
+                         'src', 'stubs'])
+
+def scan_libraries(root, matcher, found):
+    """Adds to found a name -> path entry for every file below root whose
+    name matches the compiled matcher, without descending into PRUNED_DIRS.
+    Directories are visited in sorted order and the first path seen for a
+    name is kept.
+    """
+    stack = [root]
+    while stack:
+        with os.scandir(stack.pop()) as it:
+            entries = sorted(it, key=lambda x: x.name)
+        subdirs = []
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                if entry.name not in PRUNED_DIRS:
+                    subdirs.append(entry.path)
+            elif entry.name not in found and matcher.match(entry.name):
+                found[entry.name] = entry.path
+        stack.extend(reversed(subdirs))
+    return found
+
+def patterns_matcher(patterns):
+    """Compiles file name globs into a single regular expression
+    """
+    return re.compile('|'.join(fnmatch.translate(p) for p in patterns))
+
+def dpkg_extract(debfile, dest):
+    """Extracts debfile into dest with dpkg, run in a worker process
+    """
+    os.makedirs(dest, exist_ok=True)
+    check_call(['dpkg', '-x', debfile, dest])
+    return dest
+
+class BoundedReader(object):
+    """Read-only view of the next size bytes of a file object
+    """
+
+    def __init__(self, fileobj, size):
+        self.fileobj = fileobj
+        self.remaining = size
+
+    def read(self, n=-1):
+        if n is None or n < 0 or n > self.remaining:
+            n = self.remaining
+        data = self.fileobj.read(n)
+        self.remaining -= len(data)
+        return data
+
+def iter_ar_members(f):
+    """Yields (name, size) for each member of the ar archive open in f,
+    with f positioned at the start of that member's data
+    """
+    if f.read(8) != b'!<arch>\n':
+        raise RuntimeError('not an ar archive: %s' % getattr(f, 'name', f))
+    while True:
+        header = f.read(60)
+        if len(header) < 60:
+            return
+        if header[58:60] != b'`\n':
+            raise RuntimeError('corrupt ar member header in %s' %
+                               getattr(f, 'name', f))
+        name = header[:16].decode('ascii').strip().rstrip('/')
+        size = int(header[48:58].decode('ascii').strip())
+        start = f.tell()
+        yield name, size
+        # members are aligned on even offsets
+        f.seek(start + size + size % 2)
+
+class UnsupportedCompression(ValueError):
+    """Raised for an archive compressed in a way python cannot read
+    """
+
+def _open_tar_stream(fileobj, name):
+    """Opens a compressed tar member of a deb, or a tarball, for
+    sequential reading
+    """
+    if name.endswith('.zst'):
+        try:
+            import zstandard
+        except ImportError:
+            raise UnsupportedCompression('reading %s needs zstandard' % name)
+        fileobj = zstandard.ZstdDecompressor().stream_reader(fileobj)
+        return tarfile.open(fileobj=fileobj, mode='r|')
+    modes = {'.gz': 'r|gz', '.xz': 'r|xz', '.bz2': 'r|bz2', '.tar': 'r|'}
+    for suffix, mode in modes.items():
+        if name.endswith(suffix):
+            return tarfile.open(fileobj=fileobj, mode=mode)
+    raise UnsupportedCompression('unknown deb data member %s' % name)
+
+def extract_tar_members(tar, dest, matcher):
+    """Writes the regular files, symlinks and hard links of the streaming
+    tar whose base name matches the compiled matcher into dest. Returns
+    the number of members written.
+    """
+    written = 0
+    for member in tar:
+        if not matcher.match(posixpath.basename(member.name)):
+            continue
+        relpath = posixpath.normpath(member.name.lstrip('/'))
+        if relpath.startswith('..'):
+            continue
+        linked = None
+        if member.islnk():
+            linked = posixpath.normpath(member.linkname.lstrip('/'))
+        written += _write_member(tar, member, dest, relpath, linked)
+    return written
+
+def _write_member(tar, member, dest, relpath, linked=None):
+    """Writes the regular file, symlink or hard link member of a streaming
+    tar at dest/relpath, a hard link pointing at dest/linked. Returns 1 if
+    something was written, 0 otherwise.
+    """
+    target = os.path.join(dest, *relpath.split('/'))
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    if os.path.lexists(target):
+        os.remove(target)
+    if member.isfile():
+        with tar.extractfile(member) as src, open(target, 'wb') as out:
+            shutil.copyfileobj(src, out, MD5_CHUNK_SIZE)
+        os.chmod(target, member.mode & 0o777)
+    elif member.issym():
+        os.symlink(member.linkname, target)
+    elif member.islnk() and linked is not None:
+        source = os.path.join(dest, *linked.split('/'))
+        if not os.path.isfile(source):
+            return 0
+        os.link(source, target)
+    else:
+        return 0
+    return 1
+
+def extract_deb(debfile, dest, patterns):
+    """Extracts only the members of debfile's data archive whose file name
+    matches one of the glob patterns into dest, reading the ar and tar
+    layers in-process. Falls back to dpkg for compressions python cannot
+    read. Run in a worker process, returns dest.
+    """
+    matcher = patterns_matcher(patterns)
+    os.makedirs(dest, exist_ok=True)
+    with open(debfile, 'rb') as f:
+        for name, size in iter_ar_members(f):
+            if not name.startswith('data.tar'):
+                continue
+            try:
+                tar = _open_tar_stream(BoundedReader(f, size), name)
+            except UnsupportedCompression:
+                return dpkg_extract(debfile, dest)
+            with tar:
+                extract_tar_members(tar, dest, matcher)
+            return dest
+    raise RuntimeError('%s has no data archive' % debfile)
+
+# a makeself header longer than this is not one
+MAKESELF_MAX_HEADER_LINES = 5000
+
+def read_makeself_header(f):
+    """Reads the shell script header of the makeself archive f up to its
+    payload. The header says how many lines it has, as 'head -n N "$0"' in
+    makeself 2.1, or as skip="N" used as 'head -n "$skip"' from 2.2 on, or
+    as 'tail +$skip' (payload from line N) in 2.0. Returns the payload
+    sizes it lists, raises ValueError if f is not a makeself archive.
+    """
+    skip = None
+    # skip="N" counts the header lines, unless the script tails from it
+    tails = False
+    filesizes = []
+    lines = 0
+    while skip is None or lines < skip - tails:
+        line = f.readline()
+        lines += 1
+        if not line or (lines == 1 and not line.startswith(b'#!')):
+            raise ValueError('not a makeself archive')
+        if skip is None:
+            m = re.search(br'head -n (\d+) "?\$0"?', line)
+            if m:
+                skip = int(m.group(1))
+            m = re.match(br'\s*skip="?(\d+)"?\s*$', line)
+            if m:
+                skip = int(m.group(1))
+            if lines > MAKESELF_MAX_HEADER_LINES:
+                raise ValueError('no payload offset in the makeself header')
+        if re.search(br'tail (-n )?"?\+"?\$\{?skip', line):
+            tails = True
+        m = re.match(br'filesizes="([\d ]+)"', line)
+        if m:
+            filesizes = [int(x) for x in m.group(1).split()]
+    return filesizes
+
+# leading bytes of the payload compressions makeself supports
+PAYLOAD_MAGIC = [(b'\x1f\x8b', '.gz'), (b'BZh', '.bz2'), (b'\xfd7zXZ\x00', '.xz'),
+                 (b'\x28\xb5\x2f\xfd', '.zst')]
+
+def open_payload(f):
+    """Opens the tar payload starting at the current position of the
+    buffered file f for sequential reading, telling its compression by its
+    magic bytes
+    """
+    head = f.peek(512)
+    for magic, suffix in PAYLOAD_MAGIC:
+        if head.startswith(magic):
+            return _open_tar_stream(f, suffix)
+    if head[257:262] == b'ustar':
+        return _open_tar_stream(f, '.tar')
+    raise UnsupportedCompression('unknown makeself payload compression')
+
+# directories of the toolkit the libraries are copied from, their path in
+# a runfile starts at the first of TOOLKIT_ROOTS
+TOOLKIT_ROOTS = ('lib64', 'nvvm', 'targets')
+TOOLKIT_LIBRARY_DIRS = ('lib64', 'lib', 'libdevice')
+
+def toolkit_relpath(name):
+    """The path of a runfile member relative to the toolkit root, such as
+    nvvm/lib64/libnvvm.so for builds/cuda-toolkit/nvvm/lib64/libnvvm.so,
+    or None for members outside of TOOLKIT_ROOTS
+    """
+    parts = posixpath.normpath(name.lstrip('/')).split('/')
+    for i, part in enumerate(parts):
+        if part in TOOLKIT_ROOTS:
+            return '/'.join(parts[i:])
+    return None
+
+def extract_toolkit_members(tar, dest, matcher):
+    """Writes the members of the streaming toolkit tar found directly in
+    one of TOOLKIT_LIBRARY_DIRS whose name matches the compiled matcher,
+    and symlinks standing in for those directories, into dest at their
+    path relative to the toolkit root. Returns the number written.
+    """
+    written = 0
+    for member in tar:
+        relpath = toolkit_relpath(member.name)
+        if relpath is None:
+            continue
+        parts = relpath.split('/')
+        if member.issym() and parts[-1] in TOOLKIT_LIBRARY_DIRS:
+            written += _write_member(tar, member, dest, relpath)
+        elif (len(parts) > 1 and parts[-2] in TOOLKIT_LIBRARY_DIRS and
+                matcher.match(parts[-1])):
+            linked = toolkit_relpath(member.linkname) if member.islnk() else None
+            written += _write_member(tar, member, dest, relpath, linked)
+    return written
+
+def extract_runfile(runfile, dest, matcher, embedded=None):
+    """Streams the payload of the makeself archive runfile without running
+    it, writing only the toolkit libraries matching the compiled matcher
+    into dest (see extract_toolkit_members). With embedded, the payload
+    member of that name is read as a nested makeself archive holding the
+    toolkit. Returns the number of members written. Raises ValueError
+    (UnsupportedCompression for a payload python cannot decompress) or
+    tarfile.TarError if runfile cannot be read so.
+    """
+    with open(runfile, 'rb') as f:
+        read_makeself_header(f)
+        with open_payload(f) as tar:
+            if embedded is None:
+                return extract_toolkit_members(tar, dest, matcher)
+            for member in tar:
+                if member.isfile() and posixpath.basename(member.name) == embedded:
+                    inner = tar.extractfile(member)
+                    read_makeself_header(inner)
+                    with open_payload(inner) as inner_tar:
+                        return extract_toolkit_members(inner_tar, dest, matcher)
+    raise ValueError('%s embeds no %s' % (runfile, embedded))
+
+def extract_tarball(path, dest, patterns):
+    """Extracts only the members of the compressed tarball at path whose
+    file name matches one of the glob patterns into dest, returns dest
+    """
+    os.makedirs(dest, exist_ok=True)
+    with open(path, 'rb') as f, _open_tar_stream(f, path) as tar:
+        extract_tar_members(tar, dest, patterns_matcher(patterns))
+    return dest
+
+def extract_archive(debfile, dest, patterns):
+    """Process pool job running extract_deb, or extract_tarball for
+    anything but a deb, returns dest together with the timings and I/O
+    counters of the extraction for the build report
+    """
+    start = time.time()
+    if debfile.endswith('.deb'):
+        extract_deb(debfile, dest, patterns)
+    else:
+        extract_tarball(debfile, dest, patterns)
+    files = written = 0
+    for path, dirs, filenames in os.walk(dest):
+        for filename in filenames:
+            files += 1
+            if not os.path.islink(os.path.join(path, filename)):
+                written += os.path.getsize(os.path.join(path, filename))
+    return {'dest': dest, 'start': start, 'end': time.time(),
+            'pid': os.getpid(), 'tid': threading.get_ident(),
+            'bytes_read': os.path.getsize(debfile),
+            'bytes_written': written, 'files': files}
+
+def library_patterns(cuda_libraries, cuda_lib_fmt, nvtoolsext_fmt=None):
+    """The file name globs of every shared library the extractors copy
+    """
+    patterns = [cuda_lib_fmt.format(x) for x in cuda_libraries]
+    if 'nvToolsExt' in cuda_libraries and nvtoolsext_fmt:
+        patterns.append(nvtoolsext_fmt.format('nvToolsExt'))
+    return patterns
+
+def plan_downloads(deb_sources, patterns):
+    """Splits the packages of a deb sources manifest into those to download
+    and those that provide none of the wanted libraries. Only the versioned
+    objects count, the unversioned .so links of the -dev packages are made
+    by link_unversioned instead. Packages whose manifest entry has no
+    'libraries' list are always downloaded.
+    Returns two dicts (needed, skipped) of the manifest entries.
+    """
+    matcher = patterns_matcher(patterns)
+    needed = {}
+    skipped = {}
+    for package, source in deb_sources.items():
+        if not source.get('link'):
+            continue
+        libraries = source.get('libraries')
+        if libraries is None or any(matcher.match(x) and not x.endswith('.so')
+                                    for x in libraries):
+            needed[package] = source
+        else:
+            skipped[package] = source
+    return needed, skipped
+
+# the libraries each redistributable component ships, by component name in
+# NVIDIA's redistrib_<version>.json manifests; 'nvvm' and 'libdevice' stand
+# for the nvvm library and the libdevice bitcode shipped with nvcc
+REDIST_COMPONENTS = {
+    'cuda_cudart': ['cudart', 'cudadevrt'],
+    'cuda_nvcc': ['nvvm', 'libdevice'],
+    'cuda_nvrtc': ['nvrtc', 'nvrtc-builtins'],
+    'cuda_nvtx': ['nvToolsExt'],
+    'libcublas': ['cublas', 'cublasLt', 'nvblas'],
+    'libcufft': ['cufft', 'cufftw'],
+    'libcurand': ['curand'],
+    'libcusolver': ['cusolver'],
+    'libcusparse': ['cusparse'],
+    'libnpp': ['npp*'],
+    'libnvjpeg': ['nvjpeg'],
+}
+
+# redistrib platform keys by machine, aarch64 being a Jetson (L4T) rather
+# than an SBSA server
+REDIST_PLATFORMS = {'x86_64': 'linux-x86_64',
+                    'ppc64le': 'linux-ppc64le',
+                    'aarch64': 'linux-aarch64'}
+
+def plan_components(redist, redist_platform, libraries, base_url):
+    """Picks the components of a redistrib manifest that ship at least one
+    of libraries (names as in cuda_libraries, plus 'nvvm' and 'libdevice')
+    for redist_platform. Returns (needed, skipped, missing): two dicts of
+    sources shaped like the deb sources manifest entries, and the libraries
+    no component of the manifest provides.
+    """
+    needed = {}
+    skipped = {}
+    provided = set()
+    for component, entry in sorted(redist.items()):
+        if not isinstance(entry, dict) or redist_platform not in entry:
+            continue
+        archive = entry[redist_platform]
+        ships = [x for x in libraries
+                 if any(fnmatch.fnmatchcase(x, y)
+                        for y in REDIST_COMPONENTS.get(component, []))]
+        source = {'link': urlparse.urljoin(base_url, archive['relative_path']),
+                  'name': posixpath.basename(archive['relative_path']),
+                  'size': int(archive.get('size') or 0),
+                  'md5': archive.get('md5')}
+        if ships:
+            needed[component] = source
+            provided.update(ships)
+        else:
+            skipped[component] = source
+    missing = [x for x in libraries if x not in provided]
+    return needed, skipped, missing
+
+def parse_library_name(filename):
+    """Splits a library file name into its stem (everything before the
+    first dot) and a sortable key of the version components after '.so.',
+    so 'libcufft.so.10.1.2' has stem 'libcufft' and sorts after 'libcufft.so.9'
+    """
+    stem = filename.split('.', 1)[0]
+    _, so, version = filename.partition('.so.')
+    key = tuple((int(x), '') if x.isdigit() else (-1, x)
+                for x in version.split('.')) if so else ()
+    return stem, key
+
+def library_version_key(path):
+    """Sort key ordering library paths by their numeric SONAME version
+    """
+    return parse_library_name(os.path.basename(path))[1], path
+
+class LibraryIndex(object):
+    """Maps library file names to paths, bucketed by stem so a glob such as
+    'libcublas.so*' is resolved without scanning every file name. Stems
+    are normcase'd, as fnmatch compares names, so lookups are case
+    insensitive on Windows.
+    """
+
+    def __init__(self, files):
+        """Initialise an instance:
+        Arguments:
+          files - dict mapping file names to their paths
+        """
+        self.files = dict(files)
+        self.buckets = {}
+        for name in self.files:
+            stem = os.path.normcase(parse_library_name(name)[0])
+            self.buckets.setdefault(stem, []).append(name)
+        self.stems = sorted(self.buckets)
+
+    @classmethod
+    def from_directory(cls, dirpath):
+        return cls({x: os.path.join(dirpath, x) for x in os.listdir(dirpath)})
+
+    def __getitem__(self, name):
+        return self.files[name]
+
+    def find(self, pattern):
+        """Returns the file names matching the glob pattern
+        """
+        head = os.path.normcase(pattern.split('.', 1)[0])
+        wild = min([head.index(c) for c in '*?[' if c in head] or [None])
+        if wild is None:
+            candidates = self.buckets.get(head, [])
+        else:
+            # the glob cuts into the stem, scan every stem with that prefix
+            prefix = head[:wild]
+            candidates = []
+            for stem in self.stems[bisect.bisect_left(self.stems, prefix):]:
+                if not stem.startswith(prefix):
+                    break
+                candidates.extend(self.buckets[stem])
+        return fnmatch.filter(candidates, pattern)
+
+def link_unversioned(file_dict, libraries):
+    """Adds to the name -> path dict file_dict a lib<name>.so symlink to the
+    SONAME link (the shortest versioned name) of each of libraries that
+    has versioned objects but no unversioned name, as its -dev package
+    would ship it. The symlink is made next to the SONAME link. Returns
+    the names added.
+    """
+    index = LibraryIndex(file_dict)
+    added = []
+    for library in libraries:
+        name = 'lib%s.so' % library
+        versioned = index.find(name + '.*')
+        if name in file_dict or not versioned:
+            continue
+        soname = min(versioned, key=lambda x: (len(parse_library_name(x)[1]),
+                                               parse_library_name(x)[1]))
+        link = os.path.join(os.path.dirname(file_dict[soname]), name)
+        if not os.path.lexists(link):
+            os.symlink(soname, link)
+        file_dict[name] = link
+        added.append(name)
+    return added
+
+INSTALL_MANIFEST = 'cudatoolkit_install_manifest.json'
+
+class InstallManifest(object):
+    """Records what a run installed in the output directory: for every file
+    its size, mtime and md5 (or symlink target) and the archive it came
+    from, and for every archive its md5 and the library globs it was
+    extracted for. The next run uses it to skip archives whose outputs are
+    still in place.
+    """
+
+    def __init__(self, path, files=None, archives=None):
+        self.path = path
+        self.files = files or {}
+        self.archives = archives or {}
+
+    @classmethod
+    def load(cls, path):
+        """Reads the manifest at path, empty if missing or unreadable
+        """
+        try:
+            with open(path, 'r') as f:
+                data = json.load(f)
+            return cls(path, data['files'], data['archives'])
+        except (OSError, ValueError, KeyError, TypeError):
+            return cls(path)
+
+    def dump(self):
+        with open(self.path, 'w') as f:
+            json.dump({'files': self.files, 'archives': self.archives}, f,
+                      indent=1, sort_keys=True)
+
+    def add_archive(self, archive, digest, patterns):
+        self.archives[archive] = {'md5': digest, 'patterns': sorted(patterns)}
+
+    def add_file(self, path, archive):
+        """Records the installed file at path, which came from archive
+        """
+        if os.path.islink(path):
+            entry = {'link': os.readlink(path)}
+        else:
+            st = os.stat(path)
+            entry = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns,
+                     'md5': md5(path)}
+        entry['archive'] = archive
+        self.files[os.path.basename(path)] = entry
+
+    def files_of(self, archive):
+        return sorted(k for k, v in self.files.items() if v['archive'] == archive)
+
+    def intact(self, name, dirpath):
+        """True if the file name recorded here is present in dirpath as it
+        was installed. Files whose size and mtime are unchanged are not
+        hashed again.
+        """
+        entry = self.files[name]
+        path = os.path.join(dirpath, name)
+        if 'link' in entry:
+            return os.path.islink(path) and os.readlink(path) == entry['link']
+        try:
+            st = os.lstat(path)
+        except OSError:
+            return False
+        if not os.path.isfile(path) or os.path.islink(path) or st.st_size != entry['size']:
+            return False
+        return st.st_mtime_ns == entry['mtime_ns'] or md5(path) == entry['md5']
 
 # The config dictionary looks like:
 # config[cuda_version(s)...]
@@ -70,6 +1504,8 @@ def md5(fname):
 # libdevice_versions the library device versions supported (.bc files)
 # linux the linux platform config (see below)
 # windows the windows platform config (see below)
+# redist the config used with the per-component redistributable tarballs,
+# where redist_url is what relative archive paths of a local manifest resolve to
 #
 # For each of the two platform specific dictionaries, linux and windows
 # a dictionary containing keys:
@@ -157,6 +1593,20 @@ config['linux-aarch64'] = {
     'libdevice_lib_fmt': 'libdevice.{0}.bc'
 }
 
+# the per-component redistributable tarballs, listed in a redistrib json
+# manifest given by $CUDATOOLKIT_REDIST_MANIFEST (a path or url)
+config['redist'] = {
+    'blob': os.environ.get('CUDATOOLKIT_REDIST_MANIFEST'),
+    'redist_url': 'https://developer.download.nvidia.com/compute/cuda/redist/',
+    'embedded_blob': None,
+    'patches': [],
+    # need globs to handle symlinks
+    'cuda_lib_fmt': 'lib{0}.so*',
+    'cuda_static_lib_fmt': 'lib{0}.a',
+    'nvtoolsext_fmt': 'lib{0}.so*',
+    'nvvm_lib_fmt': 'lib{0}.so*',
+    'libdevice_lib_fmt': 'libdevice.{0}.bc'
+}
 
 config['windows'] = {'blob': 'cuda_10.2.89_441.22_windows.exe',
                    'patches': [],
@@ -211,12 +1661,31 @@ class Extractor(object):
         self.output_dir = os.path.join(self.prefix, self.libdir[getplatform()])
         self.symlinks = 'linux' in getplatform()
         self.debug_install_path = os.environ.get('DEBUG_INSTALLER_PATH')
+        # number of archives fetched concurrently by download_blobs
+        self.download_workers = int(
+            os.environ.get('CUDATOOLKIT_DOWNLOAD_WORKERS', 4))
+        # number of byte ranges a single large blob is fetched in
+        self.download_segments = int(
+            os.environ.get('CUDATOOLKIT_DOWNLOAD_SEGMENTS', 8))
+        self.cache = ArtifactCache.from_environ()
+        self._md5sums = None
+        self._indexes = {}
+        # how many files copy_files placed with each materialise strategy
+        self.materialise_stats = collections.Counter()
+        self.report = BuildReport()
 
         try:
             os.mkdir(self.output_dir)
         except FileExistsError:
             pass
 
+        # what the previous run installed, and the record of this run
+        self.installed = InstallManifest.load(
+            os.path.join(self.output_dir, INSTALL_MANIFEST))
+        self.manifest = InstallManifest(self.installed.path)
+        # the archive each extracted file came from, by file name
+        self._origins = {}
+
     def download_blobs(self):
         """Downloads the binary blobs to the $SRC_DIR
         """
@@ -224,8 +1693,12 @@ class Extractor(object):
         dl_url = urlparse.urljoin(dl_url, self.config_blob)
         dl_path = os.path.join(self.src_dir, self.config_blob)
         if not self.debug_install_path:
-            print("downloading %s to %s" % (dl_url, dl_path))
-            download_from_url(dl_url, dl_path)
+            if not (self.cache and self.fetch_cached(self.blob_md5(), dl_path)):
+                print("downloading %s to %s" % (dl_url, dl_path))
+                with self.report.phase('download', self.config_blob) as counters:
+                    mirrors().download(dl_url, dl_path, download_segmented,
+                                       segments=self.download_segments,
+                                       counters=counters)
         else:
             existing_file = os.path.join(self.debug_install_path, self.config_blob)
             print("DEBUG: copying %s to %s" % (existing_file, dl_path))
@@ -237,30 +1710,112 @@ class Extractor(object):
             dl_path = os.path.join(self.src_dir, p)
             if not self.debug_install_path:
                 print("downloading %s to %s" % (dl_url, dl_path))
-                download_from_url(dl_url, dl_path)
+                with self.report.phase('download', p) as counters:
+                    mirrors().download(dl_url, dl_path, counters=counters)
             else:
                 existing_file = os.path.join(self.debug_install_path, p)
                 print("DEBUG: copying %s to %s" % (existing_file, dl_path))
                 shutil.copy(existing_file, dl_path)
 
+    def fetch_cached(self, digest, dl_path, size=None):
+        """Materialises dl_path from the artifact cache, returns False if
+        there is no cache, no digest to look up, or no intact cached entry
+        """
+        if self.cache is None or not digest:
+            return False
+        return self.cache.fetch(digest, dl_path, size)
+
+    def store_cached(self, path, digest):
+        """Adds a verified download to the artifact cache, if enabled
+        """
+        if self.cache is not None:
+            self.cache.store(path, digest)
+
+    def md5sums(self):
+        """Downloads (once) and parses NVIDIA's md5sum file into a dict
+        mapping each checksum to its file name
+        """
+        if self._md5sums is None:
+            md5file = self.md5_url.split('/')[-1]
+            path = os.path.join(self.src_dir, md5file)
+            mirrors().download(self.md5_url, path)
+            with open(path, 'r') as f:
+                checksums = [x.strip().split() for x in f.read().splitlines() if x]
+            self._md5sums = {x[0]: x[1] for x in checksums}
+        return self._md5sums
+
+    def blob_md5(self):
+        """The published md5 of config_blob, or None if it is not listed
+        """
+        matches = [k for k, v in self.md5sums().items()
+                   if v.startswith(self.config_blob[:-7])]
+        if len(matches) != 1:
+            return None
+        return matches[0]
+
     def check_md5(self):
         """Checks the md5sums of the downloaded binaries
         """
-        md5file = self.md5_url.split('/')[-1]
-        path = os.path.join(self.src_dir, md5file)
-        download_from_url(self.md5_url, path)
-
         # compute hash of blob
         blob_path = os.path.join(self.src_dir, self.config_blob)
-        md5sum = md5(blob_path)
-
-        # get checksums
-        with open(md5file, 'r') as f:
-            checksums = [x.strip().split() for x in f.read().splitlines() if x]
+        with self.report.phase('verify', self.config_blob) as counters:
+            if not md5_known(blob_path):
+                count(counters, bytes_read=os.path.getsize(blob_path))
+            md5sum = md5(blob_path)
 
         # check md5 and filename match up
-        check_dict = {x[0]: x[1] for x in checksums}
+        check_dict = self.md5sums()
         assert check_dict[md5sum].startswith(self.config_blob[:-7])
+        self.store_cached(blob_path, md5sum)
+        self.manifest.add_archive(self.config_blob, md5sum, self.wanted_patterns())
+
+    def up_to_date(self, archive, digest, libraries=None):
+        """True if the previous run installed the files of archive from the
+        same digest and they are all still intact. libraries lists the files
+        the archive ships, if known, so that only library globs added since
+        that run and matching one of them force a new extraction; otherwise
+        the globs must not have changed at all.
+        """
+        recorded = self.installed.archives.get(archive)
+        if recorded is None or not digest or recorded['md5'] != digest:
+            return False
+        patterns = set(self.wanted_patterns())
+        added = patterns - set(recorded['patterns'])
+        if libraries is None:
+            if patterns != set(recorded['patterns']):
+                return False
+        elif added and any(patterns_matcher(added).match(x) for x in libraries):
+            return False
+        return all(self.installed.intact(x, self.output_dir)
+                   for x in self.installed.files_of(archive))
+
+    def run(self):
+        """Downloads, verifies and extracts the blobs, one phase after another,
+        unless the blob was already installed from the same md5
+        """
+        if (self.config_blob in self.installed.archives and
+                self.up_to_date(self.config_blob, self.blob_md5())):
+            print("%s is already installed in %s, nothing to do" %
+                  (self.config_blob, self.output_dir))
+            return
+        with self.report.phase('download_blobs'):
+            self.download_blobs()
+        with self.report.phase('check_md5'):
+            self.check_md5()
+        with self.report.phase('extract_all'):
+            self.extract()
+
+    def wanted_patterns(self):
+        """The file name globs of every file copy_files may pick up
+        """
+        patterns = library_patterns(self.cuda_libraries, self.cuda_lib_fmt,
+                                    self.nvtoolsext_fmt)
+        patterns += [self.cuda_static_lib_fmt.format(x)
+                     for x in self.cuda_static_libraries]
+        patterns.append(self.nvvm_lib_fmt.format('nvvm'))
+        patterns += [self.libdevice_lib_fmt.format(x)
+                     for x in self.libdevice_versions]
+        return patterns
 
     def copy(self, *args):
         """The method to copy extracted files into the conda package platform
@@ -277,10 +1832,13 @@ class Extractor(object):
     def get_paths(self, libraries, dirpath, template):
         """Gets the paths to the various cuda libraries and bc files
         """
+        if dirpath not in self._indexes:
+            self._indexes[dirpath] = LibraryIndex.from_directory(dirpath)
+        index = self._indexes[dirpath]
         pathlist = []
         for libname in libraries:
             filename = template.format(libname)
-            paths = fnmatch.filter(os.listdir(dirpath), filename)
+            paths = index.find(filename)
             if not paths:
                 msg = ("Cannot find item: %s, looked for %s" %
                        (libname, filename))
@@ -293,15 +1851,15 @@ class Extractor(object):
                 raise RuntimeError(msg)
             pathsforlib = []
             for path in paths:
-                tmppath = os.path.join(dirpath, path)
+                tmppath = index[path]
                 assert os.path.isfile(tmppath), 'missing {0}'.format(tmppath)
                 pathsforlib.append(tmppath)
             if self.symlinks: # deal with symlinked items
                 # get all DSOs
                 concrete_dsos = [x for x in pathsforlib
                                  if not os.path.islink(x)]
-                # find the most recent library version by name
-                target_library = max(concrete_dsos)
+                # find the most recent library version by number
+                target_library = max(concrete_dsos, key=library_version_key)
                 # remove this from the list of concrete_dsos
                 # all that remains are DSOs that are not wanted
                 concrete_dsos.remove(target_library)
@@ -327,17 +1885,57 @@ class Extractor(object):
         filepaths += self.get_paths(self.libdevice_versions, libdevice_lib_dir,
                                     self.libdevice_lib_fmt)
 
+        self.install_files(filepaths)
+
+    def install_files(self, filepaths):
+        """Places the files in the output_dir, replicating symlinks. The
+        sources live in temporary extraction directories, so concrete
+        files are moved rather than copied wherever possible. Files kept
+        from a previous run may already be in the output_dir.
+        """
+        with self.report.phase('copy') as counters:
+            self._install_files(filepaths, counters)
+            self.record_install(filepaths)
+        print('placed files: %s' % ', '.join(
+            '%s=%d' % x for x in sorted(self.materialise_stats.items())))
+
+    def _install_files(self, filepaths, counters):
         for fn in filepaths:
-            if os.path.islink(fn):
+            count(counters, files=1)
+            dst = os.path.join(self.output_dir, os.path.basename(fn))
+            if os.path.abspath(fn) == os.path.abspath(dst):
+                self.materialise_stats['kept'] += 1
+            elif os.path.islink(fn):
                 # replicate symlinks
                 symlinktarget = os.readlink(fn)
-                targetname = os.path.basename(fn)
-                symlink = os.path.join(self.output_dir, targetname)
-                print('linking %s to %s' % (symlinktarget, symlink))
-                os.symlink(symlinktarget, symlink)
+                print('linking %s to %s' % (symlinktarget, dst))
+                if os.path.lexists(dst):
+                    os.remove(dst)
+                os.symlink(symlinktarget, dst)
+            else:
+                how = materialise(fn, dst, move=True)
+                self.materialise_stats[how] += 1
+                if how not in ('rename', 'reflink', 'hardlink'):
+                    count(counters, bytes_written=os.path.getsize(dst))
+                print('%s %s to %s' % (how, fn, self.output_dir))
+
+    def record_install(self, filepaths):
+        """Writes the install manifest of the files just placed, and removes
+        the files the previous run installed that are no longer wanted
+        """
+        for fn in filepaths:
+            name = os.path.basename(fn)
+            dst = os.path.join(self.output_dir, name)
+            if os.path.abspath(fn) == os.path.abspath(dst) and name in self.installed.files:
+                self.manifest.files[name] = self.installed.files[name]
             else:
-                print('copying %s to %s' % (fn, self.output_dir))
-                shutil.copy(fn, self.output_dir)
+                self.manifest.add_file(dst, self._origins.get(name, self.config_blob))
+        for name in sorted(set(self.installed.files) - set(self.manifest.files)):
+            stale = os.path.join(self.output_dir, name)
+            if os.path.lexists(stale):
+                print('removing stale %s' % stale)
+                os.remove(stale)
+        self.manifest.dump()
 
     def dump_config(self):
         """Dumps the config dictionary into the output directory
@@ -345,6 +1943,17 @@ class Extractor(object):
         dumpfile = os.path.join(self.output_dir, 'cudatoolkit_config.yaml')
         with open(dumpfile, 'w') as f:
             yaml.dump(self.config, f, default_flow_style=False)
+        self.dump_report()
+
+    def dump_report(self):
+        """Writes the timings and I/O counters of this run next to the
+        config, and as Chrome trace events to $CUDATOOLKIT_TRACE if set
+        """
+        self.report.dump(os.path.join(self.output_dir,
+                                      'cudatoolkit_build_report.json'))
+        trace = os.environ.get('CUDATOOLKIT_TRACE')
+        if trace:
+            self.report.dump_trace(trace)
 
 
 class WindowsExtractor(Extractor):
@@ -361,17 +1970,23 @@ class WindowsExtractor(Extractor):
     def extract(self):
         runfile = self.config_blob
         patches = self.patches
+        # only unpack the members that can be collected below
+        filters = ['-ir!*%s' % x for x in COLLECTED_SUFFIXES]
         try:
             with tempdir() as tmpd:
                 extract_name = '__extracted'
                 extractdir = os.path.join(tmpd, extract_name)
                 os.mkdir(extract_name)
 
-                check_call(['7za', 'x', '-o%s' %
-                            extractdir, os.path.join(self.src_dir, runfile)])
+                with self.report.phase('extract', runfile) as counters:
+                    self.report.check_call(['7za', 'x', '-o%s' %
+                                            extractdir, os.path.join(self.src_dir, runfile)]
+                                           + filters, counters)
                 for p in patches:
-                    check_call(['7za', 'x', '-aoa', '-o%s' %
-                                extractdir, os.path.join(self.src_dir, p)])
+                    with self.report.phase('extract', p) as counters:
+                        self.report.check_call(['7za', 'x', '-aoa', '-o%s' %
+                                                extractdir, os.path.join(self.src_dir, p)]
+                                               + filters, counters)
 
                 nvt_path = os.environ.get('NVTOOLSEXT_INSTALL_PATH', self.nvtoolsextpath)
                 print("NvToolsExt path: %s" % nvt_path)
@@ -381,38 +1996,23 @@ class WindowsExtractor(Extractor):
                                 "or inaccessible.")
                         raise ValueError(msg)
 
-                # fetch all the dlls into DLLs
+                # fetch all the dlls into DLLs, the first one found of each
+                # name wins
                 store_name = 'DLLs'
                 store = os.path.join(tmpd, store_name)
                 os.mkdir(store)
-                for path, dirs, files in os.walk(extractdir):
-                    if 'jre' not in path and 'GFExperience' not in path:  # don't get jre or GFExperience dlls
-                        for filename in fnmatch.filter(files, "*.dll"):
-                            if not Path(os.path.join(
-                                    store, filename)).is_file():
-                                shutil.copy(
-                                    os.path.join(path, filename),
-                                    store)
-                        for filename in fnmatch.filter(files, "*.lib"):
-                            if not Path(os.path.join(
-                                    store, filename)).is_file():
-                                shutil.copy(
-                                    os.path.join(path, filename),
-                                    store)
-                        for filename in fnmatch.filter(files, "*.bc"):
-                            if not Path(os.path.join(
-                                    store, filename)).is_file():
-                                shutil.copy(
-                                    os.path.join(path, filename),
-                                    store)
-                if nvt_path is not None:
-                    for path, dirs, files in os.walk(nvt_path):
-                        for filename in fnmatch.filter(files, "*.dll"):
-                            if not Path(os.path.join(
-                                    store, filename)).is_file():
-                                shutil.copy(
-                                    os.path.join(path, filename),
-                                    store)
+                seen = set()
+                with self.report.phase('collect') as counters:
+                    # don't get jre or GFExperience dlls
+                    found = collect_by_suffix(extractdir, COLLECTED_SUFFIXES, seen,
+                                              SKIPPED_COMPONENTS)
+                    # the extraction is temporary, its files can be moved
+                    store_files(found, store, move=True)
+                    if nvt_path is not None:
+                        nvt = collect_by_suffix(nvt_path, ('.dll',), seen)
+                        store_files(nvt, store)
+                        found += nvt
+                    count(counters, files=len(found))
                 self.copy(store)
         except PermissionError:
             # TODO: fix this
@@ -447,47 +2047,115 @@ class LinuxExtractor(Extractor):
                 basepath, cudapath, 'nvvm', 'lib64'), libdevice_lib_dir=os.path.join(
                 basepath, cudapath, 'nvvm', 'libdevice'))
 
+    def stream_extract(self, runfile, dest):
+        """Reads the libraries out of the runfile without running it,
+        returns False (leaving dest empty) if it cannot be read that way
+        """
+        if os.environ.get('CUDATOOLKIT_STREAM_RUNFILE', '1') == '0':
+            return False
+        # the embedded installer is run with -prefix, the plain toolkit
+        # is extracted into a cuda-toolkit directory
+        toolkit = dest if self.embedded_blob is not None else \
+            os.path.join(dest, 'cuda-toolkit')
+        path = os.path.join(self.src_dir, runfile)
+        try:
+            with self.report.phase('extract', runfile) as counters:
+                written = extract_runfile(path, toolkit,
+                                          patterns_matcher(self.wanted_patterns()),
+                                          self.embedded_blob)
+                count(counters, bytes_read=os.path.getsize(path), files=written)
+        except (ValueError, EOFError, tarfile.TarError) as e:
+            print("cannot stream %s (%s), running the installer" % (runfile, e))
+            for name in os.listdir(dest):
+                shutil.rmtree(os.path.join(dest, name), ignore_errors=True)
+            return False
+        print("streamed %d files out of %s" % (written, runfile))
+        return True
+
+    def run_installer(self, runfile, tmpd):
+        """Extracts the toolkit into tmpd by running the runfile
+        """
+        if self.embedded_blob is not None:
+            with tempdir() as tmpd2, \
+                    self.report.phase('extract', runfile) as counters:
+                cmd = [os.path.join(self.src_dir, runfile),
+                       '--extract=%s' % (tmpd2, ), '--nox11', '--silent']
+                self.report.check_call(cmd, counters)
+                # extract the embedded blob
+                cmd = [os.path.join(tmpd2, self.embedded_blob),
+                       '-prefix', tmpd, '-noprompt', '--nox11']
+                self.report.check_call(cmd, counters)
+        else:
+            # Nvidia's RHEL7 based runfiles don't use embedded runfiles
+            # Once the toolkit is extracted, it ends up in a directory called "cuda-toolkit'
+            # the --extract runfile command is used because letting the runfile do an "install" 
+            # results in attempted installs of .pc and doc files into standard Linux locations, 
+            # which is not what we want.
+            # The "--override" runfile command to disable the compiler check since we are not
+            # installing the driver here.
+
+            cmd = [os.path.join(self.src_dir, runfile),
+                   '--extract=%s' % (tmpd), '--toolkit', '--silent', '--override']
+            with self.report.phase('extract', runfile) as counters:
+                self.report.check_call(cmd, counters)
+
     def extract(self):
         runfile = self.config_blob
         patches = self.patches
         os.chmod(runfile, 0o777)
         with tempdir() as tmpd:
-            if self.embedded_blob is not None:
-                with tempdir() as tmpd2:
-                    cmd = [os.path.join(self.src_dir, runfile),
-                           '--extract=%s' % (tmpd2, ), '--nox11', '--silent']
-                    check_call(cmd)
-                    # extract the embedded blob
-                    cmd = [os.path.join(tmpd2, self.embedded_blob),
-                           '-prefix', tmpd, '-noprompt', '--nox11']
-                    check_call(cmd)
-            else:
-                # Nvidia's RHEL7 based runfiles don't use embedded runfiles
-                # Once the toolkit is extracted, it ends up in a directory called "cuda-toolkit'
-                # the --extract runfile command is used because letting the runfile do an "install" 
-                # results in attempted installs of .pc and doc files into standard Linux locations, 
-                # which is not what we want.
-                # The "--override" runfile command to disable the compiler check since we are not
-                # installing the driver here.
-
-                cmd = [os.path.join(self.src_dir, runfile),
-                       '--extract=%s' % (tmpd), '--toolkit', '--silent', '--override']
-                check_call(cmd)
+            if not self.stream_extract(runfile, tmpd):
+                self.run_installer(runfile, tmpd)
             for p in patches:
                 os.chmod(p, 0o777)
                 cmd = [os.path.join(self.src_dir, p),
                             '--installdir', tmpd, '--accept-eula', '--silent']
-                check_call(cmd)
+                with self.report.phase('extract', p) as counters:
+                    self.report.check_call(cmd, counters)
             self.copy(tmpd)
 
 class DebExtractor(Extractor):
     '''
     Extract all of the libraries from a Debian repository file
     '''
+    # where the archives are downloaded to, under $SRC_DIR
+    archive_dir = 'deb_archives'
+
     def __init__(self, version, ver_config, plt_config):
 
         super(DebExtractor, self).__init__(version, ver_config, plt_config)
+        # manifest entries, by archive name, of the packages whose files
+        # the previous run installed and that need no new extraction
+        self.reused = {}
+        # what load_sources returned, see needed_sources
+        self.sources = None
+
+    def needed_sources(self):
+        """The entries load_sources returns, loaded once for every phase
+        """
+        if self.sources is None:
+            self.sources = self.load_sources()
+        return self.sources
 
+    def load_sources(self):
+        """Loads the deb sources manifest and returns the entries of the
+        packages that provide at least one wanted library
+        """
+        with open(self.config_blob,'r') as thefile:
+            deb_sources = yaml.safe_load(thefile)
+        needed, skipped = plan_downloads(deb_sources, self.wanted_patterns())
+        if skipped:
+            saved = sum(x.get('size') or 0 for x in skipped.values())
+            print("skipping %d packages (%d bytes) providing no wanted library"
+                  % (len(skipped), saved))
+        self.reused = {}
+        for package, source in sorted(needed.items()):
+            if self.up_to_date(source['name'], source['md5'], source.get('libraries')):
+                self.reused[source['name']] = needed.pop(package)
+        if self.reused:
+            print("keeping the installed files of %d unchanged packages"
+                  % len(self.reused))
+        return needed
 
     def download_blobs(self):
         # Need to overwrite this super, for now a debfile is passed through the
@@ -495,35 +2163,66 @@ class DebExtractor(Extractor):
         # directly from the package manager
         print("Extracting download sources from {}".format(self.config_blob))
 
-        with open(self.config_blob,'r') as thefile:
-            deb_sources = yaml.safe_load(thefile)
+        deb_sources = self.needed_sources()
 
         try:
-            os.mkdir(os.path.join(self.src_dir,'deb_archives'))
+            os.mkdir(os.path.join(self.src_dir, self.archive_dir))
         except FileExistsError:
             pass
         
+        jobs = []
+        total = 0
         for package in deb_sources.keys():
-            if deb_sources[package]['link']:
-                dl_url = deb_sources[package]['link']
-                dl_path = os.path.join(self.src_dir,'deb_archives', deb_sources[package]['name'])
-                print("downloading %s to %s" % (dl_url, dl_path))
-                download_from_url(dl_url, dl_path)
+            dl_url = deb_sources[package]['link']
+            dl_path = self.archive_path(deb_sources[package])
+            if self.fetch_cached(deb_sources[package]['md5'], dl_path,
+                                 deb_sources[package].get('size')):
+                continue
+            print("downloading %s to %s" % (dl_url, dl_path))
+            jobs.append((dl_url, dl_path))
+            total += deb_sources[package].get('size') or 0
+
+        if jobs:
+            download_many(jobs, workers=self.download_workers, total=total or None,
+                          report=self.report)
         return
 
+    def archive_path(self, source):
+        return os.path.join(self.src_dir, self.archive_dir, source['name'])
+
+    def archive_files(self):
+        """The archives to extract, in the order their files are merged
+        """
+        # walk the extraction looking for more deb files embedded
+        debfiles = []
+        for path, dirs, files in os.walk(self.src_dir):
+            for filename in files:
+                if filename.lower().endswith('.deb'):
+                    debfiles.append(os.path.join(path,filename))
+        return sorted(debfiles)
+
+    def verify(self, source, dl_path):
+        """Checks a downloaded archive against its manifest md5 and adds it
+        to the artifact cache
+        """
+        if source['md5']:
+            with self.report.phase('verify', source['name']) as counters:
+                if not md5_known(dl_path):
+                    count(counters, bytes_read=os.path.getsize(dl_path))
+                md5sum = md5(dl_path)
+                assert md5sum.startswith(source['md5'][:-7])
+                self.store_cached(dl_path, md5sum)
+        self.manifest.add_archive(source['name'], source['md5'],
+                                  self.wanted_patterns())
+
     def check_md5(self):
         # Need to overwrite this super also, debfile md5s are included in
         # download yaml created by download_links.py
         
-        with open(self.config_blob,'r') as thefile:
-            deb_sources = yaml.safe_load(thefile)
+        deb_sources = self.needed_sources()
 
         for package in deb_sources.keys():
-            if deb_sources[package]['md5']:
-                dl_path = os.path.join(self.src_dir,'deb_archives', deb_sources[package]['name'])
-                md5sum = md5(dl_path)
-                assert md5sum.startswith(deb_sources[package]['md5'][:-7])
-                
+            self.verify(deb_sources[package], self.archive_path(deb_sources[package]))
 
         return
 
@@ -535,22 +2234,19 @@ class DebExtractor(Extractor):
         # from the archive
         basepath = args[0]
 
-        sos = {}
-        for path, dirs, files in os.walk(basepath):
-            for filename in files:
-                if '.so' in filename and '/doc/' not in path:
-                    if filename not in sos.keys(): sos[filename] = os.path.join(path,filename)
-
+        sos = scan_libraries(basepath, patterns_matcher(self.wanted_patterns()), {})
 
         self.copy_files(sos)
 
     def get_paths(self,libraries, file_dict, template):
         # An override of the runfile get_paths that work for traversing
         # an entire directory, not just looking in one folder
+        if not isinstance(file_dict, LibraryIndex):
+            file_dict = LibraryIndex(file_dict)
         pathlist = []
         for libname in libraries:
             filename = template.format(libname)
-            paths = fnmatch.filter(file_dict.keys(), filename)
+            paths = file_dict.find(filename)
 
             if not paths:
                 # Paths was empty for this library, we need this library
@@ -575,8 +2271,8 @@ class DebExtractor(Extractor):
                 # get all DSOs
                 concrete_dsos = [x for x in pathsforlib
                                  if not os.path.islink(x)]
-                # find the most recent library version by name
-                target_library = max(concrete_dsos)
+                # find the most recent library version by number
+                target_library = max(concrete_dsos, key=library_version_key)
                 # remove this from the list of concrete_dsos
                 # all that remains are DSOs that are not wanted
                 concrete_dsos.remove(target_library)
@@ -592,47 +2288,317 @@ class DebExtractor(Extractor):
         # previously we've assembled a dictionary of all of the binary
         # files and their filepaths, go through and extract the libraries
         # and handle the symbolic links
+        # the files of unchanged packages are picked up where the previous
+        # run installed them
+        file_dict = dict(file_dict)
+        matcher = patterns_matcher(self.wanted_patterns())
+        for archive in sorted(self.reused):
+            self.manifest.archives[archive] = self.installed.archives[archive]
+            for name in self.installed.files_of(archive):
+                if name not in file_dict and matcher.match(name):
+                    file_dict[name] = os.path.join(self.output_dir, name)
+                    self._origins[name] = archive
+        # the -dev packages providing the unversioned names are not
+        # downloaded, link them to the runtime package's SONAME
+        for name in link_unversioned(file_dict, self.cuda_libraries):
+            soname = os.readlink(file_dict[name])
+            self._origins[name] = self._origins.get(soname, self.config_blob)
+        filepaths = self.library_paths(LibraryIndex(file_dict))
+
+        self.install_files(filepaths)
+
+    def library_paths(self, index):
+        """The paths in index of every file copy_files installs
+        """
         cudalibs =  [x for x in self.cuda_libraries]
-        filepaths = self.get_paths(cudalibs, file_dict,  self.cuda_lib_fmt)
-
-        for fn in filepaths:
-            if os.path.islink(fn):
-                # replicate symlinks
-                symlinktarget = os.readlink(fn)
-                targetname = os.path.basename(fn)
-                symlink = os.path.join(self.output_dir, targetname)
-                print('linking %s to %s' % (symlinktarget, symlink))
-                os.symlink(symlinktarget, symlink)
-            else:
-                print('copying %s to %s' % (fn, self.output_dir))
-                shutil.copy(fn, self.output_dir)
-
-            
+        return self.get_paths(cudalibs, index, self.cuda_lib_fmt)
 
+    def wanted_patterns(self):
+        """The file name globs of every library copy_files may pick up
+        """
+        return library_patterns(self.cuda_libraries, self.cuda_lib_fmt,
+                                self.nvtoolsext_fmt)
 
     def extract(self):
 
-        # Use dpkg to extract the libraries from a CUDA deb file
+        # Read the CUDA deb files directly, unpacking only the members
+        # that match a wanted library instead of the whole archive
 
         with tempdir() as tmpd:
 
             extractdir = os.path.join(tmpd,"__extracted")
+            # the files of unchanged packages are already installed, as
+            # in _run_pipeline
+            debfiles = [x for x in self.archive_files()
+                        if os.path.basename(x) not in self.reused]
+
+            # each archive is unpacked into its own staging directory by a
+            # pool of processes, the staging directories are then merged in
+            # archive order, as if dpkg had extracted them one after another
+            workers = min(extraction_workers(), len(debfiles) or 1)
+            print("extracting %d archives with %d workers" % (len(debfiles), workers))
+            stagingdir = os.path.join(tmpd, "__staging")
+            patterns = self.wanted_patterns()
+            matcher = patterns_matcher(patterns)
+            sos = {}
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = []
+                for i, debfile in enumerate(debfiles):
+                    staging = os.path.join(stagingdir, '%04d_%s' % (
+                        i, os.path.basename(debfile)))
+                    futures.append(pool.submit(extract_archive, debfile, staging,
+                                               patterns))
+                # scan and merge each archive as soon as it and the ones
+                # before it are done, while later archives still extract
+                for future in futures:
+                    self.collect(future.result(), extractdir, matcher, sos)
+
+            self.copy_files(sos)
+
+    def collect(self, result, extractdir, matcher, sos):
+        """Records the wanted libraries of one archive's staging directory
+        in sos, at the place they will have once merged into extractdir,
+        then merges it. result is what extract_archive returned. As with
+        dpkg, an archive merged later owns the files it overwrites; a name
+        first seen at another place keeps that place.
+        """
+        staging = result.pop('dest')
+        archive = os.path.basename(staging)[5:]
+        self.report.record('extract', archive=archive, **result)
+        for filename, path in scan_libraries(staging, matcher, {}).items():
+            target = os.path.join(extractdir, os.path.relpath(path, staging))
+            if sos.setdefault(filename, target) == target:
+                self._origins[filename] = archive
+        merge_tree(staging, extractdir)
+
+    def run(self):
+        """Streams every archive through download, md5 verification and
+        extraction as soon as the previous stage is done with it, instead
+        of running each phase over the whole batch. Downloads feed a
+        bounded queue of archives awaiting verification, and at most
+        pipeline_depth verified archives wait for an extraction worker.
+        Set CUDATOOLKIT_PIPELINE=0 to run the phases one after another.
+        """
+        if os.environ.get('CUDATOOLKIT_PIPELINE', '1') == '0':
+            return super(DebExtractor, self).run()
+        with self.report.phase('pipeline'):
+            self._run_pipeline()
 
-            # walk the extraction looking for more deb files embedded
-            for path, dirs, files in os.walk(self.src_dir):
-                for filename in files:
-                    if filename.lower().endswith('.deb'):
-                        cmd = ['dpkg',
-                                 '-x',
-                                os.path.join(path,filename),
-                                extractdir]
-                        check_call(cmd)
+    def _run_pipeline(self):
+        print("Extracting download sources from {}".format(self.config_blob))
+        deb_sources = self.needed_sources()
+        os.makedirs(os.path.join(self.src_dir, self.archive_dir), exist_ok=True)
+        # archive order, as in extract
+        sources = sorted(deb_sources.values(), key=lambda x: x['name'])
+
+        depth = int(os.environ.get('CUDATOOLKIT_PIPELINE_DEPTH', 4))
+        verify_workers = int(os.environ.get('CUDATOOLKIT_VERIFY_WORKERS', 1))
+        extract_workers = min(extraction_workers(), len(sources) or 1)
+        print("pipeline: %d download, %d verify, %d extract workers" %
+              (self.download_workers, verify_workers, extract_workers))
+
+        verify_queue = queue.Queue(maxsize=depth)
+        extract_slots = threading.Semaphore(depth + extract_workers)
+        # resolves, per archive, to the future of its extraction job
+        stages = [Future() for _ in sources]
+        patterns = self.wanted_patterns()
+        pbar = tqdm(total=sum(x.get('size') or 0 for x in sources) or None,
+                    unit='B', unit_scale=True, desc='%d files' % len(sources))
+
+        with tempdir() as tmpd, \
+                ThreadPoolExecutor(max_workers=max(1, self.download_workers)) as download_pool, \
+                ProcessPoolExecutor(max_workers=extract_workers) as extract_pool:
+            extractdir = os.path.join(tmpd, "__extracted")
+            stagingdir = os.path.join(tmpd, "__staging")
+
+            def fail(e, indexes):
+                # another thread may have resolved some of these stages
+                for i in indexes:
+                    try:
+                        stages[i].set_exception(e)
+                    except InvalidStateError:
+                        pass
+
+            def download(i, source):
+                try:
+                    dl_path = self.archive_path(source)
+                    if not self.fetch_cached(source['md5'], dl_path,
+                                             source.get('size')):
+                        with self.report.phase('download', source['name']) as counters:
+                            mirrors().download(source['link'], dl_path, pbar=pbar,
+                                               counters=counters)
+                except Exception as e:
+                    fail(e, [i])
+                else:
+                    verify_queue.put((i, source, dl_path))
+
+            def verify():
+                while True:
+                    item = verify_queue.get()
+                    if item is None:
+                        return
+                    i, source, dl_path = item
+                    try:
+                        self.verify(source, dl_path)
+                    except Exception as e:
+                        fail(e, [i])
+                        continue
+                    extract_slots.acquire()
+                    staging = os.path.join(stagingdir, '%04d_%s' % (
+                        i, source['name']))
+                    try:
+                        job = extract_pool.submit(extract_archive, dl_path, staging,
+                                                  patterns)
+                    except Exception as e:
+                        # a dead worker breaks the pool, no other archive
+                        # can be extracted either
+                        extract_slots.release()
+                        fail(e, range(len(stages)))
+                        continue
+                    job.add_done_callback(lambda _: extract_slots.release())
+                    try:
+                        stages[i].set_result(job)
+                    except InvalidStateError:
+                        pass
+
+            get_session(max(1, self.download_workers))
+            verifiers = [threading.Thread(target=verify, daemon=True)
+                         for _ in range(max(1, verify_workers))]
+            [x.start() for x in verifiers]
+            downloads = [download_pool.submit(download, i, x)
+                         for i, x in enumerate(sources)]
+
+            # merge the archives in order while the stages keep running
+            matcher = patterns_matcher(patterns)
+            sos = {}
+            failures = {}
+            for source, stage in zip(sources, stages):
+                try:
+                    result = stage.result().result()
+                except Exception as e:
+                    failures[source['name']] = e
+                    tqdm.write('FAILED %s: %s' % (source['name'], e))
+                    continue
+                self.collect(result, extractdir, matcher, sos)
+
+            [x.result() for x in downloads]
+            [verify_queue.put(None) for _ in verifiers]
+            [x.join() for x in verifiers]
+            pbar.close()
+
+            if failures:
+                msg = "%d of %d archives failed:\n" % (len(failures), len(sources))
+                msg += '\n'.join('  %s: %s' % (name, e)
+                                 for name, e in sorted(failures.items()))
+                raise RuntimeError(msg)
 
-            self.copy(tmpd)
+            self.copy_files(sos)
 
-    
+class RedistExtractor(DebExtractor):
+    '''
+    Extract the libraries from NVIDIA's per-component redistributable
+    tarballs, downloading only the components that ship a wanted library
+    '''
+    archive_dir = 'redist_archives'
 
-        
+    def __init__(self, version, ver_config, plt_config):
+        if getplatform() == 'windows':
+            raise RuntimeError('redistributable sources are only supported on linux')
+        super(RedistExtractor, self).__init__(version, ver_config, plt_config)
+        if not self.config_blob:
+            raise RuntimeError('set CUDATOOLKIT_REDIST_MANIFEST to a redistrib '
+                               'json manifest, as a path or url')
+        self.redist_url = plt_config['redist_url']
+        self.redist_platform = REDIST_PLATFORMS[platform.machine()]
+
+    def manifest_file(self):
+        """The local path of the redistrib manifest, downloading it to the
+        $SRC_DIR first if config_blob is a url. Relative archive paths are
+        resolved against that url, or against redist_url for a local file.
+        """
+        if urlparse.urlparse(self.config_blob).scheme in ('http', 'https', 'file'):
+            self.redist_url = urlparse.urljoin(self.config_blob, '.')
+            path = os.path.join(self.src_dir,
+                                posixpath.basename(urlparse.urlparse(self.config_blob).path))
+            if not os.path.exists(path):
+                mirrors().download(self.config_blob, path)
+            return path
+        return self.config_blob
+
+    def wanted_libraries(self):
+        """The cuda_libraries and cuda_static_libraries, plus 'nvvm' and
+        'libdevice', as named in REDIST_COMPONENTS
+        """
+        libraries = self.cuda_libraries + self.cuda_static_libraries + ['nvvm']
+        if self.libdevice_versions:
+            libraries.append('libdevice')
+        return libraries
+
+    def load_sources(self):
+        """Loads the redistrib manifest and returns, shaped like the deb
+        sources manifest entries, the components that provide at least one
+        wanted library
+        """
+        path = self.manifest_file()
+        with open(path, 'r') as thefile:
+            if path.endswith('.json'):
+                redist = json.load(thefile)
+            else:
+                redist = yaml.safe_load(thefile)
+        needed, skipped, missing = plan_components(
+            redist, self.redist_platform, self.wanted_libraries(), self.redist_url)
+        if 'nvvm' in missing or 'libdevice' in missing:
+            raise RuntimeError('no %s component of %s provides nvvm and libdevice'
+                               % (self.redist_platform, path))
+        if missing:
+            # libraries dropped from the toolkit since, such as nvgraph in 11.0
+            print("WARNING: no %s component of %s provides %s, not packaging them"
+                  % (self.redist_platform, path, ', '.join(missing)))
+            self.drop_libraries(missing)
+        if skipped:
+            saved = sum(x['size'] for x in skipped.values())
+            print("skipping %d components (%d bytes) providing no wanted library"
+                  % (len(skipped), saved))
+        self.reused = {}
+        for component, source in sorted(needed.items()):
+            if self.up_to_date(source['name'], source['md5']):
+                self.reused[source['name']] = needed.pop(component)
+        if self.reused:
+            print("keeping the installed files of %d unchanged components"
+                  % len(self.reused))
+        return needed
+
+    def drop_libraries(self, libraries):
+        """Removes libraries from the cuda_libraries and
+        cuda_static_libraries of this build and of its dumped config
+        """
+        self.cuda_libraries = [x for x in self.cuda_libraries
+                               if x not in libraries]
+        self.cuda_static_libraries = [x for x in self.cuda_static_libraries
+                                      if x not in libraries]
+        self.config['cuda_libraries'] = self.cuda_libraries
+        self.config['cuda_static_libraries'] = self.cuda_static_libraries
+
+    def archive_files(self):
+        archivedir = os.path.join(self.src_dir, self.archive_dir)
+        if not os.path.isdir(archivedir):
+            return []
+        return sorted(os.path.join(archivedir, x) for x in os.listdir(archivedir)
+                      if '.tar' in x and not x.endswith('.segments'))
+
+    def wanted_patterns(self):
+        """The file name globs of every file copy_files may pick up
+        """
+        return Extractor.wanted_patterns(self)
+
+    def library_paths(self, index):
+        filepaths = super(RedistExtractor, self).library_paths(index)
+        filepaths += self.get_paths(self.cuda_static_libraries, index,
+                                    self.cuda_static_lib_fmt)
+        filepaths += self.get_paths(['nvvm'], index, self.nvvm_lib_fmt)
+        filepaths += self.get_paths(self.libdevice_versions, index,
+                                    self.libdevice_lib_fmt)
+        return filepaths
 
 def getplatform():
 
@@ -649,7 +2615,8 @@ def getplatform():
 
 dispatcher = {'linux': LinuxExtractor, 
               'linux-aarch64':DebExtractor,
-              'windows': WindowsExtractor}
+              'windows': WindowsExtractor,
+              'redist': RedistExtractor}
 
 
 def _main():
@@ -662,23 +2629,79 @@ def _main():
     if '.' in major_minor:
         config_version = major_minor
 
-    # get an extractor
+    # get an extractor, the per-component redistributables replace the
+    # platform's own sources when a redistrib manifest is given
     plat = getplatform()
+    if os.environ.get('CUDATOOLKIT_REDIST_MANIFEST'):
+        plat = 'redist'
     extractor_impl = dispatcher[plat]
         
     extractor = extractor_impl(config_version, config, config[plat])
 
-    # download binaries
-    extractor.download_blobs()
-
-    # check md5sum
-    extractor.check_md5()
-
-    # extract
-    extractor.extract()
+    # download binaries, check md5sums and extract
+    extractor.run()
 
     # dump config
     extractor.dump_config()
 
+def _cache_main(args):
+    """Inspects or prunes the artifact cache: build.py cache {stats,prune}
+    """
+    from argparse import ArgumentParser
+    p = ArgumentParser("build.py cache")
+    p.add_argument("action", choices=["stats", "prune"])
+    p.add_argument("--dir", default=os.environ.get('CUDATOOLKIT_CACHE_DIR'),
+                   help="cache directory, defaults to $CUDATOOLKIT_CACHE_DIR")
+    p.add_argument("--max-size", default=os.environ.get('CUDATOOLKIT_CACHE_MAX_SIZE'),
+                   help="size cap such as 20G, defaults to $CUDATOOLKIT_CACHE_MAX_SIZE")
+    ns = p.parse_args(args)
+    if not ns.dir:
+        p.error("no cache directory, set CUDATOOLKIT_CACHE_DIR or pass --dir")
+
+    max_bytes = parse_size(ns.max_size) if ns.max_size else None
+    cache = ArtifactCache(ns.dir, max_bytes)
+    if ns.action == "prune":
+        if max_bytes is None:
+            p.error("prune needs a size cap, pass --max-size")
+        evicted = cache.prune()
+        print("evicted %d entries" % len(evicted))
+    for key, value in cache.stats().items():
+        print("%s: %s" % (key, value))
+
+def _plan_main(args):
+    """Reports which deb archives a build would download: build.py plan
+    """
+    from argparse import ArgumentParser
+    p = ArgumentParser("build.py plan")
+    p.add_argument("manifest", nargs="?", default=config['linux-aarch64']['blob'],
+                   help="deb sources manifest written by download_links.py")
+    ns = p.parse_args(args)
+
+    plt_config = config['linux-aarch64']
+    patterns = library_patterns(config['cuda_libraries'],
+                                plt_config['cuda_lib_fmt'],
+                                plt_config['nvtoolsext_fmt'])
+    with open(ns.manifest, 'r') as f:
+        deb_sources = yaml.safe_load(f)
+    needed, skipped = plan_downloads(deb_sources, patterns)
+
+    for label, packages in (('download', needed), ('skip', skipped)):
+        for package in sorted(packages):
+            print("%-8s %12d  %s" % (label, packages[package].get('size') or 0,
+                                     package))
+    unknown = [x for x in needed if needed[x].get('libraries') is None]
+    if unknown:
+        print("%d packages have no libraries list, regenerate %s with "
+              "download_links.py to plan them" % (len(unknown), ns.manifest))
+    needed_bytes = sum(x.get('size') or 0 for x in needed.values())
+    saved_bytes = sum(x.get('size') or 0 for x in skipped.values())
+    print("download %d packages, %d bytes; skip %d packages, %d bytes saved"
+          % (len(needed), needed_bytes, len(skipped), saved_bytes))
+
 if __name__ == "__main__":
-    _main()
+    if sys.argv[1:2] == ['cache']:
+        _cache_main(sys.argv[2:])
+    elif sys.argv[1:2] == ['plan']:
+        _plan_main(sys.argv[2:])
+    else:
+        _main()
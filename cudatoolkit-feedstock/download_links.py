@@ -6,50 +6,431 @@
 # the appropriate packages for your device
 
 
+import fnmatch
+import glob
+import gzip
+import lzma
+import os
+import posixpath
 import yaml
-from subprocess import check_output
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from subprocess import DEVNULL, CalledProcessError, check_output
+from tempfile import TemporaryDirectory as tempdir
 
+# dependencies are only followed into packages whose name contains one of these
+NVIDIA_WORDS = ["cuda", "nvidia", "cublas"]
 
-def recurse_links(library):
+# the repository the Filename fields of the Jetson Packages indexes are relative to
+JETSON_REPO_URL = "https://repo.download.nvidia.com/jetson/common/"
+
+
+def package_libraries(library, run=check_output):
+    # List the shared library file names shipped by a package, so that
+    # build.py can skip downloading packages it would not use. The file
+    # list of an installed package is used when available, otherwise the
+    # deb is fetched and listed.
+    try:
+        stdout = run(["dpkg-query", "-L", library], stderr=DEVNULL)
+        paths = stdout.decode("utf-8").splitlines()
+    except CalledProcessError:
+        with tempdir() as tmpd:
+            run(["apt-get", "download", "-qq", library], cwd=tmpd)
+            debfile, = glob.glob(os.path.join(tmpd, "*.deb"))
+            stdout = run(["dpkg-deb", "--contents", debfile])
+        # lines look like tar -tv output, symlinks end in "-> target"
+        paths = [line.split(None, 5)[-1].split(" -> ")[0]
+                 for line in stdout.decode("utf-8").splitlines() if line]
+
+    names = {os.path.basename(x) for x in paths}
+    return sorted(x for x in names
+                  if fnmatch.fnmatch(x, "*.so") or fnmatch.fnmatch(x, "*.so.*"))
+
+
+def query_uris(packages, run=check_output):
+    # One apt-get call prints a line per deb to download:
+    #   'link' name size MD5Sum:md5
+    # the package of each line is the first field of the deb file name.
+    # If apt cannot plan the whole batch, the packages are asked one by one.
+    try:
+        stdout = run(["apt-get",
+                      "install",
+                      "--reinstall",
+                      "--print-uris",
+                      "-qq"] + list(packages))
+    except CalledProcessError:
+        if len(packages) == 1:
+            raise
+        output = {}
+        [output.update(query_uris([package], run)) for package in packages]
+        return output
 
     output = {}
+    for line in stdout.decode("utf-8").splitlines():
+        if not line.strip():
+            continue
+        link, name, size, md5 = line.split()
+        package = name.split("_")[0]
+        if package in packages:
+            output[package] = {'link':link.replace('\'',''),
+                               'name':name,
+                               'size':int(size),
+                               'md5':md5.split(':')[-1]}
+    return output
 
 
-    stdout = check_output(["apt-get", 
-                           "install", 
-                           "--reinstall",
-                           "--print-uris", 
-                           "-qq",
-                           library])
-    if stdout:
-        # this library has a deb file to be downloaded
-        link, name, size, md5 = stdout.decode("utf-8").split()
-        output[library] = {'link':link.replace('\'',''),
-                           'name':name,
-                           'size':int(size),
-                           'md5':md5.split(':')[-1]}
-    else:
-        # library does not itself have a package to download, but probably has depends
-        output[library] = {'link':None,'name':None,'md5':None}
-
-    
-    # Search for dependencies    
-    stdout = check_output(["apt-cache","depends",library]).decode("utf-8").splitlines()
-    Depends = [x.strip(" Depends:") for x in stdout if "Depends" in x]
-    nvidia_depends = [x for x in Depends if any(word in x for word in ["cuda","nvidia","cublas"])]
-
-    # Get the download links and md5s for those dependencies
-    if nvidia_depends:
-        [output.update(recurse_links(library)) for library in nvidia_depends]
-    
+def query_depends(packages, run=check_output):
+    # One apt-cache call prints every package name unindented followed by
+    # its indented relations, "|Depends:" marks an alternative and virtual
+    # packages are written <name>
+    stdout = run(["apt-cache", "depends"] + list(packages)).decode("utf-8")
+    output = {}
+    current = None
+    for line in stdout.splitlines():
+        if not line.strip():
+            continue
+        if not line[0].isspace():
+            current = line.strip()
+            output.setdefault(current, [])
+            continue
+        kind, _, target = line.strip().lstrip("|").partition(":")
+        if current is not None and kind.endswith("Depends") and target.strip():
+            output[current].append(target.strip().strip("<>"))
+    return output
+
+
+def resolve_links(roots, run=check_output, batch_size=32, workers=4, known=None):
+    # Breadth first walk of the NVIDIA dependency graph. Every package is
+    # queried once, each level is queried in batches and the batches run
+    # concurrently. Entries in known are taken as current, only their
+    # dependencies are queried again.
+    known = known or {}
+    output = {}
+    visited = set(roots)
+    level = sorted(visited)
+
+    def query(batch):
+        unknown = [x for x in batch if x not in known]
+        uris = query_uris(unknown, run) if unknown else {}
+        return uris, query_depends(batch, run)
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        while level:
+            batches = [level[i:i + batch_size]
+                       for i in range(0, len(level), batch_size)]
+            found = set()
+            for batch, (uris, depends) in zip(batches, pool.map(query, batches)):
+                for library in batch:
+                    if library in known:
+                        output[library] = dict(known[library])
+                    elif library in uris:
+                        # this library has a deb file to be downloaded
+                        output[library] = uris[library]
+                    else:
+                        # library does not itself have a package to download,
+                        # but probably has depends
+                        output[library] = {'link':None,'name':None,'md5':None}
+                    nvidia_depends = [x for x in depends.get(library, [])
+                                      if any(word in x for word in NVIDIA_WORDS)]
+                    found.update(nvidia_depends)
+
+            # record which shared libraries each downloadable package ships
+            downloadable = [x for x in level
+                            if output[x]['link'] and 'libraries' not in output[x]]
+            libraries = pool.map(lambda x: package_libraries(x, run), downloadable)
+            for library, names in zip(downloadable, libraries):
+                output[library]['libraries'] = names
+
+            level = sorted(found - visited)
+            visited.update(level)
+
+    return output
+
+
+def unchanged_entries(existing, run=check_output, batch_size=32, workers=4):
+    # Asks apt for the current link, size and md5 of every package of an
+    # existing manifest in a few batched calls, returning the entries that
+    # are still accurate
+    packages = sorted(x for x in existing if existing[x].get('link'))
+    batches = [packages[i:i + batch_size]
+               for i in range(0, len(packages), batch_size)]
+    current = {}
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        [current.update(x) for x in pool.map(lambda b: query_uris(b, run), batches)]
+    fields = ('link', 'name', 'size', 'md5')
+    return {x: existing[x] for x in packages if x in current and
+            all(current[x][f] == existing[x].get(f) for f in fields)}
+
+
+def _order(c):
+    # dpkg's character ordering: ~ sorts before everything, even the end
+    # of the string, letters sort before other characters
+    if c == "~":
+        return -1
+    if not c or c.isdigit():
+        return 0
+    if c.isalpha():
+        return ord(c)
+    return ord(c) + 256
+
+
+def _compare_part(a, b):
+    # dpkg's verrevcmp on an upstream version or revision string
+    ia = ib = 0
+    at = lambda s, i: s[i] if i < len(s) else ""
+    while ia < len(a) or ib < len(b):
+        first_diff = 0
+        while (at(a, ia) and not at(a, ia).isdigit()) or \
+                (at(b, ib) and not at(b, ib).isdigit()):
+            ac, bc = _order(at(a, ia)), _order(at(b, ib))
+            if ac != bc:
+                return ac - bc
+            ia += 1
+            ib += 1
+        while at(a, ia) == "0":
+            ia += 1
+        while at(b, ib) == "0":
+            ib += 1
+        while at(a, ia).isdigit() and at(b, ib).isdigit():
+            if not first_diff:
+                first_diff = ord(at(a, ia)) - ord(at(b, ib))
+            ia += 1
+            ib += 1
+        if at(a, ia).isdigit():
+            return 1
+        if at(b, ib).isdigit():
+            return -1
+        if first_diff:
+            return first_diff
+    return 0
+
+
+def compare_versions(a, b):
+    # Compares two Debian version strings, negative when a sorts first
+    def split(version):
+        epoch, _, rest = version.partition(":") if ":" in version else ("0", "", version)
+        upstream, _, revision = rest.rpartition("-") if "-" in rest else (rest, "", "")
+        return int(epoch or 0), upstream, revision
+    ea, ua, ra = split(a)
+    eb, ub, rb = split(b)
+    if ea != eb:
+        return ea - eb
+    return _compare_part(ua, ub) or _compare_part(ra, rb)
+
+
+def parse_relations(value):
+    # "a (>= 1), b | c:any" -> ["a", "b", "c"], every alternative is kept
+    names = []
+    for group in value.split(","):
+        for alternative in group.split("|"):
+            name = alternative.strip().split(" ", 1)[0].split("(", 1)[0]
+            name = name.split(":", 1)[0]
+            if name:
+                names.append(name)
+    return names
+
+
+def split_index_arg(value):
+    # Splits a --packages-index PATH[=BASE] argument into the index path and
+    # the repository root its Filename fields are relative to, or None
+    path, _, base_url = value.partition("=")
+    return path, base_url or None
+
+
+def parse_packages_index(paths):
+    # Reads apt Packages indexes (plain, .gz or .xz) into a dict mapping each
+    # package to its Version, Depends, Filename, Size, MD5sum and BaseUrl,
+    # keeping the highest version when a package appears several times.
+    # paths holds index paths or (path, base_url) pairs, each index being
+    # hosted under its own repository root (jetson/common, jetson/t194...)
+    index = {}
+    for path in paths:
+        base_url = None
+        if isinstance(path, tuple):
+            path, base_url = path
+        opener = {".gz": gzip.open, ".xz": lzma.open}.get(
+            os.path.splitext(path)[1], open)
+        with opener(path, "rt", encoding="utf-8") as f:
+            text = f.read()
+        for stanza in text.split("\n\n"):
+            fields = {}
+            key = None
+            for line in stanza.splitlines():
+                if line[:1] in (" ", "\t"):
+                    # continuation of a multi-line field
+                    if key is not None:
+                        fields[key] += "\n" + line.strip()
+                    continue
+                key, _, value = line.partition(":")
+                fields[key] = value.strip()
+            if "Package" not in fields:
+                continue
+            entry = {"Version": fields.get("Version", "0"),
+                     "Depends": parse_relations(fields.get("Pre-Depends", "")) +
+                                parse_relations(fields.get("Depends", "")),
+                     "Filename": fields.get("Filename"),
+                     "Size": int(fields.get("Size", 0)),
+                     "MD5sum": fields.get("MD5sum"),
+                     "BaseUrl": base_url}
+            known = index.get(fields["Package"])
+            if known is None or compare_versions(entry["Version"], known["Version"]) > 0:
+                index[fields["Package"]] = entry
+    return index
+
+
+def resolve_index(index, roots, base_url=JETSON_REPO_URL):
+    # The offline counterpart of resolve_links: the same breadth first walk
+    # over an in-memory Packages index. The index carries no file lists, so
+    # entries have no 'libraries' and build.py downloads them all. Links are
+    # made from the BaseUrl of the index the package came from, base_url
+    # for indexes given without one.
+    output = {}
+    visited = set(roots)
+    level = sorted(visited)
+    while level:
+        found = set()
+        for library in level:
+            entry = index.get(library)
+            if entry is None or not entry["Filename"]:
+                output[library] = {'link':None,'name':None,'md5':None}
+                continue
+            root = entry.get("BaseUrl") or base_url
+            output[library] = {'link':root.rstrip("/") + "/" + entry["Filename"],
+                               'name':posixpath.basename(entry["Filename"]),
+                               'size':entry["Size"],
+                               'md5':entry["MD5sum"]}
+            found.update(x for x in entry["Depends"]
+                         if any(word in x for word in NVIDIA_WORDS))
+        level = sorted(found - visited)
+        visited.update(level)
     return output
 
 
+def recurse_links(library):
+    return resolve_links([library])
+
+
+def write_links(links, path):
+    with open(path,'w') as file:
+        file.write("# deb archives for CUDA 10.2 for Linux4Tegra \n")
+        file.write("# information assembled using apt-cache depends <package>\n")
+        file.write("# and apt-get install --reinstall --print-uris -qq <package> \n")
+        file.write("# libraries lists the shared libraries each package ships\n")
+        yaml.dump(links,file)
+
+
+def split_blocks(text):
+    # Splits a manifest into its leading comment header and the verbatim
+    # text of each top level package entry
+    header = []
+    blocks = {}
+    current = None
+    for line in text.splitlines(True):
+        if line[:1] not in (" ", "#", "\n", "") and ":" in line:
+            current = line.split(":", 1)[0]
+            blocks[current] = line
+        elif current is None:
+            header.append(line)
+        else:
+            blocks[current] += line
+    return "".join(header), blocks
+
+
+def write_refreshed(links, path, old_text):
+    # Rewrites the manifest keeping the text of every unchanged entry byte
+    # for byte, changed and new entries are dumped as write_links would
+    old = yaml.safe_load(old_text) or {}
+    header, blocks = split_blocks(old_text)
+    with open(path, 'w') as file:
+        file.write(header)
+        for package in sorted(links):
+            if package in blocks and old.get(package) == links[package]:
+                file.write(blocks[package])
+            else:
+                yaml.dump({package: links[package]}, file)
+
+
+def diff_links(old, new):
+    # Summarises what changed between two manifests and what it will cost
+    # to fetch again
+    size = lambda entry: entry.get('size') or 0
+    added = sorted(set(new) - set(old))
+    removed = sorted(set(old) - set(new))
+    changed = {}
+    for package in sorted(set(old) & set(new)):
+        fields = sorted(k for k in set(old[package]) | set(new[package])
+                        if old[package].get(k) != new[package].get(k))
+        if fields:
+            changed[package] = {k: [old[package].get(k), new[package].get(k)]
+                                for k in fields}
+    return {'added': added,
+            'removed': removed,
+            'changed': changed,
+            'bytes_delta': sum(size(x) for x in new.values()) -
+                           sum(size(x) for x in old.values()),
+            'bytes_to_fetch': sum(size(new[x]) for x in added) +
+                              sum(size(new[x]) for x in changed
+                                  if {'link', 'md5', 'size'} & set(changed[x]))}
+
+
+def main(args=None):
+    p = ArgumentParser("download_links")
+    p.add_argument("--output", default="l4t_cuda.yaml",
+                   help="manifest to write, default l4t_cuda.yaml")
+    p.add_argument("--root", default="nvidia-cuda",
+                   help="package whose dependencies are collected")
+    p.add_argument("--batch-size", type=int, default=32,
+                   help="packages per apt query")
+    p.add_argument("--workers", type=int, default=4,
+                   help="apt queries run concurrently")
+    p.add_argument("--packages-index", action="append", default=[],
+                   metavar="PATH[=BASE]",
+                   help="resolve offline from this apt Packages[.gz] file "
+                        "instead of querying apt, may be repeated; BASE is "
+                        "the repository root its Filename fields are "
+                        "relative to, e.g. %sjetson/t194/ for the t194 index"
+                        % JETSON_REPO_URL[:-len("jetson/common/")])
+    p.add_argument("--base-url", default=JETSON_REPO_URL,
+                   help="repository root of the indexes given without =BASE")
+    p.add_argument("--refresh", action="store_true",
+                   help="update the existing manifest in place, re-querying "
+                        "only changed packages, and print what changed")
+    ns = p.parse_args(args=args)
+
+    old_text = None
+    known = {}
+    if ns.refresh and os.path.exists(ns.output):
+        with open(ns.output) as f:
+            old_text = f.read()
+
+    if ns.packages_index:
+        index = parse_packages_index([split_index_arg(x)
+                                      for x in ns.packages_index])
+        links = resolve_index(index, [ns.root], ns.base_url)
+        if old_text is not None:
+            # the index has no file lists, carry them over where the deb
+            # itself did not change
+            old = yaml.safe_load(old_text) or {}
+            for package, entry in links.items():
+                previous = old.get(package, {})
+                if 'libraries' in previous and all(
+                        previous.get(k) == entry.get(k) for k in entry):
+                    entry['libraries'] = previous['libraries']
+    else:
+        if old_text is not None:
+            known = unchanged_entries(yaml.safe_load(old_text) or {},
+                                      batch_size=ns.batch_size,
+                                      workers=ns.workers)
+        links = resolve_links([ns.root], batch_size=ns.batch_size,
+                              workers=ns.workers, known=known)
+
+    if old_text is None:
+        write_links(links, ns.output)
+    else:
+        write_refreshed(links, ns.output, old_text)
+        print(yaml.dump(diff_links(yaml.safe_load(old_text) or {}, links),
+                        default_flow_style=False), end='')
 
 
-# This function takes a long time to search for all of the links
-with open(r'l4t_cuda.yaml','w') as file:
-    file.write("# deb archives for CUDA 10.2 for Linux4Tegra \n")
-    file.write("# information assembled using apt-cache depends <package>\n")
-    file.write("# and apt-get install --reinstall --print-uris -qq <package> \n")
-    yaml.dump(recurse_links("nvidia-cuda"),file)
+if __name__ == "__main__":
+    main()
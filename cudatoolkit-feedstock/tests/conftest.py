@@ -0,0 +1,5 @@
+import os
+import sys
+
+# build.py and the helper scripts are run from the feedstock directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
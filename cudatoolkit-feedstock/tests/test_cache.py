@@ -0,0 +1,68 @@
+import hashlib
+import os
+import stat
+
+import build
+
+
+def test_writes_to_a_fetched_file_do_not_reach_the_cache(tmp_path):
+    cache = build.ArtifactCache(str(tmp_path / 'cache'))
+    data = os.urandom(100000)
+    digest = hashlib.md5(data).hexdigest()
+    src = tmp_path / 'src.deb'
+    src.write_bytes(data)
+    entry = cache.store(str(src), digest)
+    assert not os.stat(entry).st_mode & (stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH)
+
+    # a download resumed or appended to in place after the store and fetch
+    with open(src, 'ab') as f:
+        f.write(b'more')
+    dst = tmp_path / 'dst.deb'
+    assert cache.fetch(digest, str(dst), size=len(data))
+    with open(dst, 'ab') as f:
+        f.write(b'more')
+    assert open(entry, 'rb').read() == data
+    build._digests.clear()
+    assert cache.fetch(digest, str(dst), size=len(data))
+    assert dst.read_bytes() == data
+
+
+def test_corrupt_entries_are_evicted(tmp_path):
+    cache = build.ArtifactCache(str(tmp_path / 'cache'))
+    data = os.urandom(100000)
+    digest = hashlib.md5(data).hexdigest()
+    src = tmp_path / 'src.deb'
+    src.write_bytes(data)
+    entry = cache.store(str(src), digest)
+    dst = tmp_path / 'dst.deb'
+    assert not cache.fetch(digest, str(dst), size=len(data) + 1)
+    assert not os.path.exists(entry) and not dst.exists()
+
+    entry = cache.store(str(src), digest)
+    os.chmod(entry, 0o644)
+    with open(entry, 'r+b') as f:
+        f.write(b'x')
+    build._digests.clear()
+    assert not cache.fetch(digest, str(dst))
+    assert not os.path.exists(entry)
+
+
+def test_later_builds_reuse_the_recorded_digests(tmp_path, monkeypatch):
+    root = str(tmp_path / 'cache')
+    cache = build.ArtifactCache(root)
+    data = os.urandom(100000)
+    digest = hashlib.md5(data).hexdigest()
+    src = tmp_path / 'src.deb'
+    src.write_bytes(data)
+    entry = cache.store(str(src), digest)
+    other = cache.store(str(src), '0' * 32)
+    os.remove(other)
+
+    # a new build, hashing nothing to fetch the entry
+    build._digests.clear()
+    cache = build.ArtifactCache(root)
+    assert build.md5_known(entry)
+    monkeypatch.setattr(build.hashlib, 'md5', None)
+    assert cache.fetch(digest, str(tmp_path / 'dst.deb'), size=len(data))
+    with open(os.path.join(root, build.ArtifactCache.DIGESTS)) as f:
+        assert [x.split()[4] for x in f] == [digest]
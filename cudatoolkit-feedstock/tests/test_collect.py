@@ -0,0 +1,56 @@
+import os
+
+import build
+
+
+def tree(root, files):
+    for relpath, data in files.items():
+        path = root / relpath
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data)
+
+
+def test_first_file_found_for_a_name_wins(tmp_path):
+    root = tmp_path / 'extracted'
+    tree(root, {
+        'a/cublas64_10.dll': b'first',
+        'a/cublas.lib': b'lib',
+        'a/libdevice.10.bc': b'bc',
+        'a/readme.txt': b'txt',
+        'jre/bin/cublas64_10.dll': b'jre',
+        'GFExperience.NvStreamSrv/x.dll': b'gfe',
+    })
+    seen = set()
+    found = build.collect_by_suffix(str(root), build.COLLECTED_SUFFIXES, seen,
+                                    build.SKIPPED_COMPONENTS)
+    assert sorted(name for name, _ in found) == [
+        'cublas.lib', 'cublas64_10.dll', 'libdevice.10.bc']
+    assert os.path.normcase('cublas64_10.dll') in seen
+
+    other = tmp_path / 'nvtoolsext'
+    tree(other, {'bin/x64/cublas64_10.dll': b'second',
+                 'bin/x64/nvToolsExt64_1.dll': b'nvtx'})
+    found += build.collect_by_suffix(str(other), ('.dll',), seen)
+    store = tmp_path / 'store'
+    store.mkdir()
+    build.store_files(found, str(store))
+    assert (store / 'cublas64_10.dll').read_bytes() == b'first'
+    assert (store / 'nvToolsExt64_1.dll').read_bytes() == b'nvtx'
+
+
+def test_symlinks_are_stored_as_the_files_they_point_to(tmp_path):
+    root = tmp_path / 'extracted'
+    tree(root, {'bin/cufft64_10.dll': b'cufft', 'lib/x64/plain.lib': b'lib'})
+    os.symlink('../bin/cufft64_10.dll', str(root / 'lib' / 'cufft.dll'))
+    os.symlink('x64', str(root / 'lib' / 'linked'))
+    found = build.collect_by_suffix(str(root), build.COLLECTED_SUFFIXES, set())
+    assert sorted(name for name, _ in found) == [
+        'cufft.dll', 'cufft64_10.dll', 'plain.lib']
+    store = tmp_path / 'store'
+    store.mkdir()
+    strategies = build.store_files(found, str(store), move=True)
+    assert strategies['copy'] == 1
+    assert not (store / 'cufft.dll').is_symlink()
+    assert (store / 'cufft.dll').read_bytes() == b'cufft'
+    assert (store / 'cufft64_10.dll').read_bytes() == b'cufft'
+    assert (store / 'plain.lib').read_bytes() == b'lib'
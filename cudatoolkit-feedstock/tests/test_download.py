@@ -0,0 +1,106 @@
+import hashlib
+import os
+import threading
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import benchmark
+import build
+
+
+@pytest.fixture
+def served(tmp_path):
+    # a file of random bytes on a local range capable server, as
+    # (url, data)
+    root = tmp_path / 'served'
+    root.mkdir()
+    data = os.urandom(1024 * 1024)
+    (root / 'blob.deb').write_bytes(data)
+    server, base_url = benchmark.serve(str(root))
+    yield base_url + 'blob.deb', data
+    server.shutdown()
+
+
+class NoRangeHandler(SimpleHTTPRequestHandler):
+    # always sends the whole file
+
+    def log_message(self, *args):
+        pass
+
+
+def test_download_resumes_a_partial_file(tmp_path, served):
+    url, data = served
+    dst = tmp_path / 'blob.deb'
+    dst.write_bytes(data[:300000])
+    counters = {}
+    assert build.download_from_url(url, str(dst), counters=counters) == len(data)
+    assert dst.read_bytes() == data
+    assert counters['bytes_downloaded'] == len(data) - 300000
+    assert counters['bytes_read'] == 300000
+    assert build.md5_known(str(dst))
+    assert build.md5(str(dst)) == hashlib.md5(data).hexdigest()
+
+
+def test_download_of_a_complete_file_fetches_nothing(tmp_path, served):
+    url, data = served
+    dst = tmp_path / 'blob.deb'
+    dst.write_bytes(data)
+    counters = {}
+    # the server answers the range past the end with a 416
+    assert build.download_from_url(url, str(dst), counters=counters) == len(data)
+    assert dst.read_bytes() == data
+    assert not counters.get('bytes_downloaded')
+
+
+def test_download_restarts_a_file_longer_than_the_remote_one(tmp_path, served):
+    url, data = served
+    dst = tmp_path / 'blob.deb'
+    dst.write_bytes(data + b'junk')
+    assert build.download_from_url(url, str(dst)) == len(data)
+    assert dst.read_bytes() == data
+
+
+def test_download_rewrites_the_file_when_the_range_is_ignored(tmp_path):
+    root = tmp_path / 'served'
+    root.mkdir()
+    data = os.urandom(1024 * 1024)
+    (root / 'blob.deb').write_bytes(data)
+    server = ThreadingHTTPServer(
+        ('127.0.0.1', 0), lambda *args: NoRangeHandler(*args, directory=str(root)))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        dst = tmp_path / 'blob.deb'
+        dst.write_bytes(data[:300000])
+        counters = {}
+        url = 'http://127.0.0.1:%d/blob.deb' % server.server_address[1]
+        assert build.download_from_url(url, str(dst), counters=counters) == len(data)
+    finally:
+        server.shutdown()
+    assert dst.read_bytes() == data
+    assert counters['bytes_downloaded'] == len(data)
+    assert build.md5(str(dst)) == hashlib.md5(data).hexdigest()
+
+
+def test_get_session_grows_its_pool(monkeypatch):
+    monkeypatch.setattr(build, '_session', None)
+    monkeypatch.setattr(build, '_session_pool_size', 0)
+    session = build.get_session()
+    assert session.get_adapter('http://host/')._pool_maxsize == 10
+    assert build.get_session(16) is session
+    assert session.get_adapter('http://host/')._pool_maxsize == 16
+    assert session.get_adapter('https://host/')._pool_maxsize == 16
+    build.get_session(4)
+    assert session.get_adapter('http://host/')._pool_maxsize == 16
+
+
+def test_download_segmented_records_the_md5(tmp_path, served, monkeypatch):
+    url, data = served
+    monkeypatch.setattr(build, 'MIN_SEGMENT_SIZE', 64 * 1024)
+    dst = str(tmp_path / 'blob.deb')
+    counters = {}
+    assert build.download_segmented(url, dst, segments=4, counters=counters) == len(data)
+    assert not os.path.exists(dst + '.segments')
+    assert build.md5_known(dst)
+    assert build.md5(dst) == hashlib.md5(data).hexdigest()
+    assert counters['bytes_read'] == len(data)
@@ -0,0 +1,168 @@
+import gzip
+import os
+from subprocess import CalledProcessError
+
+import yaml
+
+import download_links
+
+COMMON = """\
+Package: cuda-cudart-10-2
+Version: 10.2.89-1
+Filename: pool/main/c/cuda/cuda-cudart-10-2_10.2.89-1_arm64.deb
+Size: 100
+MD5sum: 11111111111111111111111111111111
+
+Package: cuda-cublas-10-2
+Version: 10.2.89-1
+Depends: cuda-cudart-10-2
+Filename: pool/main/c/cuda/cuda-cublas-10-2_10.2.89-1_arm64.deb
+Size: 200
+MD5sum: 22222222222222222222222222222222
+"""
+
+T194 = """\
+Package: nvidia-cuda
+Version: 4.4.1-b50
+Depends: cuda-cublas-10-2, cuda-cudart-10-2 (>= 10.2)
+Filename: pool/main/n/nvidia-cuda/nvidia-cuda_4.4.1-b50_arm64.deb
+Size: 300
+MD5sum: 33333333333333333333333333333333
+"""
+
+COMMON_URL = "https://repo.download.nvidia.com/jetson/common/"
+T194_URL = "https://repo.download.nvidia.com/jetson/t194/"
+
+
+def write_indexes(tmp_path):
+    common = tmp_path / "common_Packages.gz"
+    with gzip.open(common, "wt") as f:
+        f.write(COMMON)
+    t194 = tmp_path / "t194_Packages"
+    t194.write_text(T194)
+    return str(common), str(t194)
+
+
+def test_links_use_the_base_of_their_own_index(tmp_path):
+    common, t194 = write_indexes(tmp_path)
+    output = tmp_path / "l4t_cuda.yaml"
+    download_links.main(["--output", str(output),
+                         "--packages-index", common + "=" + COMMON_URL,
+                         "--packages-index", t194 + "=" + T194_URL])
+    links = yaml.safe_load(output.read_text())
+    assert links["nvidia-cuda"]["link"] == (
+        T194_URL + "pool/main/n/nvidia-cuda/nvidia-cuda_4.4.1-b50_arm64.deb")
+    assert links["cuda-cublas-10-2"]["link"] == (
+        COMMON_URL + "pool/main/c/cuda/cuda-cublas-10-2_10.2.89-1_arm64.deb")
+    assert links["cuda-cudart-10-2"]["md5"] == "1" * 32
+
+
+def test_indexes_without_a_base_use_base_url(tmp_path):
+    common, t194 = write_indexes(tmp_path)
+    index = download_links.parse_packages_index(
+        [download_links.split_index_arg(common),
+         download_links.split_index_arg(t194 + "=" + T194_URL)])
+    links = download_links.resolve_index(index, ["nvidia-cuda"],
+                                         "https://mirror.example/common")
+    assert links["nvidia-cuda"]["link"].startswith(T194_URL)
+    assert links["cuda-cudart-10-2"]["link"] == (
+        "https://mirror.example/common/"
+        "pool/main/c/cuda/cuda-cudart-10-2_10.2.89-1_arm64.deb")
+
+
+class FakeApt(object):
+    # answers the apt-get, apt-cache, dpkg-query and dpkg-deb calls of
+    # download_links from a dict of package -> (depends, files, installed),
+    # recording every call
+
+    def __init__(self, packages, conflicting=()):
+        self.packages = packages
+        self.conflicting = set(conflicting)
+        self.calls = []
+
+    def __call__(self, cmd, stderr=None, cwd=None):
+        self.calls.append(cmd)
+        if cmd[:2] == ["apt-get", "install"]:
+            names = cmd[5:]
+            if len(self.conflicting.intersection(names)) > 1 or \
+                    any(x not in self.packages for x in names):
+                raise CalledProcessError(100, cmd)
+            return "".join(
+                "'%s%s_1.0_arm64.deb' %s_1.0_arm64.deb %d MD5Sum:%s\n" % (
+                    COMMON_URL, x, x, len(x), x[:1] * 32) for x in names).encode()
+        if cmd[:2] == ["apt-cache", "depends"]:
+            out = ""
+            for name in cmd[2:]:
+                out += name + "\n"
+                for i, dep in enumerate(self.packages[name][0]):
+                    out += "  %sDepends: %s\n" % ("|" if i % 2 else "", dep)
+            return out.encode()
+        if cmd[0] == "dpkg-query":
+            depends, files, installed = self.packages[cmd[-1]]
+            if not installed:
+                raise CalledProcessError(1, cmd)
+            return "".join(x + "\n" for x in files).encode()
+        if cmd[:2] == ["apt-get", "download"]:
+            with open(os.path.join(cwd, cmd[-1] + "_1.0_arm64.deb"), "w"):
+                pass
+            return b""
+        if cmd[0] == "dpkg-deb":
+            name = os.path.basename(cmd[-1]).split("_")[0]
+            return "".join("-rw-r--r-- root/root 0 2020-01-01 00:00 .%s\n" % x
+                           for x in self.packages[name][1]).encode()
+        raise AssertionError("unexpected call %s" % cmd)
+
+
+LIB = "/usr/local/cuda-10.2/targets/aarch64-linux/lib/"
+
+GRAPH = {
+    "nvidia-cuda": (["cuda-runtime-10-2", "libc6"], [], True),
+    "cuda-runtime-10-2": (["cuda-cublas-10-2", "<cuda-cudart-10-2>"], [], True),
+    "cuda-cublas-10-2": (["cuda-cudart-10-2"],
+                         [LIB + "libcublas.so.10.2.2.89", LIB + "libcublas.so.10",
+                          "/usr/share/doc/cuda-cublas-10-2/copyright"], False),
+    "cuda-cudart-10-2": ([], [LIB + "libcudart.so.10.2.89"], True),
+    "libc6": ([], ["/lib/aarch64-linux-gnu/libc.so.6"], True),
+}
+
+
+def test_resolve_links_walks_the_nvidia_dependencies(tmp_path):
+    apt = FakeApt(GRAPH)
+    links = download_links.resolve_links(["nvidia-cuda"], run=apt, batch_size=1)
+    assert sorted(links) == ["cuda-cublas-10-2", "cuda-cudart-10-2",
+                             "cuda-runtime-10-2", "nvidia-cuda"]
+    assert links["cuda-cublas-10-2"] == {
+        "link": COMMON_URL + "cuda-cublas-10-2_1.0_arm64.deb",
+        "name": "cuda-cublas-10-2_1.0_arm64.deb", "size": 16, "md5": "c" * 32,
+        "libraries": ["libcublas.so.10", "libcublas.so.10.2.2.89"]}
+    assert links["cuda-cudart-10-2"]["libraries"] == ["libcudart.so.10.2.89"]
+    # every package is asked for once, libc6 not at all
+    depends = [x for call in apt.calls if call[:2] == ["apt-cache", "depends"]
+               for x in call[2:]]
+    assert sorted(depends) == sorted(links)
+    assert not any("libc6" in call for call in apt.calls)
+    # cublas is not installed, its deb is downloaded and listed
+    assert ["dpkg-deb", "--contents"] in [x[:2] for x in apt.calls]
+
+
+def test_resolve_links_asks_apt_one_by_one_when_a_batch_fails():
+    apt = FakeApt(GRAPH, conflicting=["cuda-cublas-10-2", "cuda-cudart-10-2"])
+    batched = download_links.resolve_links(["cuda-runtime-10-2"], run=apt)
+    assert batched == download_links.resolve_links(
+        ["cuda-runtime-10-2"], run=FakeApt(GRAPH), batch_size=1)
+    assert [x[5:] for x in apt.calls if x[:2] == ["apt-get", "install"]] == [
+        ["cuda-runtime-10-2"], ["cuda-cublas-10-2", "cuda-cudart-10-2"],
+        ["cuda-cublas-10-2"], ["cuda-cudart-10-2"]]
+
+
+def test_resolve_links_keeps_known_entries():
+    apt = FakeApt(GRAPH)
+    known = {"cuda-runtime-10-2": {"link": "kept", "name": "kept", "md5": "k",
+                                   "size": 1, "libraries": []}}
+    links = download_links.resolve_links(["cuda-runtime-10-2"], run=apt,
+                                         known=known)
+    assert links["cuda-runtime-10-2"] == known["cuda-runtime-10-2"]
+    assert links["cuda-cublas-10-2"]["link"].endswith("cuda-cublas-10-2_1.0_arm64.deb")
+    uris = [x for call in apt.calls if call[:2] == ["apt-get", "install"]
+            for x in call[5:]]
+    assert "cuda-runtime-10-2" not in uris
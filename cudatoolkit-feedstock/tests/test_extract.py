@@ -0,0 +1,67 @@
+import io
+import tarfile
+
+import pytest
+
+import build
+
+
+def data_tar(mode):
+    out = io.BytesIO()
+    with tarfile.open(fileobj=out, mode=mode) as t:
+        for name, data in [('./usr/lib/aarch64-linux-gnu/libcublas.so.10.2.2.89', b'cublas'),
+                           ('./usr/share/doc/changelog', b'doc')]:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            t.addfile(info, io.BytesIO(data))
+    return out.getvalue()
+
+
+def deb(path, data_name, data):
+    # an ar archive laid out like a deb
+    with open(path, 'wb') as f:
+        f.write(b'!<arch>\n')
+        for name, body in [('debian-binary', b'2.0\n'),
+                           ('control.tar.gz', data_tar('w:gz')),
+                           (data_name, data)]:
+            f.write(('%-16s%-12s%-6s%-6s%-8s%-10s`\n' % (
+                name, 0, 0, 0, 100644, len(body))).encode())
+            f.write(body + b'\n' * (len(body) % 2))
+
+
+@pytest.fixture
+def dpkg(monkeypatch):
+    calls = []
+    monkeypatch.setattr(build, 'dpkg_extract',
+                        lambda debfile, dest: calls.append(debfile) or dest)
+    return calls
+
+
+def test_extract_deb_streams_the_data_archive(tmp_path, dpkg):
+    path = str(tmp_path / 'cublas.deb')
+    deb(path, 'data.tar.xz', data_tar('w:xz'))
+    dest = tmp_path / 'out'
+    build.extract_deb(path, str(dest), ['libcublas.so*'])
+    assert (dest / 'usr/lib/aarch64-linux-gnu/libcublas.so.10.2.2.89').read_bytes() == b'cublas'
+    assert not (dest / 'usr/share').exists()
+    assert dpkg == []
+
+
+def test_extract_deb_falls_back_to_dpkg_for_an_unsupported_compression(tmp_path, dpkg):
+    path = str(tmp_path / 'cublas.deb')
+    deb(path, 'data.tar.lzma', b'lzma')
+    with pytest.raises(build.UnsupportedCompression):
+        build._open_tar_stream(io.BytesIO(b'lzma'), 'data.tar.lzma')
+    build.extract_deb(path, str(tmp_path / 'out'), ['libcublas.so*'])
+    assert dpkg == [path]
+
+
+def test_extract_deb_does_not_hide_a_not_implemented_error(tmp_path, dpkg, monkeypatch):
+    def stub(tar, dest, matcher):
+        raise NotImplementedError
+    monkeypatch.setattr(build, 'extract_tar_members', stub)
+    path = str(tmp_path / 'cublas.deb')
+    deb(path, 'data.tar.xz', data_tar('w:xz'))
+    with pytest.raises(NotImplementedError):
+        build.extract_deb(path, str(tmp_path / 'out'), ['libcublas.so*'])
+    assert dpkg == []
@@ -0,0 +1,29 @@
+import fnmatch
+import ntpath
+import os
+import types
+
+import build
+
+
+def test_find_resolves_globs_through_the_stem_buckets():
+    index = build.LibraryIndex({x: '/lib/' + x for x in [
+        'libcublas.so', 'libcublas.so.10', 'libcublas.so.10.2.2.89',
+        'libcublasLt.so.10', 'libcufft.so.10', 'libnppc.so.10']})
+    assert sorted(index.find('libcublas.so*')) == [
+        'libcublas.so', 'libcublas.so.10', 'libcublas.so.10.2.2.89']
+    assert sorted(index.find('libcu*.so.10')) == [
+        'libcublas.so.10', 'libcublasLt.so.10', 'libcufft.so.10']
+    assert index.find('libcurand.so*') == []
+
+
+def test_find_ignores_case_where_the_filesystem_does(monkeypatch):
+    # as on Windows, where fnmatch normcases both names and patterns
+    monkeypatch.setattr(os.path, 'normcase', ntpath.normcase)
+    monkeypatch.setattr(fnmatch, 'os', types.SimpleNamespace(path=ntpath))
+    index = build.LibraryIndex({x: 'C:\\bin\\' + x for x in [
+        'CUBLAS64_10.DLL', 'cufft64_10.dll', 'nvToolsExt64_1.dll']})
+    assert index.find('cublas64_10.dll') == ['CUBLAS64_10.DLL']
+    assert index.find('cublas64_*.dll') == ['CUBLAS64_10.DLL']
+    assert index.find('nvtoolsext64_*.dll') == ['nvToolsExt64_1.dll']
+    assert index['CUBLAS64_10.DLL'] == 'C:\\bin\\CUBLAS64_10.DLL'
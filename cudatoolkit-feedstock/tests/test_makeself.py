@@ -0,0 +1,171 @@
+import io
+import subprocess
+import tarfile
+
+import pytest
+
+import build
+
+PAYLOAD = b'payload'
+
+# header bodies of the makeself versions, {skip} is the header line count
+# (or the first payload line for 2.0) and {sizes} the payload sizes
+HEADER_20 = """\
+#!/bin/sh
+# This script was generated using Makeself 2.0.1
+CRCsum="0"
+MD5="00000000000000000000000000000000"
+TMPROOT=${{TMPDIR:=/tmp}}
+label="CUDA"
+filesizes="{sizes}"
+skip="{skip}"
+tail +$skip "$0" | gzip -cd | tar xf -
+exit 1
+"""
+
+HEADER_21 = """\
+#!/bin/sh
+# This script was generated using Makeself 2.1.4
+CRCsum="0"
+MD5="00000000000000000000000000000000"
+label="CUDA"
+filesizes="{sizes}"
+MS_Check()
+{{
+    offset=`head -n {skip} "$1" | wc -c | tr -d " "`
+}}
+offset=`head -n {skip} "$0" | wc -c | tr -d " "`
+exit 1
+"""
+
+HEADER_24 = """\
+#!/bin/sh
+# This script was generated using Makeself 2.4.0
+# The license covering this archive and its contents, if any, is wholly independent of the Makeself license (GPL)
+
+ORIG_UMASK=`umask`
+if test "n" = n; then
+    umask 077
+fi
+
+CRCsum="0"
+MD5="00000000000000000000000000000000"
+SHA="0000000000000000000000000000000000000000000000000000000000000000"
+TMPROOT=${{TMPDIR:=/tmp}}
+USER_PWD="$PWD"; export USER_PWD
+
+label="CUDA"
+script="./cuda-installer"
+scriptargs=""
+licensetxt=""
+helpheader=''
+targetdir="pkg"
+filesizes="{sizes}"
+keep="y"
+nooverwrite="n"
+quiet="n"
+accept="n"
+nodiskspace="n"
+export_conf="n"
+
+print_cmd_arg=""
+skip="{skip}"
+
+MS_Check()
+{{
+    offset=`head -n "$skip" "$1" | wc -c | tr -d " "`
+}}
+offset=`head -n "$skip" "$0" | wc -c | tr -d " "`
+exit 1
+"""
+
+HEADERS = {'2.0': HEADER_20, '2.1': HEADER_21, '2.4': HEADER_24}
+
+
+def makeself(version, payload):
+    # header lines followed by payload, with the header's own arithmetic
+    # pointing at the payload
+    template = HEADERS[version]
+    lines = template.count('\n')
+    skip = lines + 1 if version == '2.0' else lines
+    header = template.format(skip=skip, sizes=len(payload)).encode()
+    return header + payload
+
+
+def shell_offset(path, version):
+    # where the header's own shell commands find the payload
+    if version == '2.0':
+        cmd = 'skip=$(sed -n "s/^skip=\\"\\(.*\\)\\"/\\1/p" "$0"); ' \
+              'head -n $((skip - 1)) "$0" | wc -c'
+    elif version == '2.1':
+        cmd = 'eval "$(grep "^offset=" "$0")"; echo $offset'
+    else:
+        cmd = 'eval "$(grep "^skip=" "$0")"; ' \
+              'eval "$(grep "^offset=" "$0")"; echo $offset'
+    return int(subprocess.check_output(['sh', '-c', cmd, str(path)]))
+
+
+@pytest.mark.parametrize('version', sorted(HEADERS))
+def test_header_ends_where_the_script_finds_the_payload(tmp_path, version):
+    path = tmp_path / 'installer.run'
+    path.write_bytes(makeself(version, PAYLOAD))
+    with open(path, 'rb') as f:
+        assert build.read_makeself_header(f) == [len(PAYLOAD)]
+        assert f.tell() == shell_offset(path, version)
+        assert f.read() == PAYLOAD
+
+
+def test_not_a_makeself_archive():
+    with pytest.raises(ValueError):
+        build.read_makeself_header(io.BytesIO(b'\x7fELF\x02\x01'))
+    with pytest.raises(ValueError):
+        build.read_makeself_header(io.BytesIO(b'#!/bin/sh\necho hi\n'))
+
+
+def tar(entries, mode):
+    out = io.BytesIO()
+    with tarfile.open(fileobj=out, mode=mode) as t:
+        for name, data, link in entries:
+            info = tarfile.TarInfo(name)
+            if link is not None:
+                info.type = tarfile.SYMTYPE
+                info.linkname = link
+                t.addfile(info)
+            else:
+                info.size = len(data)
+                info.mode = 0o755
+                t.addfile(info, io.BytesIO(data))
+    return out.getvalue()
+
+
+@pytest.mark.parametrize('outer,inner', [('2.4', '2.1'), ('2.1', '2.4'),
+                                         ('2.4', '2.0')])
+def test_extract_runfile_streams_the_embedded_toolkit(tmp_path, outer, inner):
+    toolkit = tar([
+        ('./lib64', None, 'targets/x86_64-linux/lib'),
+        ('./targets/x86_64-linux/lib/libcublas.so.10.2.2.89', b'cublas', None),
+        ('./targets/x86_64-linux/lib/libcublas.so.10', None, 'libcublas.so.10.2.2.89'),
+        ('./targets/x86_64-linux/lib/libcufft.so.10', b'cufft', None),
+        ('./nvvm/lib64/libnvvm.so.3.3.0', b'nvvm', None),
+        ('./nvvm/libdevice/libdevice.10.bc', b'bc', None),
+        ('./bin/nvcc', b'nvcc', None),
+        ('./doc/libcublas.so.10', b'doc', None),
+    ], 'w:xz')
+    runfile = tmp_path / 'cuda.run'
+    runfile.write_bytes(makeself(outer, tar([
+        ('./run_files/NVIDIA-Linux-x86_64.run', b'driver', None),
+        ('./run_files/cuda-linux.run', makeself(inner, toolkit), None),
+    ], 'w:gz')))
+    dest = tmp_path / 'toolkit'
+    matcher = build.patterns_matcher(['libcublas.so*', 'libnvvm.so*',
+                                      'libdevice.10.bc'])
+    written = build.extract_runfile(str(runfile), str(dest), matcher,
+                                    'cuda-linux.run')
+    assert written == 5
+    lib = dest / 'lib64'
+    assert lib.is_symlink()
+    assert (lib / 'libcublas.so.10.2.2.89').read_bytes() == b'cublas'
+    assert (lib / 'libcublas.so.10').is_symlink()
+    assert not (lib / 'libcufft.so.10').exists()
+    assert (dest / 'nvvm' / 'libdevice' / 'libdevice.10.bc').read_bytes() == b'bc'
+    assert not (dest / 'bin').exists() and not (dest / 'doc').exists()
@@ -0,0 +1,177 @@
+import os
+import posixpath
+import signal
+import threading
+import time
+
+import pytest
+import yaml
+
+import benchmark
+import build
+
+_extract_archive = build.extract_archive
+
+
+def kill_second_archive(debfile, dest, patterns):
+    # stands in for extract_archive in the worker, dying on the second archive
+    if os.path.basename(dest).startswith('0001_'):
+        os.kill(os.getpid(), signal.SIGKILL)
+    return _extract_archive(debfile, dest, patterns)
+
+
+def slow_first_archive(debfile, dest, patterns):
+    # stands in for extract_archive in the worker, finishing the first
+    # archive after the others
+    if os.path.basename(dest).startswith('0000_'):
+        time.sleep(1)
+    return _extract_archive(debfile, dest, patterns)
+
+
+@pytest.fixture
+def manifest_path(tmp_path):
+    fixtures = tmp_path / 'fixtures'
+    (fixtures / 'debs').mkdir(parents=True)
+    server, base_url = benchmark.serve(str(fixtures / 'debs'))
+    manifest = benchmark.generate_fixtures(
+        str(fixtures), len(build.config['cuda_libraries']), 4096, 0, 0, 'gz',
+        base_url)
+    path = fixtures / 'l4t_cuda.yaml'
+    path.write_text(yaml.dump(manifest))
+    yield str(path)
+    server.shutdown()
+
+
+def test_pipeline_raises_when_an_extraction_worker_dies(tmp_path, manifest_path,
+                                                        monkeypatch):
+    monkeypatch.delenv('CUDATOOLKIT_CACHE_DIR', raising=False)
+    monkeypatch.setenv('CUDATOOLKIT_PIPELINE', '1')
+    monkeypatch.setenv('CUDATOOLKIT_EXTRACT_WORKERS', '1')
+    monkeypatch.setattr(build, 'extract_archive', kill_second_archive)
+    extractor = benchmark.new_extractor(str(tmp_path / 'work'), manifest_path)
+
+    raised = []
+
+    def run():
+        try:
+            extractor.run()
+        except Exception as e:
+            raised.append(e)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    thread.join(timeout=120)
+    assert not thread.is_alive(), 'run() hung after the worker died'
+    assert len(raised) == 1
+    assert isinstance(raised[0], RuntimeError)
+    assert 'archives failed' in str(raised[0])
+
+
+def add_dev_packages(manifest_path):
+    # a -dev deb per library, shipping only the unversioned .so link, listed
+    # in the manifest as the dpkg file lists record it
+    with open(manifest_path) as f:
+        manifest = yaml.safe_load(f)
+    debdir = os.path.join(os.path.dirname(manifest_path), 'debs')
+    base_url = next(iter(manifest.values()))['link'].rsplit('/', 1)[0] + '/'
+    for library in build.config['cuda_libraries']:
+        package = 'cuda-%s-dev-10-2' % library
+        name = '%s_%s-1_arm64.deb' % (package, benchmark.VERSION)
+        data = benchmark.tar_archive(
+            [('%s/lib%s.so' % (benchmark.LIBDIR, library), None,
+              'lib%s.so.10' % library),
+             ('usr/local/cuda-10.2/include/%s.h' % library, b'h' * 1000, None)],
+            'gz')
+        deb = benchmark.ar_archive([('debian-binary', b'2.0\n'),
+                                    ('data.tar.gz', data)])
+        with open(os.path.join(debdir, name), 'wb') as f:
+            f.write(deb)
+        manifest[package] = {'link': base_url + name, 'name': name,
+                             'size': len(deb),
+                             'md5': build.hashlib.md5(deb).hexdigest(),
+                             'libraries': ['lib%s.so' % library]}
+    with open(manifest_path, 'w') as f:
+        yaml.dump(manifest, f)
+    return manifest
+
+
+def test_dev_packages_are_skipped_and_their_links_recreated(tmp_path, manifest_path,
+                                                            monkeypatch):
+    monkeypatch.delenv('CUDATOOLKIT_CACHE_DIR', raising=False)
+    manifest = add_dev_packages(manifest_path)
+    extractor = benchmark.new_extractor(str(tmp_path / 'work'), manifest_path)
+    needed = extractor.load_sources()
+    assert needed and not any('-dev-' in x for x in needed)
+    assert len(needed) + len(extractor.reused) < len(manifest)
+
+    extractor.run()
+    archives = os.listdir(os.path.join(extractor.src_dir, 'deb_archives'))
+    assert not any('-dev-' in x for x in archives)
+    for library in build.config['cuda_libraries']:
+        link = os.path.join(extractor.output_dir, 'lib%s.so' % library)
+        assert os.readlink(link) == 'lib%s.so.10' % library
+        assert os.path.isfile(link)
+    installed = build.InstallManifest.load(
+        os.path.join(extractor.output_dir, build.INSTALL_MANIFEST))
+    assert installed.files['libcublas.so']['archive'].startswith('cuda-cublas-10-2_')
+
+
+def test_phased_rerun_keeps_the_unchanged_archives(tmp_path, manifest_path,
+                                                   monkeypatch, capsys):
+    monkeypatch.delenv('CUDATOOLKIT_CACHE_DIR', raising=False)
+    monkeypatch.setenv('CUDATOOLKIT_PIPELINE', '0')
+    benchmark.new_extractor(str(tmp_path / 'work'), manifest_path).run()
+    capsys.readouterr()
+
+    # the same $SRC_DIR and $PREFIX, with the archives still downloaded
+    extractor = build.DebExtractor('10.2', build.config, dict(
+        build.config['linux-aarch64'], blob=manifest_path))
+    extractor.run()
+    out = capsys.readouterr().out
+    assert out.count('keeping the installed files of') == 1
+    assert 'extracting 0 archives' in out
+    assert os.path.isfile(os.path.join(extractor.output_dir, 'libcublas.so.10'))
+
+
+def add_package(manifest_path, package, entries):
+    # a deb holding the tar entries, sorted after the generated ones
+    with open(manifest_path) as f:
+        manifest = yaml.safe_load(f)
+    debdir = os.path.join(os.path.dirname(manifest_path), 'debs')
+    base_url = next(iter(manifest.values()))['link'].rsplit('/', 1)[0] + '/'
+    name = '%s_%s-1_arm64.deb' % (package, benchmark.VERSION)
+    deb = benchmark.ar_archive([('debian-binary', b'2.0\n'),
+                                ('data.tar.gz', benchmark.tar_archive(entries, 'gz'))])
+    with open(os.path.join(debdir, name), 'wb') as f:
+        f.write(deb)
+    manifest[package] = {'link': base_url + name, 'name': name, 'size': len(deb),
+                         'md5': build.hashlib.md5(deb).hexdigest(),
+                         'libraries': [posixpath.basename(x[0]) for x in entries]}
+    with open(manifest_path, 'w') as f:
+        yaml.dump(manifest, f)
+    return name
+
+
+@pytest.mark.parametrize('pipeline', ['0', '1'])
+def test_later_archives_win_whatever_order_they_extract_in(tmp_path, manifest_path,
+                                                           monkeypatch, pipeline):
+    monkeypatch.delenv('CUDATOOLKIT_CACHE_DIR', raising=False)
+    monkeypatch.setenv('CUDATOOLKIT_PIPELINE', pipeline)
+    monkeypatch.setenv('CUDATOOLKIT_EXTRACT_WORKERS', '4')
+    monkeypatch.setattr(build, 'extract_archive', slow_first_archive)
+    concrete = 'libcublas.so.%s' % benchmark.VERSION
+    # as dpkg would, the last archive unpacked provides the file, and its
+    # link replaces a file of the same name
+    add_package(manifest_path, 'zz-cublas-update', [
+        ('%s/%s' % (benchmark.LIBDIR, concrete), b'update', None),
+        ('%s/libcublas.so.10' % benchmark.LIBDIR, None, concrete)])
+    extractor = benchmark.new_extractor(str(tmp_path / 'work'), manifest_path)
+    extractor.run()
+    with open(os.path.join(extractor.output_dir, concrete), 'rb') as f:
+        assert f.read() == b'update'
+    installed = build.InstallManifest.load(
+        os.path.join(extractor.output_dir, build.INSTALL_MANIFEST))
+    assert installed.files[concrete]['archive'].startswith('zz-cublas-update_')
+    assert installed.files['libcublas.so.10']['archive'].startswith('zz-cublas-update_')
+    with open(os.path.join(extractor.output_dir, 'libcufft.so.10'), 'rb') as f:
+        assert len(f.read()) == 4096
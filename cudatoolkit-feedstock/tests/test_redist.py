@@ -0,0 +1,104 @@
+import json
+
+import build
+
+PLATFORMS = ['linux-x86_64', 'linux-ppc64le', 'linux-sbsa', 'windows-x86_64']
+
+# the components of redistrib_11.4.4.json, by the platforms they ship for
+COMPONENTS = {
+    'cuda_cccl': PLATFORMS,
+    'cuda_cudart': PLATFORMS,
+    'cuda_cuobjdump': PLATFORMS,
+    'cuda_cupti': PLATFORMS,
+    'cuda_cuxxfilt': PLATFORMS,
+    'cuda_gdb': ['linux-x86_64', 'linux-ppc64le', 'linux-sbsa'],
+    'cuda_memcheck': ['linux-x86_64', 'linux-ppc64le', 'windows-x86_64'],
+    'cuda_nsight': ['linux-x86_64', 'linux-ppc64le'],
+    'cuda_nvcc': PLATFORMS,
+    'cuda_nvdisasm': PLATFORMS,
+    'cuda_nvml_dev': PLATFORMS,
+    'cuda_nvprof': ['linux-x86_64', 'linux-ppc64le', 'windows-x86_64'],
+    'cuda_nvprune': PLATFORMS,
+    'cuda_nvrtc': PLATFORMS,
+    'cuda_nvtx': PLATFORMS,
+    'cuda_nvvp': ['linux-x86_64', 'linux-ppc64le', 'windows-x86_64'],
+    'cuda_sanitizer_api': PLATFORMS,
+    'fabricmanager': ['linux-x86_64', 'linux-sbsa'],
+    'libcublas': PLATFORMS,
+    'libcufft': PLATFORMS,
+    'libcufile': ['linux-x86_64'],
+    'libcurand': PLATFORMS,
+    'libcusolver': PLATFORMS,
+    'libcusparse': PLATFORMS,
+    'libnpp': PLATFORMS,
+    'libnvjpeg': PLATFORMS,
+    'nsight_compute': PLATFORMS,
+    'nsight_nvtx': ['windows-x86_64'],
+    'nsight_systems': ['linux-x86_64', 'linux-ppc64le', 'linux-sbsa', 'windows-x86_64'],
+    'nsight_vse': ['windows-x86_64'],
+    'nvidia_driver': ['linux-x86_64', 'linux-ppc64le', 'linux-sbsa', 'windows-x86_64'],
+    'nvidia_fs': ['linux-x86_64'],
+    'visual_studio_integration': ['windows-x86_64'],
+}
+
+
+def redistrib():
+    # shaped like NVIDIA's redistrib json: release keys next to the
+    # components, sizes as strings, windows archives as zips
+    manifest = {'release_date': '2022-02-01',
+                'release_label': '11.4.4',
+                'release_product': 'cuda'}
+    for component, platforms in COMPONENTS.items():
+        entry = {'name': component.replace('_', ' '),
+                 'license': 'CUDA Toolkit',
+                 'version': '11.4.148'}
+        for plat in platforms:
+            ext = 'zip' if plat.startswith('windows') else 'tar.xz'
+            entry[plat] = {
+                'relative_path': '%s/%s/%s-%s-11.4.148-archive.%s' % (
+                    component, plat, component, plat, ext),
+                'sha256': '0' * 64,
+                'md5': '%032x' % len(component),
+                'size': '123456'}
+        manifest[component] = entry
+    return manifest
+
+
+def test_plan_components_on_a_real_shaped_manifest():
+    libraries = (build.config['cuda_libraries'] +
+                 build.config['cuda_static_libraries'] + ['nvvm', 'libdevice'])
+    needed, skipped, missing = build.plan_components(
+        redistrib(), 'linux-x86_64', libraries, build.config['redist']['redist_url'])
+    assert missing == ['nvgraph']
+    expected = {'cuda_cudart', 'cuda_nvcc', 'cuda_nvrtc', 'cuda_nvtx', 'libcublas',
+                'libcufft', 'libcurand', 'libcusolver', 'libcusparse', 'libnpp'}
+    if 'nvjpeg' in libraries:
+        expected.add('libnvjpeg')
+    assert set(needed) == expected
+    assert 'cuda_cupti' in skipped and 'nvidia_driver' in skipped
+    cublas = needed['libcublas']
+    assert cublas['link'] == ('https://developer.download.nvidia.com/compute/cuda/'
+                              'redist/libcublas/linux-x86_64/'
+                              'libcublas-linux-x86_64-11.4.148-archive.tar.xz')
+    assert cublas['name'] == 'libcublas-linux-x86_64-11.4.148-archive.tar.xz'
+    assert cublas['size'] == 123456
+
+
+def test_load_sources_drops_libraries_no_component_ships(tmp_path, monkeypatch,
+                                                         capsys):
+    path = tmp_path / 'redistrib_11.4.4.json'
+    path.write_text(json.dumps(redistrib(), indent=4))
+    monkeypatch.setenv('SRC_DIR', str(tmp_path / 'src'))
+    monkeypatch.setenv('PREFIX', str(tmp_path / 'prefix'))
+    (tmp_path / 'src').mkdir()
+    (tmp_path / 'prefix').mkdir()
+    monkeypatch.setattr(build.platform, 'machine', lambda: 'x86_64')
+    plt_config = dict(build.config['redist'], blob=str(path))
+    extractor = build.RedistExtractor('11.4', build.config, plt_config)
+    needed = extractor.load_sources()
+    assert 'nvgraph' not in extractor.cuda_libraries
+    assert 'nvgraph' not in extractor.config['cuda_libraries']
+    assert 'nvgraph' in build.config['cuda_libraries']
+    assert not any('nvgraph' in x for x in extractor.wanted_patterns())
+    assert 'libcublas' in needed
+    assert 'WARNING' in capsys.readouterr().out
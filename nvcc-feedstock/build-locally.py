@@ -4,9 +4,13 @@
 # locally.
 #
 import os
+import fnmatch
 import glob
+import shutil
 import subprocess
+import time
 from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
 
 
 def setup_environment(ns):
@@ -48,11 +52,154 @@ def verify_config(ns):
         )
 
 
+def config_names(patterns):
+    # expands config names, globs and .ci_support/*.yaml paths into the
+    # names of existing configs, in order and without duplicates
+    valid = sorted(
+        os.path.basename(f)[:-5] for f in glob.glob(".ci_support/*.yaml")
+    )
+    names = []
+    for pattern in patterns:
+        pattern = os.path.basename(pattern)
+        if pattern.endswith(".yaml"):
+            pattern = pattern[:-5]
+        matches = fnmatch.filter(valid, pattern)
+        if not matches:
+            raise ValueError("config " + pattern + " matches no configuration")
+        names += [m for m in matches if m not in names]
+    return names
+
+
+def run_batch(ns):
+    configs = config_names(ns.config)
+    for config in configs:
+        if not config.startswith("linux"):
+            raise ValueError(
+                f"batch mode only supports Linux configs, got {config}"
+            )
+    artifacts = os.path.join(os.getcwd(), "build_artifacts")
+    os.makedirs(artifacts, exist_ok=True)
+    env = dict(os.environ, UPLOAD_PACKAGES="False")
+    # docker run only asks for a terminal outside of CI, the builds run
+    # concurrently with their output going to log files
+    env.setdefault("CI", "local")
+    script = ".scripts/run_docker_build.sh"
+    with open(script) as f:
+        extra_run_args = "CONDA_FORGE_DOCKER_RUN_ARGS" in f.read()
+    run_args = [env.get("CONDA_FORGE_DOCKER_RUN_ARGS")]
+    if extra_run_args and not ns.no_shared_pkgs:
+        # every container downloads and extracts into the same package
+        # cache, below the feedstock root that is mounted in all of them
+        os.makedirs(os.path.join(artifacts, "pkgs_cache"), exist_ok=True)
+        run_args.append(
+            "-e CONDA_PKGS_DIRS=/home/conda/feedstock_root/"
+            "build_artifacts/pkgs_cache"
+        )
+    elif not extra_run_args:
+        # conda build indexes its output folder, builds sharing
+        # build_artifacts would race on it
+        print(f"{script} takes no extra docker arguments, "
+              "building one config at a time")
+        ns.jobs = 1
+    print(f"building {len(configs)} configs, {ns.jobs} at a time, "
+          f"artifacts in {artifacts}")
+
+    def build(config):
+        log = os.path.join(artifacts, f"build-locally-{config}.log")
+        config_env = dict(env, CONFIG=config)
+        if extra_run_args:
+            # each build gets its own conda-build root, and so its own
+            # output folder, merged into build_artifacts afterwards
+            config_env["CONDA_FORGE_DOCKER_RUN_ARGS"] = " ".join(
+                x
+                for x in run_args + [
+                    "-e CONDA_BLD_PATH=/home/conda/feedstock_root/"
+                    f"build_artifacts/{config}"
+                ]
+                if x
+            )
+        start = time.monotonic()
+        print(f"started {config}, logging to {log}")
+        with open(log, "w") as f:
+            returncode = subprocess.call(
+                [script], env=config_env,
+                stdout=f, stderr=subprocess.STDOUT,
+            )
+        seconds = time.monotonic() - start
+        print(f"{'finished' if returncode == 0 else 'FAILED'} {config} "
+              f"in {seconds:.0f}s")
+        return returncode, seconds
+
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=ns.jobs) as pool:
+        results = list(pool.map(build, configs))
+    if extra_run_args:
+        merge_artifacts(
+            artifacts,
+            [c for c, (returncode, _) in zip(configs, results)
+             if returncode == 0],
+        )
+    width = max(len(c) for c in configs)
+    print(f"\n{'config':<{width}}  status     time")
+    for config, (returncode, seconds) in zip(configs, results):
+        status = "ok" if returncode == 0 else f"failed({returncode})"
+        print(f"{config:<{width}}  {status:<9} {seconds:5.0f}s")
+    print(f"{'total':<{width}}  {'':<9} {time.monotonic() - start:5.0f}s")
+    if any(returncode for returncode, _ in results):
+        raise SystemExit(1)
+
+
+def merge_artifacts(artifacts, configs):
+    # copies the packages of each config's build root into the subdirs
+    # of build_artifacts and indexes it once
+    merged = 0
+    for config in configs:
+        for path in glob.glob(os.path.join(artifacts, config, "*", "*")):
+            if not path.endswith((".tar.bz2", ".conda")):
+                continue
+            subdir = os.path.basename(os.path.dirname(path))
+            os.makedirs(os.path.join(artifacts, subdir), exist_ok=True)
+            shutil.copy2(path, os.path.join(artifacts, subdir))
+            merged += 1
+    if not merged:
+        return
+    # the host only has conda-build's index command if it has conda-build
+    if not shutil.which("conda") or subprocess.call(
+        ["conda", "index", artifacts],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    ):
+        print(f"merged {merged} packages into {artifacts}, "
+              f"run `conda index {artifacts}` to use it as a channel")
+
+
 def main(args=None):
     p = ArgumentParser("build-locally")
-    p.add_argument("config", default=None, nargs="?")
+    p.add_argument(
+        "config",
+        nargs="*",
+        help="config to build; several configs or a glob build them all "
+        "in batch mode",
+    )
+    p.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="configs built at once in batch mode",
+    )
+    p.add_argument(
+        "--no-shared-pkgs",
+        action="store_true",
+        help="in batch mode, do not share one package cache between builds",
+    )
 
     ns = p.parse_args(args=args)
+    if len(ns.config) > 1 or any(
+        c in x for x in ns.config for c in "*?["
+    ):
+        run_batch(ns)
+        return
+    ns.config = ns.config[0] if ns.config else None
     verify_config(ns)
     setup_environment(ns)
 
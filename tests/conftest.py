@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the build scripts at the top of the repository are run from there
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
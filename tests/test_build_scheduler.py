@@ -0,0 +1,94 @@
+import os
+import subprocess
+import sys
+import threading
+
+import build_scheduler
+from build_scheduler import Job, Scheduler
+
+G = 1 << 30
+
+
+def job(name, rss, seconds):
+    return Job(name, None, None, int(rss * G), seconds)
+
+
+def test_jobs_start_longest_first_within_the_budget():
+    scheduler = Scheduler([job('small%d' % i, 1, 10) for i in range(4)] +
+                          [job('sort.cu', 8, 100)], 10 * G, 8)
+    started = scheduler.ready(0, [])
+    assert [x.name for x in started] == ['sort.cu', 'small0', 'small1']
+    assert [x.name for x in scheduler.pending] == ['small2', 'small3']
+
+
+def test_running_jobs_are_charged_what_they_are_given():
+    scheduler = Scheduler([job('a', 1, 10), job('b', 1, 10)], 10 * G, 8)
+    # estimated at 1G, but grown to 9G while it runs
+    running = [(job('grown', 1, 10), 9 * G, 0)]
+    assert [x.name for x in scheduler.ready(0, running)] == ['a']
+    assert [x.name for x in scheduler.ready(0, running + [(job('a', 1, 10), G, 0)])] == []
+
+
+def test_a_job_larger_than_the_budget_runs_alone():
+    scheduler = Scheduler([job('huge', 20, 100), job('small', 1, 10)], 10 * G, 8)
+    assert [x.name for x in scheduler.ready(0, [(job('x', 1, 5), G, 0)])] == ['small']
+    assert [x.name for x in scheduler.ready(5, [(job('small', 1, 10), G, 5)])] == []
+    assert [x.name for x in scheduler.ready(15, [])] == ['huge']
+
+
+def test_only_jobs_done_before_a_blocked_one_fits_jump_ahead():
+    # heavy needs 6G and waits for 'running' to finish at t=100
+    scheduler = Scheduler([job('heavy', 6, 300), job('long', 1, 200),
+                           job('short', 1, 50)], 10 * G, 8)
+    running = [(job('running', 5, 100), 5 * G, 0)]
+    assert [x.name for x in scheduler.ready(0, running)] == ['short']
+    assert [x.name for x in scheduler.pending] == ['heavy', 'long']
+
+
+def test_the_worker_limit_holds():
+    scheduler = Scheduler([job('u%d' % i, 0.1, 10) for i in range(10)], 10 * G, 3)
+    assert len(scheduler.ready(0, [])) == 3
+
+
+def test_simulated_peak_stays_within_the_budget():
+    jobs = build_scheduler.synthetic_jobs(300, 0)
+    budget = 16 * G
+    makespan, peak = build_scheduler.simulate(Scheduler(list(jobs), budget, 8))
+    assert peak <= budget
+    # like make -j8, with no budget
+    fixed, fixed_peak = build_scheduler.simulate(
+        Scheduler(list(jobs), None, 8, order='fifo'))
+    assert fixed_peak > budget
+    assert makespan > 0 and fixed > 0
+
+
+def test_the_server_admits_launchers_within_the_budget(tmp_path):
+    db = build_scheduler.RssDatabase(str(tmp_path / 'rss.json'))
+    # two 1G units do not fit a 1.5G budget together
+    server = build_scheduler.BudgetServer(
+        str(tmp_path / 'budget.sock'), Scheduler([], int(1.5 * G), 4), db,
+        G, 1.0, 1.1, poll=0.05)
+    threads = [threading.Thread(target=server.serve_forever, daemon=True),
+               threading.Thread(target=server.dispatch, daemon=True)]
+    [x.start() for x in threads]
+    compiler = ('import sys, time\n'
+                'open(sys.argv[1] + ".start", "w").write(repr(time.time()))\n'
+                'time.sleep(0.5)\n'
+                'open(sys.argv[1] + ".end", "w").write(repr(time.time()))\n')
+    env = dict(os.environ, **{build_scheduler.SOCKET_ENV: server.server_address})
+    try:
+        launchers = [subprocess.Popen(
+            [sys.executable, build_scheduler.__file__, 'launch', sys.executable,
+             '-c', compiler, str(tmp_path / name)], env=env)
+            for name in ('a.cu', 'b.cu')]
+        assert [x.wait(timeout=60) for x in launchers] == [0, 0]
+    finally:
+        server.stop()
+
+    def read(name):
+        return float((tmp_path / name).read_text())
+    first, second = sorted(['a.cu', 'b.cu'], key=lambda x: read(x + '.start'))
+    assert read(second + '.start') >= read(first + '.end')
+    assert sorted(db.entries) == [str(tmp_path / 'a.cu'), str(tmp_path / 'b.cu')]
+    assert all(x['rss'] > 0 for x in db.entries.values())
+    assert server.running == {} and server.scheduler.pending == []